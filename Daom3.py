@@ -1,23 +1,206 @@
-from flask import Flask, request, jsonify
-import requests
-import json
+import asyncio
+import contextlib
+import functools
+import hmac
+import os
+import threading
 import time
 
-app = Flask(__name__)
+from flask import Blueprint, Flask, Response, request, jsonify
+import Daom_Client as notion
+from Daom_Async import LOCK_POLL, FanOutEngine
+from Daom_Block import Block, iter_blocks
+from Daom_Cache import LRUCache, SharedCache, TTLCache
+from Daom_Client import PaginationError, iter_database_pages, iter_property_items
+from Daom_Index import resolve_database_id
+from Daom_Jobs import Coalescer, JobQueue
+from Daom_Log import get_logger, lazy_json
+from Daom_Metrics import metrics
+from Daom_State import SyncedRefIndex
+
+bp = Blueprint("daom3", __name__)
+log = get_logger("daom3")
 
 # ========== Notion 配置 ==========
 NOTION_API_KEY = "YOU KEY"
 MAPPING_DATABASE_ID = "MAPPING ID"  # 请替换为实际 Button Mapping 数据库ID
+MAPPING_DATABASE_NAME = ""  # 非空时按名称从本地工作区索引解析数据库ID（先运行 Search DatabaseID.py 建立索引）
 HEADERS = {
     "Authorization": f"Bearer {NOTION_API_KEY}",
     "Content-Type": "application/json",
     "Notion-Version": "2022-06-28"
 }
+if MAPPING_DATABASE_NAME:
+    MAPPING_DATABASE_ID = resolve_database_id(MAPPING_DATABASE_NAME) or MAPPING_DATABASE_ID
+
+# ========== 后台任务队列配置 ==========
+JOB_WORKERS = 4        # 并发处理 Webhook 的工作线程数
+JOB_QUEUE_SIZE = 100   # 队列上限，超出时 Webhook 返回 503
+COALESCE_WINDOW = 2.0      # 秒；同一 A 页面的事件在此窗口内合并为一次处理（0 表示不合并）
+COALESCE_MAX_WAIT = 10.0   # 秒；持续收到事件时，最多等待这么久就处理一次
+COALESCE_MAX_PENDING = 1000  # 同时处于合并窗口中的 A 页面数上限，超出时 Webhook 返回 503
+
+# ========== Button Mapping 缓存配置 ==========
+MAPPING_CACHE_TTL = 300  # 秒；过期后先返回旧数据并在后台刷新
+ADMIN_TOKEN = ""         # 管理接口（/admin/*）需在 X-Admin-Token 头中携带该值；为空时管理接口全部拒绝
+
+# ========== 同步块引用索引 ==========
+REF_INDEX_FILE = "daom_synced_refs.sqlite3"  # 记录每个 B 页面已引用的原始同步块，重复事件不再重复追加
+ORIGIN_CACHE_SIZE = 1024  # 同步块 -> 原始块 的 LRU 缓存条目数
+RELATION_CACHE_SIZE = 256  # (页面, relation 属性, last_edited_time) -> 完整关联列表 的 LRU 缓存条目数
 
-@app.route("/notion-webhook", methods=["POST"])
+# ========== 同步块分发 ==========
+FANOUT_ASYNC = True     # 多个 B 页面的追加请求通过 asyncio 并发发出（False 时逐个页面顺序执行）
+FANOUT_CONCURRENCY = 8  # 同时写入的 B 页面数上限（所有任务共享；请求速率仍受 Daom_Client 令牌桶限制）
+MARKER_CACHE_SIZE = 256    # (A 页面, last_edited_time, markers) -> marker 索引 的 LRU 缓存条目数
+
+# ========== 多进程部署（gunicorn -c gunicorn.conf.py wsgi:app） ==========
+# 多个 worker 进程共享的缓存文件（SQLite WAL）：Button Mapping、marker 索引、同步块原始块、完整 relation 列表、任务记录。
+# 为空时只使用进程内缓存（单进程运行时足够）
+SHARED_CACHE_FILE = "daom_shared_cache.sqlite3"
+SHARED_CACHE_TTL = 86400  # 秒；共享缓存中 LRU 条目的过期时间（键中已包含 last_edited_time，只用于回收空间）
+SHARED_CACHE_PURGE_INTERVAL = 300  # 秒；各 worker 定期删除共享缓存中已过期的条目（否则文件会一直增长）
+STATS_PUBLISH_INTERVAL = 15  # 秒；各 worker 将指标与队列统计写入共享缓存的间隔，/metrics 与 /jobs 汇总所有 worker
+# B 页面跨进程租约的有效期：不短于单次 Notion 调用的最坏耗时（每次尝试最多 REQUEST_TIMEOUT 秒，
+# 重试之间最多等待 BACKOFF_MAX 秒），每发出一批追加请求前续期
+PAGE_LEASE_TTL = ((notion.MAX_RETRIES + 1) * notion.REQUEST_TIMEOUT + notion.MAX_RETRIES * notion.BACKOFF_MAX) + 60
+
+shared_cache = SharedCache(SHARED_CACHE_FILE) if SHARED_CACHE_FILE else None
+
+@bp.route("/notion-webhook", methods=["POST"])
+@metrics.timed("notion_webhook")
 def notion_webhook():
     """
-    Webhook 入口：
+    Webhook 入口：只校验 payload 并将任务放入后台队列，立即返回 202。
+    实际的映射处理与同步由 process_webhook() 在工作线程中完成。
+    """
+    data = request.get_json(silent=True)
+    log.debug("🔍 Webhook payload", payload=lazy_json(data))
+
+    if not isinstance(data, dict) or not isinstance(data.get("data"), dict):
+        return jsonify({"error": "Webhook payload 格式错误"}), 400
+    source_page_id = data["data"].get("id")
+    if not source_page_id:
+        return jsonify({"error": "未找到 A 页面 ID"}), 400
+    log.info("✅ 收到 Notion Webhook 请求", page_id=source_page_id, type=data.get("type"))
+
+    # Button Mapping 数据库自身的变更：只刷新映射缓存
+    if is_mapping_database_event(data):
+        mapping_cache.invalidate()
+        return jsonify({"status": "mapping_cache_invalidated"})
+
+    # 同一 A 页面短时间内的多个事件合并为一次处理
+    job_id = coalescer.add(source_page_id, data, page_id=source_page_id)
+    if not job_id:
+        return jsonify({"error": "任务队列已满，请稍后重试"}), 503
+    return jsonify({"status": "accepted", "job_id": job_id}), 202
+
+@bp.route("/jobs", methods=["GET"])
+def jobs_stats():
+    """ 后台队列深度、任务耗时与事件合并统计（本 worker）；workers 中为各 worker 最近一次发布的统计 """
+    stats = dict(job_queue.stats(), coalescer=coalescer.stats(), worker=os.getpid())
+    if shared_cache is not None:
+        publish_worker_stats()
+        stats["workers"] = {key.split(":", 2)[2]: value for key, value in shared_cache.items("stats:jobs:").items()}
+    return jsonify(stats)
+
+@bp.route("/jobs/<job_id>", methods=["GET"])
+def job_detail(job_id):
+    """ 查询单个后台任务的状态与耗时 """
+    record = job_queue.get(job_id)
+    if not record:
+        return jsonify({"error": "任务不存在"}), 404
+    return jsonify(record)
+
+def admin_only(view):
+    """ 管理接口鉴权：未配置 ADMIN_TOKEN 时一律拒绝（服务默认监听 0.0.0.0），否则校验 X-Admin-Token 头 """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"error": "管理接口未启用，请先配置 ADMIN_TOKEN"}), 403
+        if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+            return jsonify({"error": "未授权"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@bp.route("/admin/mapping-cache/invalidate", methods=["POST"])
+@admin_only
+def invalidate_mapping_cache():
+    """ 管理接口：强制刷新 Button Mapping 缓存 """
+    mapping_cache.invalidate()
+    return jsonify({"status": "invalidated", "cache": mapping_cache.stats()})
+
+@bp.route("/admin/fanout", methods=["GET"])
+@admin_only
+def fanout_stats():
+    """ 扇出执行器状态：传输方式（aiohttp / threads）、并发上限、正在写入的 B 页面数 """
+    return jsonify(fanout_engine.stats())
+
+@bp.route("/admin/mapping-cache", methods=["GET"])
+@admin_only
+def mapping_cache_stats():
+    return jsonify(mapping_cache.stats())
+
+@bp.route("/admin/ref-index/<page_id>/rescan", methods=["POST"])
+@admin_only
+def rescan_ref_index(page_id):
+    """ 管理接口：B 页面被手动修改后，丢弃其引用索引，下次同步时重新扫描 """
+    ref_index.forget_page(page_id)
+    return jsonify({"status": "forgotten", "page_id": page_id})
+
+@bp.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Prometheus 指标：各接口请求数 / 错误 / 429 / 耗时直方图、限速器等待、整体操作耗时、队列状态。
+    多 worker 部署时输出所有 worker 快照的汇总（各 worker 每 STATS_PUBLISH_INTERVAL 秒发布一次，本 worker 即时发布），
+    不论请求落到哪个 worker 结果都相同；worker 重启后其计数归零，Prometheus 的 rate() 会按计数器重置处理。
+    """
+    if shared_cache is None:
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+    publish_worker_stats()
+    snapshots = list(shared_cache.items("stats:metrics:").values())
+    return Response(metrics.render(snapshots), mimetype="text/plain; version=0.0.4")
+
+def publish_worker_stats():
+    """ 将本 worker 的指标快照与队列统计写入共享缓存（worker 退出后 3 个发布周期内过期） """
+    ttl = STATS_PUBLISH_INTERVAL * 3
+    pid = os.getpid()
+    queue_stats = dict(job_queue.stats(), coalescer=coalescer.stats())
+    queue_stats.pop("recent")
+    shared_cache.set(f"stats:metrics:{pid}", metrics.snapshot(), ttl=ttl)
+    shared_cache.set(f"stats:jobs:{pid}", queue_stats, ttl=ttl)
+
+def run_stats_publisher():
+    """ 后台线程：定期发布本 worker 的统计，并清除共享缓存中已过期的条目 """
+    last_purge = time.monotonic()
+    while True:
+        time.sleep(STATS_PUBLISH_INTERVAL)
+        try:
+            publish_worker_stats()
+        except Exception as e:
+            log.warning("⚠️ 发布 worker 统计失败", error=repr(e))
+        if time.monotonic() - last_purge < SHARED_CACHE_PURGE_INTERVAL:
+            continue
+        last_purge = time.monotonic()
+        try:
+            purged = shared_cache.purge()
+        except Exception as e:
+            log.warning("⚠️ 清除共享缓存过期条目失败", error=repr(e))
+            continue
+        if purged:
+            log.info("🧹 已清除共享缓存过期条目", count=purged)
+
+def is_mapping_database_event(data):
+    """ 判断 Webhook 是否来自 Button Mapping 数据库中的页面 """
+    parent = data["data"].get("parent") or {}
+    parent_db = (parent.get("database_id") or "").replace("-", "")
+    return bool(parent_db) and parent_db == MAPPING_DATABASE_ID.replace("-", "")
+
+# ========== 后台任务：处理 Webhook ==========
+@metrics.timed("process_webhook")
+def process_webhook(data):
+    """
+    后台执行 Webhook 任务：
       - 从 Webhook 数据中获取 A 页面 ID 以及 properties
       - 读取 Button Mapping 数据库中的映射数据，每行包含：
             * Name：关键词（如 "%Fiary", "%Collection"）
@@ -25,60 +208,136 @@ def notion_webhook():
       - 对于每个映射，只有当 A 页面的 properties 中存在对应 Relation 且关联数据不为空时才处理：
             * 从 webhook payload 的 properties 中获取 B 页面 ID 列表
             * 在 A 页面中查找 marker 后的同步块（如果存在则返回该同步块 ID；如果 marker 存在但后面没有同步块，则尝试在页面底部创建新的同步块；如果页面中完全没有 marker，则跳过）
-            * 将该同步块复制到所有对应的 B 页面中
+            * 按 B 页面汇总所有映射的同步块，每个 B 页面只发一次追加请求（按映射顺序），不同 B 页面并发写入
+    返回处理摘要，记录在任务结果中：同步块计数，以及 targets 中成功 / 失败 / 发生过重试的 B 页面。
     """
-    data = request.json
-    print(f"✅ 收到 Notion Webhook 请求: {json.dumps(data, indent=2)}")
-
-    source_page_id = data.get("data", {}).get("id")
-    if not source_page_id:
-        return jsonify({"error": "未找到 A 页面 ID"}), 400
+    source_page_id = data["data"]["id"]
 
     # 从 webhook payload 中获取 A 页面的 properties
-    source_props = data.get("data", {}).get("properties", {})
+    source_props = data["data"].get("properties", {})
+    last_edited_time = data["data"].get("last_edited_time")
 
-    # 读取 Button Mapping 数据库（使用 API 查询）
-    mapping_rows = get_button_mapping_rows(MAPPING_DATABASE_ID)
+    # 读取 Button Mapping（进程内缓存，过期后后台刷新）
+    mapping_rows = mapping_cache.get()
     if not mapping_rows:
-        return jsonify({"error": "Button Mapping 数据库为空"}), 400
+        log.warning("⚠️ Button Mapping 数据库为空，跳过", page_id=source_page_id)
+        return {"status": "skipped", "reason": "Button Mapping 数据库为空"}
 
+    # 先根据 webhook payload 筛选出需要处理的映射
+    active = []
     for mapping in mapping_rows:
         marker = mapping["Name"]         # 如 "%Fiary" 或 "%Collection"
         relation_prop = mapping["Relation"] # 如 "Fiarybase" 或 "Collection Home"
-        print(f"=== 处理映射：关键词: {marker}, Relation: {relation_prop} ===")
+        log.debug("=== 处理映射", marker=marker, relation=relation_prop)
 
         # 仅使用 webhook payload 中的数据来判断是否触发该映射
-        b_page_ids = get_b_pages_from_property_from_webhook(source_props, relation_prop)
+        b_page_ids = get_b_pages_from_property_from_webhook(source_props, relation_prop, source_page_id, last_edited_time)
         if not b_page_ids:
-            print(f"⚠️ Webhook中 A 页面属性 {relation_prop} 无关联 B 页面，跳过")
+            log.debug("⏭️ A 页面属性无关联 B 页面，跳过", marker=marker, relation=relation_prop)
             continue
+        active.append((marker, b_page_ids))
+    if not active:
+        return {"status": "success", "page_id": source_page_id, "synced": 0, "skipped": 0, "failed": 0,
+                "targets": summarize_targets({})}
+
+    # A 页面的 Blocks 只遍历一次，并一次性为所有 marker 建立索引（全部找到后不再拉取后续分页）
+    markers = [marker for marker, _ in active]
+    marker_key = (source_page_id, last_edited_time, tuple(sorted(markers)))
+    cached = marker_cache.get(marker_key) if last_edited_time else None
+    if cached is not None:
+        marker_index = load_marker_index(cached)
+    else:
+        log.debug("🔍 获取 A 页面的 Blocks", page_id=source_page_id, markers=len(active))
+        blocks = iter_blocks(source_page_id, HEADERS)
+        marker_index = build_marker_index(blocks, markers)
+        # 只缓存每个 marker 后都已有同步块的索引；否则本次处理会修改 A 页面，索引随即过期
+        if last_edited_time and len(marker_index) == len(markers) and all(
+                e["sync_block_id"] for e in marker_index.values()):
+            marker_cache.set(marker_key, dump_marker_index(marker_index))
 
+    counts = {"synced": 0, "skipped": 0, "failed": 0}
+    plan = {}  # B 页面 ID -> [原始同步块 ID]，按映射顺序
+    for marker, b_page_ids in active:
         # 查找 A 页面中 marker 后的同步块
-        sync_block_id = find_synced_block_after_marker(source_page_id, marker)
-        if sync_block_id == "marker_not_found":
-            print(f"⚠️ A 页面中完全未找到 marker {marker}，跳过此映射")
+        if marker not in marker_index:
+            log.warning("⚠️ A 页面中未找到 marker，跳过此映射", page_id=source_page_id, marker=marker)
             continue
+        entry = marker_index[marker]
+        sync_block_id, sync_block = entry["sync_block_id"], entry["sync_block"]
+        log.debug("✅ 找到 marker", marker=marker, position=entry["position"])
         if not sync_block_id:
-            print(f"⚠️ 找到 marker {marker} 但后面无同步块，尝试在页面底部创建新的同步块...")
-            sync_block_id = create_synced_block_at_bottom(source_page_id, marker)
-            if not sync_block_id:
-                print("❌ 创建同步块失败，跳过此映射")
+            log.info("⚠️ marker 后无同步块，在 marker 后创建", page_id=source_page_id, marker=marker)
+            sync_block = create_synced_block_after_marker(source_page_id, entry["marker_block_id"])
+            if not sync_block:
+                log.error("❌ 创建同步块失败，跳过此映射", page_id=source_page_id, marker=marker)
                 continue
+            sync_block_id = sync_block.id
+            entry.update(sync_block_id=sync_block_id, sync_block=sync_block)
 
+        # 每个同步块只解析一次原始块
+        original_block_id = resolve_synced_origin(sync_block_id, sync_block)
+        if not original_block_id:
+            counts["failed"] += len(b_page_ids)
+            continue
+        # 先规划：按 B 页面汇总要写入的原始块（保持映射顺序，同一原始块只写一次）
         for b_page_id in b_page_ids:
-            print(f"🚀 将 A 页面同步块 {sync_block_id} 复制到 B 页面 {b_page_id}")
-            copy_synced_block_content(sync_block_id, b_page_id)
+            planned = plan.setdefault(b_page_id, [])
+            if original_block_id in planned:
+                counts["skipped"] += 1
+            else:
+                planned.append(original_block_id)
 
-    return jsonify({"status": "success"})
+    # 再执行：每个 B 页面只发一次追加请求，携带该页面的全部同步块
+    outcomes = distribute_synced_blocks(plan)
+    for outcome in outcomes.values():
+        for status, count in outcome["blocks"].items():
+            counts[status] += count
+    targets = summarize_targets(outcomes)
+
+    log.info("🏁 Webhook 处理完成", page_id=source_page_id, targets=len(outcomes),
+             failed_targets=len(targets["failed"]), retried_targets=len(targets["retried"]), **counts)
+    return dict({"status": "success", "page_id": source_page_id, "targets": targets}, **counts)
+
+def merge_webhook_payloads(old, new):
+    """
+    合并同一 A 页面的两个 Webhook payload：以较新的 payload 为准，
+    relation 属性取两者关联页面的并集（新 payload 中的顺序在前）。
+    """
+    merged = dict(new, data=dict(new["data"]))
+    new_props = new["data"].get("properties", {})
+    old_props = old["data"].get("properties", {})
+    props = dict(new_props)
+    for name, old_prop in old_props.items():
+        if old_prop.get("type") != "relation":
+            continue
+        new_prop = new_props.get(name)
+        if not new_prop or new_prop.get("type") != "relation":
+            props[name] = old_prop
+            continue
+        seen = {r["id"] for r in new_prop.get("relation", [])}
+        extra = [r for r in old_prop.get("relation", []) if r["id"] not in seen]
+        # 任一方被截断时，合并结果仍视为截断，处理时会读取完整列表
+        has_more = bool(new_prop.get("has_more") or old_prop.get("has_more"))
+        props[name] = dict(new_prop, relation=new_prop.get("relation", []) + extra, has_more=has_more)
+    merged["data"]["properties"] = props
+    return merged
+
+marker_cache = LRUCache(MARKER_CACHE_SIZE, shared=shared_cache, namespace="markers", ttl=SHARED_CACHE_TTL)
+job_queue = JobQueue(process_webhook, workers=JOB_WORKERS, max_queue=JOB_QUEUE_SIZE, shared=shared_cache)
+coalescer = Coalescer(job_queue, merge_webhook_payloads, window=COALESCE_WINDOW, max_wait=COALESCE_MAX_WAIT,
+                      max_pending=COALESCE_MAX_PENDING, shared=shared_cache)
+metrics.gauge("daom_job_queue_depth", "等待执行的 Webhook 任务数", lambda: job_queue.queue.qsize())
+metrics.gauge("daom_jobs_running", "正在执行的 Webhook 任务数", lambda: job_queue.running)
+metrics.gauge("daom_coalescer_waiting", "处于合并窗口中、尚未入队的 A 页面数", lambda: len(coalescer.pending))
 
 # ========== 读取 Button Mapping 数据库 ==========
 def get_button_mapping_rows(database_id):
-    url = f"https://api.notion.com/v1/databases/{database_id}/query"
-    resp = requests.post(url, headers=HEADERS)
-    if resp.status_code != 200:
-        print(f"❌ 读取 Button Mapping 失败: {resp.text}")
-        return []
-    results = resp.json().get("results", [])
+    """ 查询 Button Mapping 数据库的全部行（自动翻页）；任一页读取失败时返回 None（缓存会保留旧数据） """
+    try:
+        results = list(iter_database_pages(database_id, HEADERS, strict=True))
+    except PaginationError as e:
+        log.error("❌ 读取 Button Mapping 失败", error=str(e))
+        return None
     rows = []
     for row in results:
         props = row.get("properties", {})
@@ -86,9 +345,13 @@ def get_button_mapping_rows(database_id):
         relation_val = extract_plain_text(props.get("Relation", {}))
         if name_val and relation_val:
             rows.append({"Name": name_val, "Relation": relation_val})
-    print(f"✅ 读取到 {len(rows)} 行 Button Mapping 数据: {rows}")
+    log.info("✅ 读取 Button Mapping", rows=len(rows))
+    log.debug("🔍 Button Mapping 内容", mapping=lazy_json(rows))
     return rows
 
+mapping_cache = TTLCache(lambda: get_button_mapping_rows(MAPPING_DATABASE_ID), ttl=MAPPING_CACHE_TTL,
+                         name="button_mapping", shared=shared_cache)
+
 def extract_plain_text(prop):
     ptype = prop.get("type")
     if ptype == "title":
@@ -98,137 +361,417 @@ def extract_plain_text(prop):
     return ""
 
 # ========== 从 webhook payload 获取 B 页面 ID ==========
-def get_b_pages_from_property_from_webhook(source_props, property_name):
+def get_b_pages_from_property_from_webhook(source_props, property_name, page_id=None, last_edited_time=None):
     """
     从 webhook payload 中的 A 页面 properties 获取指定 Relation 的 B 页面 ID 列表
+    （relation 被截断时通过 resolve_relation_ids 读取完整列表）
     """
     if property_name not in source_props:
-        print(f"⚠️ Webhook中未包含属性 {property_name}")
+        log.debug("⚠️ Webhook 中未包含属性", property=property_name)
         return []
     rel_prop = source_props[property_name]
     if rel_prop.get("type") != "relation":
-        print(f"⚠️ Webhook中属性 {property_name} 不是 relation 类型")
+        log.warning("⚠️ Webhook 中属性不是 relation 类型", property=property_name, type=rel_prop.get("type"))
         return []
-    relation_list = rel_prop.get("relation", [])
-    if not relation_list:
-        print(f"⚠️ Webhook中属性 {property_name} 关联列表为空")
+    b_page_ids = resolve_relation_ids(page_id, rel_prop, last_edited_time)
+    if not b_page_ids:
+        log.debug("⚠️ Webhook 中属性关联列表为空", property=property_name)
         return []
-    b_page_ids = [r["id"] for r in relation_list]
-    print(f"✅ Webhook: A 页面属性 {property_name} -> B 页面列表: {b_page_ids}")
+    log.debug("✅ A 页面属性关联的 B 页面", property=property_name, pages=lazy_json(b_page_ids))
     return b_page_ids
 
+def resolve_relation_ids(page_id, prop, last_edited_time=None):
+    """
+    返回 relation 属性的全部关联页面 ID：
+      - 页面对象 / Webhook payload 中的 relation 数组最多 25 个，has_more 为 true 表示被截断
+      - 被截断时通过 GET /pages/{id}/properties/{property_id} 分页读取完整列表
+      - 完整列表按 (页面 ID, 属性 ID, last_edited_time) 缓存，页面未改动时重复事件不再分页请求
+    分页读取失败时退回已有的（截断的）列表。
+    """
+    relation_ids = [r["id"] for r in prop.get("relation", [])]
+    if not prop.get("has_more"):
+        return relation_ids
+    if not page_id or not prop.get("id"):
+        log.warning("⚠️ relation 已截断但缺少页面或属性 ID，只能使用前几个关联页面", count=len(relation_ids))
+        return relation_ids
+
+    key = (page_id, prop["id"], last_edited_time)
+    if last_edited_time:
+        cached = relation_cache.get(key)
+        if cached is not None:
+            return cached
+    try:
+        relation_ids = [item["relation"]["id"] for item in iter_property_items(page_id, prop["id"], HEADERS)
+                        if item.get("type") == "relation"]
+    except PaginationError as e:
+        log.warning("⚠️ 读取完整 relation 失败，使用截断的列表", page_id=page_id, property=prop["id"],
+                    count=len(relation_ids), error=str(e))
+        return relation_ids
+    log.debug("✅ 读取完整 relation", page_id=page_id, property=prop["id"], count=len(relation_ids))
+    # 没有 last_edited_time 时无法判断缓存是否过期，不缓存
+    if last_edited_time:
+        relation_cache.set(key, relation_ids)
+    return relation_ids
+
+relation_cache = LRUCache(RELATION_CACHE_SIZE, shared=shared_cache, namespace="relation", ttl=SHARED_CACHE_TTL)
+
 # ========== 获取页面 Blocks ==========
-def get_page_blocks(page_id):
-    url = f"https://api.notion.com/v1/blocks/{page_id}/children"
-    resp = requests.get(url, headers=HEADERS)
-    if resp.status_code == 200:
-        return resp.json().get("results", [])
-    print(f"❌ 获取页面 {page_id} Blocks 失败: {resp.text}")
-    return []
+def get_page_blocks(page_id, page_size=100):
+    """ 获取页面的全部 Blocks（自动翻页，返回 Daom_Block.Block 列表） """
+    return list(iter_blocks(page_id, HEADERS, page_size=page_size))
 
 # ========== 查找同步块 ==========
+def build_marker_index(blocks, markers):
+    """
+    单次遍历页面 blocks（Block 列表或 iter_blocks 迭代器均可），为所有 marker 建立索引：
+        marker -> {"position", "marker_block_id", "sync_block_id", "sync_block"}
+    marker 后第一个 block 不是同步块时，sync_block_id / sync_block 为 None。
+    页面中不存在的 marker 不会出现在索引中；同一 marker 出现多次时以第一次为准。
+    所有 marker 都已确定后立即停止遍历。
+    """
+    wanted = set(markers)
+    index = {}
+    pending = None  # 上一个 block 是 marker 时，等待检查当前 block 是否为同步块
+    for i, block in enumerate(blocks):
+        if pending is not None:
+            if block.type == "synced_block":
+                index[pending].update(sync_block_id=block.id, sync_block=block)
+            pending = None
+            if len(index) == len(wanted):
+                break
+        content = block.text_key
+        if content in wanted and content not in index:
+            index[content] = {"position": i, "marker_block_id": block.id, "sync_block_id": None, "sync_block": None}
+            pending = content
+    return index
+
+def dump_marker_index(index):
+    """ 转成可写入共享缓存的形式（同步块以元组保存） """
+    return {marker: dict(entry, sync_block=entry["sync_block"].to_record() if entry["sync_block"] else None)
+            for marker, entry in index.items()}
+
+def load_marker_index(data):
+    return {marker: dict(entry, sync_block=Block.from_record(entry["sync_block"]) if entry["sync_block"] else None)
+            for marker, entry in data.items()}
+
 def find_synced_block_after_marker(page_id, marker):
     """
     在 A 页面中查找指定 marker 后面的第一个同步块。
     如果页面中完全没有 marker，则返回 "marker_not_found"；
     如果 marker 存在但 marker 后没有同步块，则返回 None。
+    （只查单个 marker；处理多个 marker 时请用 build_marker_index）
     """
-    print(f"🔍 获取 A 页面 {page_id} 的 Blocks...")
-    blocks = get_page_blocks(page_id)
-    if not blocks:
-        return None
-    marker_found = False
-    for i, block in enumerate(blocks):
-        btype = block.get("type")
-        text_content = block.get(btype, {}).get("rich_text", [])
-        if text_content and text_content[0].get("text", {}).get("content") == marker:
-            marker_found = True
-            print(f"✅ 找到 marker {marker} in {btype}，位置 {i}")
-            # 检查 marker 后的第一个 block是否为同步块
-            if i + 1 < len(blocks):
-                next_block = blocks[i+1]
-                if next_block.get("type") == "synced_block":
-                    print(f"✅ Marker 后的第一个 block已为同步块，ID: {next_block.get('id')}")
-                    return next_block.get("id")
-            return None
-    if not marker_found:
-        print(f"⚠️ 未找到 marker {marker} in A 页面 {page_id}")
+    log.debug("🔍 获取 A 页面的 Blocks", page_id=page_id, markers=1)
+    index = build_marker_index(iter_blocks(page_id, HEADERS), [marker])
+    if marker not in index:
+        log.warning("⚠️ A 页面中未找到 marker", page_id=page_id, marker=marker)
         return "marker_not_found"
-    return None
+    return index[marker]["sync_block_id"]
 
-# ========== 创建同步块（追加到页面底部） ==========
-def create_synced_block_at_bottom(page_id, marker):
+# ========== 创建同步块（插入到 marker 之后） ==========
+def create_synced_block_after_marker(page_id, marker_block_id=None):
     """
-    在 A 页面底部创建新的同步块（追加到页面末尾），返回同步块ID。
-    仅在页面中存在 marker 的情况下调用。
+    在 A 页面中紧跟 marker block 之后创建新的同步块（通过 after 参数插入），
+    marker_block_id 为空时追加到页面末尾。
+    新同步块直接从追加接口的返回结果中读取，无需等待和重新扫描页面。
+    返回新同步块（Block），失败时返回 None。
     """
     new_sync_block = {
         "object": "block",
         "type": "synced_block",
         "synced_block": {"synced_from": None}
     }
+    body = {"children": [new_sync_block]}
+    if marker_block_id:
+        body["after"] = marker_block_id
     url = f"https://api.notion.com/v1/blocks/{page_id}/children"
-    resp = requests.patch(url, headers=HEADERS, json={"children": [new_sync_block]})
-    if resp.status_code == 200:
-        print(f"✅ 在 A 页面底部新建同步块成功")
-        time.sleep(1)
-        result = find_synced_block_after_marker(page_id, marker)
-        if result == "marker_not_found":
-            return None
-        return result or new_sync_block.get("id")
-    else:
-        print(f"❌ 创建同步块失败: {resp.text}")
+    resp = notion.patch(url, headers=HEADERS, json=body)
+    if resp.status_code != 200:
+        log.error("❌ 创建同步块失败", page_id=page_id, status=resp.status_code, body=resp.text)
+        return None
+    created = find_created_block(resp.json().get("results", []), marker_block_id)
+    if not created:
+        log.error("❌ 创建同步块的返回结果中没有新 block", page_id=page_id, body=resp.text)
+        return None
+    log.info("✅ 在 A 页面新建同步块", page_id=page_id, block_id=created["id"])
+    return Block.from_json(created)
+
+def find_created_block(results, after_block_id=None):
+    """ 从追加接口返回的 results 中取出新建的 block（兼容返回内容包含 after 指定的 block 的情况） """
+    ids = [r.get("id") for r in results]
+    if after_block_id in ids:
+        position = ids.index(after_block_id) + 1
+        return results[position] if position < len(results) else None
+    if not results:
         return None
+    return results[0] if after_block_id else results[-1]
 
 # ========== 同步到 B 页面 ==========
-def copy_synced_block_content(sync_block_id, target_page_id):
+def resolve_synced_origin(sync_block_id, block=None):
     """
-    将 A 页面的同步块复制到 B 页面：
-      - 若同步块已同步自其他块，则使用原始块 ID；否则使用当前同步块 ID。
-      - 在 B 页面追加一个新的同步块引用原始块。
+    解析同步块引用的原始块 ID：若同步块已同步自其他块，则返回原始块 ID；否则返回自身 ID。
+      - block 为页面 Blocks 列表中已取得的同步块（Block）时直接解析，无需额外请求
+      - 否则请求一次 GET /blocks/{id}
+    结果按 (block ID, last_edited_time) 缓存在 LRU 中。失败时返回 None。
     """
-    detail_url = f"https://api.notion.com/v1/blocks/{sync_block_id}"
-    detail_resp = requests.get(detail_url, headers=HEADERS)
-    if detail_resp.status_code != 200:
-        print(f"❌ 获取源同步块详情失败: {detail_resp.text}")
-        return
-    source_block = detail_resp.json()
-    synced_info = source_block.get("synced_block", {})
-    if synced_info.get("synced_from"):
-        original_block_id = synced_info["synced_from"].get("block_id")
-        print(f"✅ 源同步块 {sync_block_id} 同步自 {original_block_id}")
+    if block is not None:
+        key = (sync_block_id, block.last_edited_time)
+        cached = origin_cache.get(key)
+        if cached:
+            return cached
+    else:
+        detail_url = f"https://api.notion.com/v1/blocks/{sync_block_id}"
+        detail_resp = notion.get(detail_url, headers=HEADERS)
+        if detail_resp.status_code != 200:
+            log.error("❌ 获取源同步块详情失败", block_id=sync_block_id, status=detail_resp.status_code, body=detail_resp.text)
+            return None
+        block = Block.from_json(detail_resp.json())
+        key = (sync_block_id, block.last_edited_time)
+
+    if block.synced_from:
+        original_block_id = block.synced_from
+        log.debug("✅ 源同步块同步自原始块", block_id=sync_block_id, original=original_block_id)
     else:
         original_block_id = sync_block_id
+    origin_cache.set(key, original_block_id)
+    return original_block_id
 
-    new_sync_block = {
+origin_cache = LRUCache(ORIGIN_CACHE_SIZE, shared=shared_cache, namespace="origin", ttl=SHARED_CACHE_TTL)
+
+def copy_synced_block_content(sync_block_id, target_page_id, original_block_id=None):
+    """
+    将 A 页面的同步块复制到 B 页面：
+      - 使用同步块的原始块 ID（未传入 original_block_id 时调用 resolve_synced_origin 解析）。
+      - B 页面中已有引用该原始块的同步块时跳过（幂等，重复事件不产生重复引用）。
+      - 否则在 B 页面追加一个新的同步块引用原始块。
+    返回 "synced" / "skipped" / "failed"。（多个同步块写入同一页面时请用 append_synced_blocks）
+    """
+    original_block_id = original_block_id or resolve_synced_origin(sync_block_id)
+    if not original_block_id:
+        return "failed"
+    return append_synced_blocks(target_page_id, [original_block_id])[original_block_id]
+
+MAX_CHILDREN_PER_REQUEST = 100  # Notion 单次追加 children 上限
+
+def append_synced_blocks(target_page_id, original_block_ids):
+    """
+    在 B 页面末尾按顺序追加引用各原始块的同步块，一次请求携带全部 children（超过 100 个时分批）。
+    B 页面中已引用的原始块跳过。返回 {原始块 ID: "synced" / "skipped" / "failed"}。
+    """
+    return sync_target_page(target_page_id, original_block_ids)["results"]
+
+def sync_target_page(target_page_id, original_block_ids):
+    """ append_synced_blocks 的同步实现，返回该 B 页面的结果（见 new_target_outcome） """
+    outcome = new_target_outcome()
+    with ref_index.lock(target_page_id), page_lease(target_page_id) as lease:
+        pending = split_existing_references(target_page_id, original_block_ids, outcome)
+        for batch in batched(pending, MAX_CHILDREN_PER_REQUEST):
+            if not renew_page_lease(target_page_id, lease, outcome):
+                break
+            resp = notion.patch(f"https://api.notion.com/v1/blocks/{target_page_id}/children",
+                                headers=HEADERS, json={"children": synced_block_children(batch)})
+            record_append(target_page_id, batch, resp, outcome)
+    return finish_target_outcome(outcome, original_block_ids)
+
+async def sync_target_page_async(client, target_page_id, original_block_ids):
+    """
+    sync_target_page 的异步版本，由 FanOutEngine 调用：追加请求通过 AsyncNotion 发出。
+    同一 B 页面先在事件循环内排队（fanout_engine.key_lock），再以轮询方式取得本进程的页面锁与跨进程租约，
+    等待期间不占用线程池；引用索引（SQLite）等短时间的阻塞操作放到线程池中执行。
+    """
+    outcome = new_target_outcome()
+    async with fanout_engine.key_lock(target_page_id):
+        lock = ref_index.lock(target_page_id)
+        while not lock.acquire(blocking=False):
+            await asyncio.sleep(LOCK_POLL)
+        try:
+            lease = await acquire_page_lease_async(target_page_id)
+            try:
+                pending = await asyncio.to_thread(split_existing_references, target_page_id, original_block_ids, outcome)
+                for batch in batched(pending, MAX_CHILDREN_PER_REQUEST):
+                    if not await asyncio.to_thread(renew_page_lease, target_page_id, lease, outcome):
+                        break
+                    resp = await client.patch(f"https://api.notion.com/v1/blocks/{target_page_id}/children",
+                                              headers=HEADERS, json={"children": synced_block_children(batch)})
+                    await asyncio.to_thread(record_append, target_page_id, batch, resp, outcome)
+            finally:
+                await asyncio.to_thread(release_page_lease, target_page_id, lease)
+        finally:
+            lock.release()
+    return finish_target_outcome(outcome, original_block_ids)
+
+def distribute_synced_blocks(plan):
+    """
+    按 plan（B 页面 ID -> [原始同步块 ID]）写入所有 B 页面，返回 {B 页面 ID: 结果}。
+    FANOUT_ASYNC 且目标多于一个时并发执行，否则逐个执行。
+    """
+    if FANOUT_ASYNC and len(plan) > 1:
+        outcomes = fanout_engine.run(sync_target_page_async, plan.items())
+    else:
+        outcomes = {}
+        for b_page_id, original_block_ids in plan.items():
+            try:
+                outcomes[b_page_id] = sync_target_page(b_page_id, original_block_ids)
+            except Exception as e:
+                log.error("❌ 写入 B 页面异常", page_id=b_page_id, error=repr(e))
+                outcomes[b_page_id] = {"status": "failed", "error": repr(e)}
+    # 执行过程中抛出异常（含超时）的目标没有逐块结果，其全部同步块计为失败；
+    # 追加请求可能已经生效，丢弃该页面的引用索引，下次事件重新扫描
+    for b_page_id, outcome in outcomes.items():
+        if "blocks" not in outcome:
+            ref_index.forget_page(b_page_id)
+            outcome["blocks"] = {"synced": 0, "skipped": 0, "failed": len(plan[b_page_id])}
+            outcome.setdefault("retries", 0)
+    return outcomes
+
+def new_target_outcome():
+    """
+    单个 B 页面的结果：
+        results：{原始块 ID: "synced" / "skipped" / "failed"}
+        blocks：各状态的同步块数
+        retries：该页面的请求共重试了几次
+        status："succeeded"（没有失败的同步块）或 "failed"
+        error：最后一个失败请求的错误信息
+    """
+    return {"status": None, "results": {}, "blocks": None, "retries": 0, "error": None}
+
+def split_existing_references(target_page_id, original_block_ids, outcome):
+    """ B 页面中已引用的原始块记为 skipped，返回需要追加的原始块 ID """
+    pending = []
+    for original_block_id in original_block_ids:
+        if ref_index.has_reference(original_block_id, target_page_id):
+            log.debug("⏭️ B 页面已引用同步块，跳过", page_id=target_page_id, original=original_block_id)
+            outcome["results"][original_block_id] = "skipped"
+        else:
+            pending.append(original_block_id)
+    return pending
+
+def synced_block_children(original_block_ids):
+    return [{
         "object": "block",
         "type": "synced_block",
         "synced_block": {"synced_from": {"block_id": original_block_id}}
+    } for original_block_id in original_block_ids]
+
+def record_append(target_page_id, batch, resp, outcome):
+    outcome["retries"] += getattr(resp, "retries", 0)
+    if resp.status_code != 200:
+        log.error("❌ 同步块复制失败", page_id=target_page_id, blocks=len(batch),
+                  status=resp.status_code, body=resp.text)
+        outcome["results"].update((original_block_id, "failed") for original_block_id in batch)
+        outcome["error"] = f"{resp.status_code}: {resp.text[:200]}"
+        # 4xx 说明请求未生效；5xx 不重试（见 Daom_Client.is_idempotent），追加可能已经生效，下次事件重新扫描该页面
+        if resp.status_code >= 500:
+            ref_index.forget_page(target_page_id)
+        return
+    for original_block_id in batch:
+        ref_index.add(original_block_id, target_page_id)
+        outcome["results"][original_block_id] = "synced"
+    log.info("✅ 同步块已复制到 B 页面", page_id=target_page_id, blocks=len(batch))
+
+def finish_target_outcome(outcome, original_block_ids):
+    blocks = {"synced": 0, "skipped": 0, "failed": 0}
+    for original_block_id in original_block_ids:
+        blocks[outcome["results"].get(original_block_id, "failed")] += 1
+    outcome["blocks"] = blocks
+    outcome["status"] = "failed" if blocks["failed"] else "succeeded"
+    return outcome
+
+def summarize_targets(outcomes):
+    """ 任务结果中的 B 页面汇总：成功、失败（附错误信息）、发生过重试的页面 """
+    return {
+        "succeeded": [page_id for page_id, o in outcomes.items() if o["status"] == "succeeded"],
+        "failed": {page_id: o.get("error") for page_id, o in outcomes.items() if o["status"] != "succeeded"},
+        "retried": {page_id: o["retries"] for page_id, o in outcomes.items() if o.get("retries")},
     }
-    add_url = f"https://api.notion.com/v1/blocks/{target_page_id}/children"
-    resp = requests.patch(add_url, headers=HEADERS, json={"children": [new_sync_block]})
-    if resp.status_code == 200:
-        print(f"✅ 成功同步 block 到 B 页面 {target_page_id}")
-    else:
-        print(f"❌ 同步 block 失败: {resp.text}")
+
+def batched(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+fanout_engine = FanOutEngine(concurrency=FANOUT_CONCURRENCY)
+metrics.gauge("daom_fanout_running", "正在写入的 B 页面数", lambda: fanout_engine.running)
+
+def scan_synced_references(page_id):
+    """
+    列出 B 页面顶层同步块所引用的原始块 ID（用于懒加载引用索引）。
+    必须读完整个页面：读取失败时返回 None，页面不会被记为已扫描。
+    """
+    originals = []
+    try:
+        for block in iter_blocks(page_id, HEADERS, strict=True):
+            if block.type == "synced_block":
+                originals.append(block.synced_from or block.id)
+    except PaginationError as e:
+        log.error("❌ 扫描 B 页面的同步块失败", page_id=page_id, error=str(e))
+        return None
+    return originals
+
+def page_lease(page_id):
+    """ 多 worker 部署时，跨进程独占 B 页面的写入（ref_index.lock 只在本进程内有效） """
+    if shared_cache is None:
+        return contextlib.nullcontext()
+    return shared_cache.lease(f"page:{page_id}", ttl=PAGE_LEASE_TTL)
+
+async def acquire_page_lease_async(page_id):
+    """ 轮询取得跨进程租约（每次尝试都不阻塞），返回 owner；未配置共享缓存时返回 None """
+    if shared_cache is None:
+        return None
+    while True:
+        owner = await asyncio.to_thread(shared_cache.try_acquire_lease, f"page:{page_id}", PAGE_LEASE_TTL)
+        if owner:
+            return owner
+        await asyncio.sleep(LOCK_POLL)
+
+def renew_page_lease(page_id, owner, outcome):
+    """
+    发出下一批追加请求前续期租约，返回是否可以继续写入。
+    租约已过期并被其他进程取得时停止写入（否则可能重复追加），未写入的同步块由 finish_target_outcome 记为失败。
+    """
+    if owner is None or shared_cache.renew_lease(f"page:{page_id}", owner, PAGE_LEASE_TTL):
+        return True
+    log.error("❌ B 页面租约已过期，停止写入", page_id=page_id)
+    outcome["error"] = "page lease expired"
+    return False
+
+def release_page_lease(page_id, owner):
+    if owner is not None:
+        shared_cache.release_lease(f"page:{page_id}", owner)
+
+ref_index = SyncedRefIndex(REF_INDEX_FILE, scan_synced_references)
 
 # ========== 备用方案：从 Notion API 获取 A 页面关联的 B 页面 ID ==========
-def get_related_page_ids_from_notion(page_id):
+def get_related_page_ids_from_notion(page_id, property_name):
+    """ 读取 A 页面指定 Relation 属性（即 Button Mapping 中的 Relation 列）关联的全部 B 页面 ID """
     url = f"https://api.notion.com/v1/pages/{page_id}"
-    resp = requests.get(url, headers=HEADERS)
+    resp = notion.get(url, headers=HEADERS)
     if resp.status_code != 200:
-        print(f"❌ 获取 A 页面失败: {resp.text}")
+        log.error("❌ 获取 A 页面失败", page_id=page_id, status=resp.status_code, body=resp.text)
+        return None
+    page = resp.json()
+    relation_prop = page.get("properties", {}).get(property_name, {})
+    if relation_prop.get("type") != "relation":
+        log.warning("⚠️ A 页面没有该 relation 属性", page_id=page_id, property=property_name)
         return None
-    props = resp.json().get("properties", {})
-    relation_prop = props.get("Fiarybase", {})
-    relation_list = relation_prop.get("relation", [])
-    if relation_list:
-        related_page_ids = [r["id"] for r in relation_list]
-        print(f"✅ 从 Notion API 获取 `Fiarybase` 关联页面: {related_page_ids}")
+    related_page_ids = resolve_relation_ids(page_id, relation_prop, page.get("last_edited_time"))
+    if related_page_ids:
+        log.info("✅ 从 Notion API 获取关联页面", page_id=page_id, property=property_name,
+                 pages=lazy_json(related_page_ids))
         return related_page_ids
     else:
-        print(f"⚠️ A 页面 {page_id} 没有关联的 B 页面")
+        log.warning("⚠️ A 页面没有关联的 B 页面", page_id=page_id)
         return None
 
+# ========== 应用工厂 ==========
+def create_app():
+    """
+    创建 Flask 应用。本地调试直接运行本文件（单进程开发服务器）；
+    生产环境由 wsgi.py 调用，交给多 worker 的 WSGI 服务器：gunicorn -c gunicorn.conf.py wsgi:app
+    """
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    if shared_cache is not None:
+        threading.Thread(target=run_stats_publisher, name="daom-stats", daemon=True).start()
+    return app
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    create_app().run(host="0.0.0.0", port=5000, debug=True)
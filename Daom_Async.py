@@ -0,0 +1,232 @@
+import asyncio
+import atexit
+import concurrent.futures
+import contextlib
+import json
+import math
+import threading
+import time
+
+import Daom_Client as notion
+from Daom_Log import get_logger
+from Daom_Metrics import metrics
+
+try:
+    import aiohttp
+except ImportError:  # 未安装 aiohttp 时在线程池中调用 Daom_Client（requests 连接池）
+    aiohttp = None
+
+log = get_logger("async")
+
+FANOUT_CONCURRENCY = 8  # 同时处理的目标数上限（所有任务共享）
+FANOUT_TIMEOUT = 600.0  # 单个目标的处理时间上限（秒），超时记为失败
+LOCK_POLL = 0.05        # 等待线程锁 / 跨进程租约时的轮询间隔（秒），等待期间不占用线程
+
+
+class AsyncResponse:
+    """ aiohttp 响应读取完毕后的快照，提供与 requests.Response 相同的常用接口 """
+
+    __slots__ = ("status_code", "headers", "content", "url", "retries")
+
+    def __init__(self, status_code, headers, content, url):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+        self.retries = 0
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncNotion:
+    """
+    异步 Notion 客户端，与 Daom_Client.request 共用令牌桶、重试预算、熔断器与指标：
+      - 安装了 aiohttp 时使用一个长期存在的 ClientSession（keep-alive 连接池，最多 pool_size 个连接）
+      - 否则每个请求通过 asyncio.to_thread 调用 Daom_Client.request
+    必须在同一个事件循环中 open() / 使用 / close()。
+    """
+
+    def __init__(self, pool_size=notion.POOL_SIZE):
+        self.pool_size = pool_size
+        self.session = None
+
+    async def open(self):
+        if aiohttp is not None and self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method, url, retry_statuses=(), **kwargs):
+        if self.session is None:
+            return await asyncio.to_thread(notion.request, method, url, retry_statuses=retry_statuses, **kwargs)
+
+        timeout = aiohttp.ClientTimeout(total=kwargs.pop("timeout", notion.REQUEST_TIMEOUT))
+        url = notion.resolve_url(url)
+        endpoint = notion.endpoint_key(method, url)
+        idempotent = notion.is_idempotent(endpoint)
+        retryable = (notion.RETRY_STATUSES if idempotent else notion.UNSAFE_RETRY_STATUSES).union(retry_statuses)
+        attempt = 0
+        while True:
+            if not notion.breaker.allow(endpoint):
+                return notion._short_circuit(url, endpoint, attempt)
+            waited = time.perf_counter()
+            wait = notion.bucket.try_acquire()
+            while wait:
+                await asyncio.sleep(wait)
+                wait = notion.bucket.try_acquire()
+            started = time.perf_counter()
+            metrics.observe_wait(started - waited)
+            resp = error = None
+            try:
+                async with self.session.request(method, url, timeout=timeout, **kwargs) as raw:
+                    resp = AsyncResponse(raw.status, raw.headers, await raw.read(), url)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            finally:
+                # 包括取消（扇出超时）在内的任何异常都要记录，熔断器的试探状态才会被清除
+                notion._record_attempt(endpoint, resp, error, time.perf_counter() - started)
+
+            # 非幂等请求只有连接未建立（ClientConnectorError）时才重试，超时或断开时请求可能已经生效
+            retry_error = idempotent or isinstance(error, aiohttp.ClientConnectorError)
+            delay = notion._retry_delay(endpoint, attempt, resp, error, retryable, retry_error)
+            if delay is None:
+                if error is not None:
+                    raise error
+                resp.retries = attempt
+                return resp
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def patch(self, url, **kwargs):
+        return await self.request("PATCH", url, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self.request("DELETE", url, **kwargs)
+
+
+class FanOutEngine:
+    """
+    asyncio 扇出执行器：在后台线程中运行一个常驻事件循环和一个共享的 AsyncNotion 连接池。
+      - run(handler, items)：可在任意线程中调用，阻塞到全部完成；
+        对每个 (key, value) 并发执行 await handler(client, key, value)
+      - 同时执行的 handler 数受 concurrency 信号量限制（所有调用共享），请求速率仍由共享令牌桶控制
+      - 单个目标抛出异常或超过 timeout 秒不影响其他目标，其结果记为 {"status": "failed", "error": ...}
+      - key_lock(key)：事件循环内按 key 互斥（如同一 B 页面），等待时不占用线程
+    事件循环使用独立的线程池（asyncio.to_thread 默认在其中执行），大小为 concurrency 的两倍，
+    handler 只在其中做短时间的阻塞操作，不在其中等待锁。
+    返回 {key: handler 的返回值}，保持 items 的顺序。事件循环在第一次 run() 时才启动（fork 之后）。
+    """
+
+    def __init__(self, concurrency=FANOUT_CONCURRENCY, pool_size=notion.POOL_SIZE, timeout=FANOUT_TIMEOUT):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.client = AsyncNotion(pool_size)
+        self.loop = None
+        self.semaphore = None
+        self.key_locks = {}  # key -> [asyncio.Lock, 使用者数]，只在事件循环线程中访问
+        self.lock = threading.Lock()
+        self.running = 0
+        self.counters = {"runs": 0, "targets": 0, "failed": 0}
+
+    def start(self):
+        with self.lock:
+            if self.loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.concurrency * 2, thread_name_prefix="daom-fanout-io"))
+            threading.Thread(target=loop.run_forever, name="daom-fanout", daemon=True).start()
+            asyncio.run_coroutine_threadsafe(self._open(), loop).result()
+            self.loop = loop
+        atexit.register(self.stop)
+        log.info("✅ 扇出执行器已启动", concurrency=self.concurrency,
+                 transport="aiohttp" if self.client.session is not None else "threads")
+
+    async def _open(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        await self.client.open()
+
+    def stop(self):
+        with self.lock:
+            loop, self.loop = self.loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.client.close(), loop).result(timeout=10)
+        loop.call_soon_threadsafe(loop.stop)
+
+    def run(self, handler, items):
+        self.start()
+        items = list(items)
+        with self.lock:
+            self.counters["runs"] += 1
+            self.counters["targets"] += len(items)
+        future = asyncio.run_coroutine_threadsafe(self._run(handler, items), self.loop)
+        # 每个目标已有超时，这里只是兜底：最坏情况下所有目标排队依次超时
+        deadline = self.timeout * math.ceil(len(items) / self.concurrency) + 30
+        try:
+            return future.result(timeout=deadline)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            log.error("❌ 扇出执行超时", targets=len(items), timeout=deadline)
+            return {key: {"status": "failed", "error": f"fan-out timed out after {deadline}s"} for key, _ in items}
+
+    async def _run(self, handler, items):
+        results = await asyncio.gather(*(self._guarded(handler, key, value) for key, value in items))
+        return dict(zip((key for key, _ in items), results))
+
+    async def _guarded(self, handler, key, value):
+        async with self.semaphore:
+            with self.lock:
+                self.running += 1
+            try:
+                return await asyncio.wait_for(handler(self.client, key, value), self.timeout)
+            except asyncio.TimeoutError:
+                log.error("❌ 扇出目标超时", target=key, timeout=self.timeout)
+                with self.lock:
+                    self.counters["failed"] += 1
+                return {"status": "failed", "error": f"timed out after {self.timeout}s"}
+            except Exception as e:
+                log.error("❌ 扇出目标执行失败", target=key, error=repr(e))
+                with self.lock:
+                    self.counters["failed"] += 1
+                return {"status": "failed", "error": repr(e)}
+            finally:
+                with self.lock:
+                    self.running -= 1
+
+    @contextlib.asynccontextmanager
+    async def key_lock(self, key):
+        """ 同一 key 的 handler 依次执行；没有使用者的锁随即删除 """
+        entry = self.key_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.key_locks[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "concurrency": self.concurrency,
+                "timeout": self.timeout,
+                "transport": "aiohttp" if self.client.session is not None else "threads",
+                "running": self.running,
+                "counters": dict(self.counters),
+            }
@@ -0,0 +1,274 @@
+"""
+基于 Daom_FakeNotion 的离线基准测试：统计各场景发出的请求数、耗时与峰值内存。
+
+    python Daom_Bench.py                       # 运行全部场景
+    python Daom_Bench.py webhook --latency 0.02
+    python Daom_Bench.py copy --pages 500 --rate-limit 3
+    python Daom_Bench.py --baseline            # 默认参数下与记录的请求数对比，超出时退出码为 1
+    python Daom_Bench.py --pages 500 --baseline old.json   # 与之前 --json 保存的结果对比
+
+Fake 服务运行在独立子进程中，tracemalloc 只统计脚本本身的内存。
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+import Daom_Client as notion
+from Daom_FakeNotion import FakeNotion, FakeNotionServer, rich_text
+from Daom_Log import set_level
+
+# ========== 默认参数 ==========
+WEBHOOK_MAPPINGS = 10     # Button Mapping 行数（每行一个 marker + 同步块）
+WEBHOOK_B_PAGES = 50      # 每个映射关联的 B 页面数
+WEBHOOK_FILLER = 150      # A 页面中 marker 之前的普通段落数（触发分页）
+COPY_PAGES = 2000         # 源数据库页面数
+COPY_BLOCKS = 4           # 每个源页面的顶层 block 数（其中一个 toggle 带子 block）
+SYNC_TOUCHED = 0.01       # 增量同步场景中第二次运行前修改的页面比例
+CLIENT_RATE = 1000.0      # 基准测试时放开客户端限速，测的是请求数而不是 Notion 的限额
+
+# 默认参数下各场景记录的请求数（--baseline 不带文件时的对比基线）；优化使请求数下降后应同步更新
+BASELINE_REQUESTS = {
+    "webhook（首次）": 103,
+    "webhook（重复事件）": 2,
+    "copy_database": 8022,
+    "sync_database（首次）": 8022,
+    "sync_database（20 页有改动）": 101,
+}
+
+
+# ========== 测试数据 ==========
+def paragraph(text):
+    return {"object": "block", "type": "paragraph", "paragraph": {"rich_text": [rich_text(text)]}}
+
+def seed_webhook(fake, mappings=WEBHOOK_MAPPINGS, b_pages=WEBHOOK_B_PAGES, filler=WEBHOOK_FILLER):
+    """ Button Mapping 数据库 + 一个带 marker 与同步块的 A 页面 + 一组 B 页面 """
+    mapping_db = fake.add_database("Button Mapping", {"Name": "title", "Relation": "rich_text"})
+    for i in range(mappings):
+        fake.add_page(mapping_db, {
+            "Name": {"title": [rich_text(f"%M{i}")]},
+            "Relation": {"rich_text": [rich_text(f"Rel {i}")]},
+        })
+    work_db = fake.add_database("Work", {"Name": "title"})
+    b_ids = [fake.add_page(work_db, {"Name": {"title": [rich_text(f"B {i}")]}}) for i in range(b_pages)]
+    a_id = fake.add_page(work_db, {"Name": {"title": [rich_text("A")]}})
+    for i in range(filler):
+        fake.add_block(a_id, paragraph(f"filler {i}"))
+    for i in range(mappings):
+        fake.add_block(a_id, paragraph(f"%M{i}"))
+        fake.add_block(a_id, {"type": "synced_block",
+                              "synced_block": {"synced_from": None, "children": [paragraph(f"content {i}")]}})
+    return {"mapping_db": mapping_db, "work_db": work_db, "a_page": a_id, "b_pages": b_ids, "mappings": mappings}
+
+def seed_copy(fake, pages=COPY_PAGES, blocks=COPY_BLOCKS):
+    """ 与 Daom_Copy.properties_map 字段一致的源 / 目标数据库 """
+    source_db = fake.add_database("Source", {"Name": "title", "Multi-select": "multi_select",
+                                             "Date 1": "date", "Value 1": "number"})
+    target_db = fake.add_database("Target", {"Name": "title", "slect": "multi_select",
+                                             "Date": "date", "V": "number"})
+    page_ids = []
+    for i in range(pages):
+        page_id = fake.add_page(source_db, {
+            "Name": {"title": [rich_text(f"Page {i}")]},
+            "Multi-select": {"multi_select": [{"name": f"tag{i % 5}"}]},
+            "Date 1": {"date": {"start": "2024-01-01"}},
+            "Value 1": {"number": i},
+        })
+        page_ids.append(page_id)
+        for j in range(blocks - 1):
+            fake.add_block(page_id, paragraph(f"Page {i} line {j}"))
+        fake.add_block(page_id, {"type": "toggle", "toggle": {"rich_text": [rich_text("details")],
+                                                              "children": [paragraph("nested")]}})
+    return {"source_db": source_db, "target_db": target_db, "source_pages": page_ids}
+
+SEEDS = {"webhook": seed_webhook, "copy": seed_copy}
+
+
+# ========== Fake 服务子进程 ==========
+def serve(seed_name, seed_kwargs, options, conn):
+    fake = FakeNotion()
+    ids = SEEDS[seed_name](fake, **seed_kwargs)
+    server = FakeNotionServer(fake, **options).start()
+    conn.send((server.url, ids))
+    conn.recv()  # 主进程发送任意消息后退出
+    server.stop()
+
+@contextlib.contextmanager
+def fake_server(seed_name, seed_kwargs, options):
+    parent_conn, child_conn = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=serve, args=(seed_name, seed_kwargs, options, child_conn), daemon=True)
+    proc.start()
+    url, ids = parent_conn.recv()
+    previous = notion.NOTION_API_URL
+    notion.NOTION_API_URL = url
+    try:
+        yield url, ids
+    finally:
+        notion.NOTION_API_URL = previous
+        parent_conn.send("stop")
+        proc.join(timeout=10)
+
+def admin(url, path, method="GET"):
+    """ 访问 Fake 服务的管理接口（不经过 Daom_Client，不计入请求数） """
+    base = url.rsplit("/v1", 1)[0]
+    req = urllib.request.Request(base + path, method=method, data=b"" if method == "POST" else None)
+    with urllib.request.urlopen(req) as resp:
+        return json.loads(resp.read())
+
+
+# ========== 计量 ==========
+def measure(name, url, fn, quiet=True):
+    """ 运行 fn()，返回请求数、429 次数、耗时与峰值内存 """
+    admin(url, "/__reset", "POST")
+    tracemalloc.start()
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+        result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    server_stats = admin(url, "/__stats")
+    row = {
+        "scenario": name,
+        "requests": server_stats["requests"],
+        "throttled": server_stats["throttled"],
+        "wall_s": round(elapsed, 2),
+        "peak_mb": round(peak / 1024 / 1024, 2),
+        "by_endpoint": server_stats["by_endpoint"],
+        "result": result,
+    }
+    print(f"📊 {name}: {row['requests']} 次请求（429: {row['throttled']}），"
+          f"{row['wall_s']}s，峰值内存 {row['peak_mb']} MB")
+    return row
+
+def load_baseline(path):
+    """ 读取基线：--json 保存的结果列表，或 {场景名: 请求数} """
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return {row["scenario"]: row["requests"] for row in data}
+    return data
+
+def check_baseline(rows, baseline):
+    """ 与基线对比请求数，返回超出基线的场景名列表 """
+    print("\n📏 基线对比")
+    regressions = []
+    for row in rows:
+        limit = baseline.get(row["scenario"])
+        if limit is None:
+            print(f"  ⚠️ {row['scenario']:<28} 基线中没有该场景，跳过")
+        elif row["requests"] > limit:
+            print(f"  ❌ {row['scenario']:<28} {row['requests']:>7} 次请求，超出基线 {limit}")
+            regressions.append(row["scenario"])
+        else:
+            print(f"  ✅ {row['scenario']:<28} {row['requests']:>7} 次请求（基线 {limit}）")
+    return regressions
+
+
+# ========== 场景 ==========
+def import_daom3(workdir):
+    """ 在临时目录中导入 Daom3，避免在仓库目录生成 SQLite 索引文件 """
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        return importlib.import_module("Daom3")
+    finally:
+        os.chdir(cwd)
+
+def bench_webhook(args, options):
+    seed_kwargs = {"mappings": args.mappings, "b_pages": args.b_pages}
+    with fake_server("webhook", seed_kwargs, options) as (url, ids), tempfile.TemporaryDirectory() as workdir:
+        daom3 = import_daom3(workdir)
+        daom3.MAPPING_DATABASE_ID = ids["mapping_db"]
+        relation = [{"id": b} for b in ids["b_pages"]]
+        payload = {"data": {
+            "id": ids["a_page"],
+            "parent": {"type": "database_id", "database_id": ids["work_db"]},
+            "properties": {f"Rel {i}": {"id": f"r{i}", "type": "relation", "relation": relation}
+                           for i in range(ids["mappings"])},
+        }}
+        rows = [measure("webhook（首次）", url, lambda: daom3.process_webhook(payload), args.quiet)]
+        rows.append(measure("webhook（重复事件）", url, lambda: daom3.process_webhook(payload), args.quiet))
+        return rows
+
+def bench_copy(args, options):
+    import Daom_Copy
+    from Daom_State import SyncStateStore
+
+    seed_kwargs = {"pages": args.pages}
+    rows = []
+    with fake_server("copy", seed_kwargs, options) as (url, ids):
+        rows.append(measure("copy_database", url,
+                            lambda: Daom_Copy.copy_database(ids["source_db"], ids["target_db"]), args.quiet))
+
+    if args.skip_sync:
+        return rows
+    with fake_server("copy", seed_kwargs, options) as (url, ids), tempfile.TemporaryDirectory() as workdir:
+        store = SyncStateStore(os.path.join(workdir, "state.sqlite3"))
+        sync = lambda: Daom_Copy.sync_database(ids["source_db"], ids["target_db"], store=store)
+        rows.append(measure("sync_database（首次）", url, sync, args.quiet))
+        touched = ids["source_pages"][:max(1, int(len(ids["source_pages"]) * SYNC_TOUCHED))]
+        for page_id in touched:
+            notion.patch(f"{notion.NOTION_API_URL}/pages/{page_id}", headers=Daom_Copy.headers,
+                         json={"properties": {"Value 1": {"number": -1}}})
+        rows.append(measure(f"sync_database（{len(touched)} 页有改动）", url, sync, args.quiet))
+        store.close()
+    return rows
+
+SCENARIOS = {"webhook": bench_webhook, "copy": bench_copy}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Daom 离线基准测试")
+    parser.add_argument("scenarios", nargs="*", help=f"可选 {', '.join(SCENARIOS)}，默认运行全部场景")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake 服务每个请求的额外延迟（秒）")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Fake 服务每秒请求上限，超出返回 429")
+    parser.add_argument("--client-rate", type=float, default=CLIENT_RATE, help="Daom_Client 客户端限速")
+    parser.add_argument("--mappings", type=int, default=WEBHOOK_MAPPINGS)
+    parser.add_argument("--b-pages", type=int, default=WEBHOOK_B_PAGES)
+    parser.add_argument("--pages", type=int, default=COPY_PAGES)
+    parser.add_argument("--skip-sync", action="store_true", help="copy 场景不运行增量同步")
+    parser.add_argument("--verbose", dest="quiet", action="store_false", help="显示脚本自身的输出")
+    parser.add_argument("--json", help="将结果写入 JSON 文件，便于对比不同版本")
+    parser.add_argument("--baseline", nargs="?", const="", default=None, metavar="FILE",
+                        help="请求数超过基线时以退出码 1 结束；不带文件时使用默认参数下记录的 BASELINE_REQUESTS")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知场景: {', '.join(sorted(unknown))}")
+    defaults = (args.mappings, args.b_pages, args.pages) == (WEBHOOK_MAPPINGS, WEBHOOK_B_PAGES, COPY_PAGES)
+    if args.baseline == "" and not defaults:
+        parser.error("内置基线只适用于默认的 --mappings / --b-pages / --pages，其他参数请用 --baseline FILE")
+
+    if args.quiet:
+        set_level("WARNING")  # 脚本输出会影响耗时，默认只保留警告以上的日志
+    notion.configure(rate=args.client_rate, burst=max(int(args.client_rate), 1))
+    options = {"latency": args.latency, "rate_limit": args.rate_limit}
+    rows = []
+    for name in args.scenarios or SCENARIOS:
+        print(f"🚀 场景 {name}")
+        rows.extend(SCENARIOS[name](args, options))
+
+    print("\n🏁 汇总")
+    for row in rows:
+        print(f"  {row['scenario']:<28} {row['requests']:>7} 次请求 {row['throttled']:>5} 次 429 "
+              f"{row['wall_s']:>8}s {row['peak_mb']:>8} MB")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2, default=str)
+    if args.baseline is not None:
+        baseline = load_baseline(args.baseline) if args.baseline else BASELINE_REQUESTS
+        if check_baseline(rows, baseline):
+            sys.exit(1)
+    return rows
+
+
+if __name__ == "__main__":
+    main()
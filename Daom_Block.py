@@ -0,0 +1,91 @@
+import json
+import sys
+
+from Daom_Client import MAX_PAGE_SIZE, iter_block_children
+
+
+class Block:
+    """
+    紧凑的 block 表示，每条 API 结果只解析一次：
+      - 只保留 id、type、父级 ID、has_children、last_edited_time
+      - text_key：第一段 rich_text 的文本（marker 比较用），解析时预先取出
+      - synced_from：引用型同步块的原始块 ID（原始同步块与其他类型为 None）
+      - 该类型的内容（block[type]）压缩为 JSON 字符串保存，读取 content / payload() 时才还原为字典
+    比完整的 JSON 字典小得多，扫描 marker 时也不必再逐层 .get()。
+    """
+
+    __slots__ = ("id", "type", "parent_id", "has_children", "last_edited_time", "text_key", "synced_from", "_content")
+
+    def __init__(self, id, type, parent_id=None, has_children=False, last_edited_time=None,
+                 text_key=None, synced_from=None, content=None):
+        self.id = id
+        self.type = type
+        self.parent_id = parent_id
+        self.has_children = has_children
+        self.last_edited_time = last_edited_time
+        self.text_key = text_key
+        self.synced_from = synced_from
+        self._content = content  # 压缩后的 JSON 字符串；None 表示原始数据中没有该类型的内容
+
+    @classmethod
+    def from_json(cls, raw):
+        """ 从 Notion 返回的 block 字典构造；不是有效 block 时返回 None """
+        if not isinstance(raw, dict) or "type" not in raw:
+            return None
+        btype = sys.intern(raw["type"])
+        content = raw.get(btype)
+        text_key = synced_from = None
+        if isinstance(content, dict):
+            rich_text = content.get("rich_text")
+            if rich_text:
+                text_key = rich_text[0].get("text", {}).get("content")
+            if btype == "synced_block" and content.get("synced_from"):
+                synced_from = content["synced_from"].get("block_id")
+        parent = raw.get("parent") or {}
+        return cls(
+            raw.get("id"),
+            btype,
+            parent_id=parent.get(parent.get("type")) if parent.get("type") != "workspace" else None,
+            has_children=bool(raw.get("has_children")),
+            last_edited_time=raw.get("last_edited_time"),
+            text_key=text_key,
+            synced_from=synced_from,
+            content=json.dumps(content, ensure_ascii=False, separators=(",", ":")) if btype in raw else None,
+        )
+
+    @property
+    def content(self):
+        """ 该类型的内容字典（每次调用都重新解析，调用方可以随意修改） """
+        return json.loads(self._content) if self._content is not None else {}
+
+    @property
+    def copyable(self):
+        return self._content is not None
+
+    def payload(self):
+        """ 追加 children 时使用的 block 数据 """
+        return {"object": "block", "type": self.type, self.type: self.content}
+
+    def to_record(self):
+        """ 可 JSON 序列化的元组形式（写入共享缓存用），from_record() 还原 """
+        return (self.id, self.type, self.parent_id, self.has_children, self.last_edited_time,
+                self.text_key, self.synced_from, self._content)
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(*record)
+
+    def __repr__(self):
+        return f"Block({self.type} {self.id})"
+
+
+def parse_blocks(results):
+    """ 逐条解析 API 返回的 block 列表，跳过无效数据 """
+    for raw in results:
+        block = Block.from_json(raw)
+        if block is not None:
+            yield block
+
+def iter_blocks(block_id, headers, page_size=MAX_PAGE_SIZE, prefetch=False, strict=False):
+    """ 与 iter_block_children 相同，但逐条产出 Block；每页的原始 JSON 解析后即可释放 """
+    return parse_blocks(iter_block_children(block_id, headers, page_size=page_size, prefetch=prefetch, strict=strict))
@@ -0,0 +1,333 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from Daom_Log import get_logger
+
+log = get_logger("cache")
+
+
+class TTLCache:
+    """
+    单值进程内缓存（stale-while-revalidate）：
+      - 首次 get() 或 invalidate() 之后的 get() 会同步调用 loader 加载
+      - 超过 ttl 后 get() 仍立即返回旧值，同时在后台线程刷新
+      - loader 返回 None 表示加载失败，此时保留旧值
+      - 传入 shared（SharedCache）时，加载前先读共享缓存，多个 worker 进程只有一个需要调用 loader；
+        invalidate() 会通知其他进程在下一次 get() 时丢弃本地副本。
+        共享缓存中的值按失效标记分别存放，失效前发起的加载即使稍后才写入，也不会被之后的 get() 读到
+    """
+
+    def __init__(self, loader, ttl=300, name="cache", shared=None):
+        self.loader = loader
+        self.ttl = ttl
+        self.name = name
+        self.shared = shared
+        self.shared_generation = None  # 最近一次见到的跨进程失效标记
+        self.value = None
+        self.loaded_at = None
+        self.generation = 0        # 每次 invalidate 递增，丢弃失效前发起的刷新结果
+        self.refreshing = False
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.counters = {"hits": 0, "stale_hits": 0, "loads": 0, "load_failures": 0, "invalidations": 0}
+
+    def get(self):
+        if self.shared is not None:
+            self._sync_shared_generation()
+        with self.lock:
+            if self.loaded_at is not None:
+                if time.monotonic() - self.loaded_at <= self.ttl:
+                    self.counters["hits"] += 1
+                    return self.value
+                self.counters["stale_hits"] += 1
+                if not self.refreshing:
+                    self.refreshing = True
+                    threading.Thread(target=self._refresh, name=f"{self.name}-refresh", daemon=True).start()
+                return self.value
+        return self._load_sync()
+
+    def _load_sync(self):
+        # 多个线程同时冷启动时只加载一次
+        with self.load_lock:
+            with self.lock:
+                if self.loaded_at is not None:
+                    return self.value
+            return self._load()
+
+    def _refresh(self):
+        try:
+            self._load()
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def _load(self):
+        with self.lock:
+            generation, marker = self.generation, self.shared_generation
+        shared_key = self._shared_key(marker)
+        value = self.shared.get(shared_key) if self.shared is not None else None
+        loaded = False
+        if value is None:
+            try:
+                value = self.loader()
+            except Exception as e:
+                log.error("❌ 缓存加载异常", cache=self.name, error=repr(e))
+                value = None
+            loaded = value is not None and self.shared is not None
+        with self.lock:
+            if value is None:
+                self.counters["load_failures"] += 1
+            elif generation == self.generation:
+                # 加载期间本进程或其他进程调用过 invalidate() 时，结果已经过期，不写入共享缓存
+                if loaded and self.shared.get(f"{self.name}:generation") == marker:
+                    self.shared.set(shared_key, value, ttl=self.ttl)
+                self.value = value
+                self.loaded_at = time.monotonic()
+                self.counters["loads"] += 1
+            return self.value
+
+    def _shared_key(self, marker):
+        return f"{self.name}:value:{marker}" if marker else self.name
+
+    def invalidate(self):
+        """ 强制失效：下一次 get() 会同步重新加载 """
+        with self.lock:
+            self.loaded_at = None
+            self.generation += 1
+            self.counters["invalidations"] += 1
+        if self.shared is not None:
+            marker = uuid.uuid4().hex
+            with self.lock:
+                previous, self.shared_generation = self.shared_generation, marker
+            self.shared.set(f"{self.name}:generation", marker)
+            self.shared.delete(self._shared_key(previous))
+        log.info("♻️ 缓存已失效", cache=self.name)
+
+    def _sync_shared_generation(self):
+        """ 其他进程调用过 invalidate() 时，丢弃本地副本 """
+        marker = self.shared.get(f"{self.name}:generation")
+        with self.lock:
+            if marker == self.shared_generation:
+                return
+            self.shared_generation = marker
+            self.loaded_at = None
+            self.generation += 1
+
+    def stats(self):
+        with self.lock:
+            age = time.monotonic() - self.loaded_at if self.loaded_at is not None else None
+            return {
+                "name": self.name,
+                "ttl": self.ttl,
+                "age": round(age, 1) if age is not None else None,
+                "refreshing": self.refreshing,
+                "counters": dict(self.counters),
+            }
+
+
+class LRUCache:
+    """
+    线程安全的定长 LRU 缓存，超出 maxsize 时淘汰最久未使用的条目。
+    传入 shared（SharedCache）时作为其前面的进程内一级缓存：本地未命中再查共享缓存，
+    set() 同时写入两级，其他 worker 进程可以直接复用。键与值需可 JSON 序列化（元组读回后为列表）。
+    """
+
+    def __init__(self, maxsize=1024, shared=None, namespace="lru", ttl=None):
+        self.maxsize = maxsize
+        self.shared = shared
+        self.namespace = namespace
+        self.ttl = ttl  # 共享缓存中条目的过期时间（秒），None 表示不过期
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "shared_hits": 0}
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.counters["hits"] += 1
+                return self.data[key]
+        if self.shared is not None:
+            value = self.shared.get(self._shared_key(key))
+            if value is not None:
+                self._set_local(key, value)
+                with self.lock:
+                    self.counters["shared_hits"] += 1
+                return value
+        with self.lock:
+            self.counters["misses"] += 1
+        return default
+
+    def set(self, key, value):
+        self._set_local(key, value)
+        if self.shared is not None:
+            self.shared.set(self._shared_key(key), value, ttl=self.ttl)
+
+    def _set_local(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def _shared_key(self, key):
+        return f"{self.namespace}:{json.dumps(key, ensure_ascii=False)}"
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.data), "maxsize": self.maxsize, "counters": dict(self.counters)}
+
+
+SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class SharedCache:
+    """
+    跨进程共享缓存（SQLite 文件，WAL 模式），供多 worker 部署（gunicorn 等 pre-fork 服务器）使用：
+      - get() / set() / delete()：值以 JSON 存储，可设置过期时间（墙钟时间，各进程一致）
+      - update(key, fn)：原子地读-改-写（持有数据库写锁，其他进程的写入等待）
+      - items(prefix)：列出某个前缀下所有未过期的条目（如各 worker 发布的统计快照）
+      - lease(key)：跨进程互斥锁，持有进程异常退出时 ttl 秒后自动释放；长时间持有时用 renew_lease() 续期
+      - purge()：过期条目不会自动删除，需定期调用以回收空间
+    WAL 模式下读不阻塞写，多个进程可同时读取。每个线程使用独立连接，fork 之后在子进程中重新连接。
+    """
+
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = os.path.abspath(path)  # 其他线程稍后才建立连接，不能受当时工作目录影响
+        self.busy_timeout = busy_timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "writes": 0}
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.executescript(SHARED_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key, default=None):
+        row = self._conn().execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        hit = row is not None and (row[1] is None or row[1] > time.time())
+        with self.lock:
+            self.counters["hits" if hit else "misses"] += 1
+        return json.loads(row[0]) if hit else default
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        raw = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, raw, expires_at))
+        with self.lock:
+            self.counters["writes"] += 1
+
+    def update(self, key, fn, ttl=None):
+        """
+        原子地读-改-写：fn(当前值，不存在或已过期时为 None) 返回新值，返回 None 表示删除该条目。
+        返回新值。fn 在事务中执行，应只做内存计算。
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            current = json.loads(row[0]) if row is not None and (row[1] is None or row[1] > now) else None
+            value = fn(current)
+            if value is None:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            else:
+                conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                             (key, json.dumps(value, ensure_ascii=False, separators=(",", ":")),
+                              now + ttl if ttl else None))
+        with self.lock:
+            self.counters["writes"] += 1
+        return value
+
+    def items(self, prefix):
+        """ 返回 {键: 值}，只包含以 prefix 开头且未过期的条目 """
+        rows = self._conn().execute(
+            "SELECT key, value FROM cache WHERE substr(key, 1, ?) = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (len(prefix), prefix, time.time()),
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def delete(self, key):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def purge(self):
+        """ 删除已过期的条目与租约（持有进程异常退出后遗留的），返回删除的条目数 """
+        conn = self._conn()
+        with conn:
+            now = time.time()
+            conn.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+            return conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,)).rowcount
+
+    @contextlib.contextmanager
+    def lease(self, key, ttl=60.0, poll=0.05):
+        """ 跨进程互斥：with shared.lease("page:xxx") as owner: ...；已被其他进程持有时轮询等待 """
+        owner = self.acquire_lease(key, ttl, poll)
+        try:
+            yield owner
+        finally:
+            self.release_lease(key, owner)
+
+    def acquire_lease(self, key, ttl=60.0, poll=0.05):
+        """ 阻塞到取得租约，返回 owner（释放时使用）；获取与释放可以在不同线程中调用 """
+        while True:
+            owner = self.try_acquire_lease(key, ttl)
+            if owner:
+                return owner
+            time.sleep(poll)
+
+    def try_acquire_lease(self, key, ttl=60.0):
+        """ 不等待：取得租约时返回 owner，已被其他持有者占用时返回 None（asyncio 调用方自行 await 重试） """
+        owner = uuid.uuid4().hex
+        conn = self._conn()
+        with conn:
+            now = time.time()
+            conn.execute("DELETE FROM leases WHERE key = ? AND expires_at < ?", (key, now))
+            acquired = conn.execute("INSERT OR IGNORE INTO leases VALUES (?, ?, ?)",
+                                    (key, owner, now + ttl)).rowcount
+        return owner if acquired else None
+
+    def renew_lease(self, key, owner, ttl=60.0):
+        """ 将仍由 owner 持有的租约延长到 ttl 秒后，返回是否成功（已过期并被其他持有者取得时返回 False） """
+        conn = self._conn()
+        with conn:
+            return bool(conn.execute("UPDATE leases SET expires_at = ? WHERE key = ? AND owner = ?",
+                                     (time.time() + ttl, key, owner)).rowcount)
+
+    def release_lease(self, key, owner):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+    def stats(self):
+        size = self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        with self.lock:
+            return {"path": self.path, "size": size, "counters": dict(self.counters)}
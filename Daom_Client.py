@@ -0,0 +1,443 @@
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from Daom_Log import get_logger
+from Daom_Metrics import metrics
+
+log = get_logger("client")
+
+OFFICIAL_API_URL = "https://api.notion.com/v1"
+# 可通过环境变量指向本地的 Daom_FakeNotion 服务，用于离线测试与基准测试
+NOTION_API_URL = os.environ.get("NOTION_API_URL", OFFICIAL_API_URL).rstrip("/")
+MAX_PAGE_SIZE = 100  # Notion 列表接口单页上限
+
+# ========== 连接池与限速配置 ==========
+RATE_LIMIT = 3.0       # 每秒平均请求数（Notion 限制约 3 次/秒）
+RATE_BURST = 3         # 令牌桶容量，允许的瞬时突发请求数
+POOL_SIZE = 10         # keep-alive 连接池大小
+REQUEST_TIMEOUT = 30   # 单次请求超时（秒）
+
+# ========== 重试与熔断配置 ==========
+RETRY_STATUSES = {409, 429, 500, 502, 503, 504}  # 可重试的状态码（409 为 Notion 的写冲突）
+# 非幂等的写接口（创建页面、追加 children 等）：5xx 或读超时时请求可能已经生效，重试会重复写入，
+# 只重试确定没有生效的情况：429、409 与连接未建立
+UNSAFE_RETRY_STATUSES = {409, 429}
+READ_ONLY_POSTS = {"POST /databases/{id}/query", "POST /search"}  # 只读的 POST 接口，按幂等处理
+NON_IDEMPOTENT = {"PATCH /blocks/{id}/children"}  # 非 POST 的非幂等接口
+MAX_RETRIES = 5            # 单次调用的最大重试次数
+BACKOFF_BASE = 0.5         # 指数退避的基础等待（秒）
+BACKOFF_MAX = 30.0         # 单次退避的最大等待（秒）
+RETRY_BUDGET = 30          # 每个接口在 RETRY_BUDGET_WINDOW 秒内最多重试的次数
+RETRY_BUDGETS = {          # 个别接口单独设置重试预算，键为接口模板
+    "POST /databases/{id}/query": 60,
+    "PATCH /blocks/{id}/children": 60,
+}
+RETRY_BUDGET_WINDOW = 60.0
+BREAKER_THRESHOLD = 5      # 某接口连续失败（5xx / 网络错误）多少次后熔断
+BREAKER_COOLDOWN = 30.0    # 熔断后多少秒再放行一次试探请求
+
+
+# ========== 令牌桶限速 ==========
+class TokenBucket:
+    """
+    线程安全的令牌桶：
+      - 以 rate 个/秒的速度补充令牌，最多积累 capacity 个
+      - acquire() 取走一个令牌，没有令牌时阻塞到下一个令牌可用
+      - try_acquire() 不阻塞，返回还需等待的秒数（供 asyncio 调用方 await asyncio.sleep）
+      - pause(seconds) 在收到 429 + Retry-After 时清空令牌并暂停所有线程
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """ 有令牌时取走并返回 0，否则返回下一个令牌可用前需要等待的秒数 """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + seconds)
+            self.tokens = 0
+            self.updated = self.paused_until
+
+
+bucket = TokenBucket(RATE_LIMIT, RATE_BURST)
+counters = {"requests": 0, "throttled": 0, "retries": 0, "short_circuited": 0}
+counters_lock = threading.Lock()
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE))
+session.mount("http://", HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE))
+
+def configure(rate=None, burst=None, pool_size=None):
+    """ 调整全局限速与连接池大小（所有脚本、所有线程共享） """
+    global bucket
+    if rate is not None or burst is not None:
+        bucket = TokenBucket(rate or bucket.rate, burst or bucket.capacity)
+    if pool_size is not None:
+        for prefix in ("https://", "http://"):
+            session.mount(prefix, HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+
+
+# ========== 重试预算与熔断 ==========
+PROPERTY_PATTERN = re.compile(r"/properties/[^/]+")
+ID_PATTERN = re.compile(r"/[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}(?=/|$)")
+
+def is_idempotent(endpoint):
+    """ 接口重复调用是否安全（决定 5xx 与超时能否重试） """
+    if endpoint in READ_ONLY_POSTS:
+        return True
+    return not endpoint.startswith("POST ") and endpoint not in NON_IDEMPOTENT
+
+def endpoint_key(method, url):
+    """ 把 URL 归一成接口模板，如 PATCH /blocks/{id}/children """
+    path = url.split("?", 1)[0]
+    for base in (NOTION_API_URL, OFFICIAL_API_URL):
+        if path.startswith(base):
+            path = path[len(base):]
+            break
+    path = PROPERTY_PATTERN.sub("/properties/{property_id}", ID_PATTERN.sub("/{id}", path))
+    return f"{method.upper()} {path}"
+
+class RetryBudget:
+    """ 每个接口在滑动窗口内的重试次数上限，避免大面积故障时重试放大请求量 """
+
+    def __init__(self, window=RETRY_BUDGET_WINDOW):
+        self.window = window
+        self.spent = {}  # 接口模板 -> 重试时间戳队列
+        self.lock = threading.Lock()
+
+    def take(self, endpoint):
+        limit = RETRY_BUDGETS.get(endpoint, RETRY_BUDGET)
+        now = time.monotonic()
+        with self.lock:
+            spent = self.spent.setdefault(endpoint, deque())
+            while spent and now - spent[0] > self.window:
+                spent.popleft()
+            if len(spent) >= limit:
+                return False
+            spent.append(now)
+            return True
+
+class CircuitBreaker:
+    """
+    按接口熔断：连续失败 threshold 次后打开，cooldown 秒内直接拒绝请求；
+    冷却结束后放行一次试探请求，成功则恢复，失败则继续熔断。
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = {}  # 接口模板 -> {"failures", "opened_at", "probing"}
+        self.lock = threading.Lock()
+
+    def allow(self, endpoint):
+        with self.lock:
+            st = self.state.get(endpoint)
+            if not st or st["opened_at"] is None:
+                return True
+            if time.monotonic() - st["opened_at"] < self.cooldown or st["probing"]:
+                return False
+            st["probing"] = True
+            return True
+
+    def record(self, endpoint, ok):
+        with self.lock:
+            st = self.state.setdefault(endpoint, {"failures": 0, "opened_at": None, "probing": False})
+            st["probing"] = False
+            if ok:
+                st["failures"] = 0
+                st["opened_at"] = None
+                return
+            st["failures"] += 1
+            if st["failures"] >= self.threshold:
+                if st["opened_at"] is None:
+                    log.error("🚫 接口熔断", endpoint=endpoint, failures=st["failures"], cooldown=self.cooldown)
+                st["opened_at"] = time.monotonic()
+
+    def open_endpoints(self):
+        with self.lock:
+            return [e for e, st in self.state.items() if st["opened_at"] is not None]
+
+retry_budget = RetryBudget()
+breaker = CircuitBreaker()
+
+
+# ========== 请求入口 ==========
+def request(method, url, retry_statuses=(), **kwargs):
+    """
+    所有 Notion 调用的统一入口，用法与 requests.request 相同：
+      - 复用 keep-alive 连接池，发送前从共享令牌桶取令牌
+      - 429 / 409 / 5xx 和网络错误按统一策略重试：指数退避 + 随机抖动，有 Retry-After 时以其为准；
+        非幂等接口（POST /pages、追加 children 等）只重试 429 / 409 和连接未建立的错误
+      - 429 会暂停共享令牌桶，所有线程一起降速
+      - 每个接口有独立的重试预算和熔断器，熔断期间直接返回 503 响应
+    retry_statuses 可额外指定需要重试的状态码（如刚创建的页面可能短暂 404）。
+    返回的响应带有 retries 属性，记录这次调用重试了几次。
+    """
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    url = resolve_url(url)
+    endpoint = endpoint_key(method, url)
+    idempotent = is_idempotent(endpoint)
+    retryable = (RETRY_STATUSES if idempotent else UNSAFE_RETRY_STATUSES).union(retry_statuses)
+    attempt = 0
+    while True:
+        if not breaker.allow(endpoint):
+            return _short_circuit(url, endpoint, attempt)
+        waited = time.perf_counter()
+        bucket.acquire()
+        started = time.perf_counter()
+        metrics.observe_wait(started - waited)
+        resp = error = None
+        try:
+            resp = session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            error = e
+        finally:
+            # 任何异常都要记录，否则熔断器的试探状态不会被清除，接口会一直处于熔断中
+            _record_attempt(endpoint, resp, error, time.perf_counter() - started)
+
+        retry_error = isinstance(error, (requests.ConnectionError, requests.Timeout)) and (
+            idempotent or connect_failed(error))
+        delay = _retry_delay(endpoint, attempt, resp, error, retryable, retry_error)
+        if delay is None:
+            if error is not None:
+                raise error
+            resp.retries = attempt
+            return resp
+        attempt += 1
+        time.sleep(delay)
+
+# request() 的各个步骤，Daom_Async 的异步客户端共用同一套限速、重试与熔断策略
+def _short_circuit(url, endpoint, attempt):
+    with counters_lock:
+        counters["short_circuited"] += 1
+    resp = _breaker_response(url, endpoint)
+    resp.retries = attempt
+    return resp
+
+def _record_attempt(endpoint, resp, error, seconds):
+    """ 记录一次实际发出的请求：指标、计数与熔断状态 """
+    status = resp.status_code if resp is not None else None
+    metrics.observe_request(endpoint, status, seconds)
+    with counters_lock:
+        counters["requests"] += 1
+        if status == 429:
+            counters["throttled"] += 1
+    # 只有服务端错误和网络错误（以及请求过程中抛出的其他异常）计入熔断；429 / 409 / 4xx 说明接口本身可用
+    breaker.record(endpoint, ok=status is not None and status < 500)
+
+def connect_failed(error):
+    """ requests 的网络错误是否发生在连接建立之前（此时请求肯定没有发出，非幂等请求也可以重试） """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+def _retry_delay(endpoint, attempt, resp, error, retryable, retry_error=True):
+    """
+    需要重试时返回重试前应等待的秒数（429 已暂停共享令牌桶，返回 0），不重试时返回 None。
+    retry_error：调用方判断的这次网络错误能否重试（非幂等请求只有连接未建立时可以）。
+    """
+    status = resp.status_code if resp is not None else None
+    if error is not None and not retry_error:
+        return None
+    if error is None and status not in retryable:
+        return None
+    if attempt >= MAX_RETRIES or not retry_budget.take(endpoint):
+        return None
+    delay = _backoff(attempt, resp)
+    with counters_lock:
+        counters["retries"] += 1
+    reason = f"{status}" if error is None else type(error).__name__
+    log.warning("⚠️ 请求重试", endpoint=endpoint, reason=reason, delay=round(delay, 2), attempt=attempt + 1, max_retries=MAX_RETRIES)
+    if status == 429:
+        bucket.pause(delay)
+        return 0.0
+    return delay
+
+def resolve_url(url):
+    """ 脚本中写死的官方地址在配置了 NOTION_API_URL 时改写到对应地址 """
+    if NOTION_API_URL != OFFICIAL_API_URL and url.startswith(OFFICIAL_API_URL):
+        return NOTION_API_URL + url[len(OFFICIAL_API_URL):]
+    return url
+
+def _backoff(attempt, resp):
+    """ Retry-After 优先；否则为 full-jitter 指数退避 """
+    if resp is not None and resp.headers.get("Retry-After"):
+        try:
+            return max(float(resp.headers["Retry-After"]), 0.0)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+def _breaker_response(url, endpoint):
+    resp = requests.Response()
+    resp.status_code = 503
+    resp.url = url
+    resp.headers["Retry-After"] = str(int(BREAKER_COOLDOWN))
+    resp._content = json.dumps({"object": "error", "code": "circuit_open", "message": f"{endpoint} 已熔断"}).encode()
+    return resp
+
+def stats():
+    """ 进程内累计的请求、429、重试与熔断次数 """
+    with counters_lock:
+        return dict(counters, open_circuits=breaker.open_endpoints())
+
+def _register_metrics():
+    """ 限速配置、重试与熔断状态作为回调指标挂到 /metrics 上 """
+    metrics.gauge("daom_rate_limit_per_second", "客户端令牌桶速率（次/秒）", lambda: bucket.rate)
+    metrics.gauge("daom_rate_limit_burst", "客户端令牌桶容量", lambda: bucket.capacity)
+    metrics.gauge("daom_notion_retries_total", "Notion 请求重试次数", lambda: stats()["retries"], kind="counter")
+    metrics.gauge("daom_notion_short_circuited_total", "因熔断未发出的请求数",
+                  lambda: stats()["short_circuited"], kind="counter")
+    metrics.gauge("daom_notion_circuit_open", "处于熔断状态的接口（1 为熔断中）",
+                  lambda: {(e,): 1 for e in breaker.open_endpoints()}, labels=("endpoint",), merge="max")
+
+_register_metrics()
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+def patch(url, **kwargs):
+    return request("PATCH", url, **kwargs)
+
+def delete(url, **kwargs):
+    return request("DELETE", url, **kwargs)
+
+
+# ========== 分页迭代 ==========
+class PaginationError(RuntimeError):
+    """ strict 分页中途失败（已 yield 的结果不完整） """
+
+def iter_paginated(method, url, headers, body=None, page_size=MAX_PAGE_SIZE, prefetch=False, strict=False):
+    """
+    按 has_more / next_cursor 逐页请求 Notion 列表接口，每取到一页就逐条 yield 结果。
+      - GET 接口（如 block children）通过查询参数分页，POST 接口（如 query / search）通过请求体分页
+      - prefetch=True 时在后台线程提前拉取下一页，调用方处理当前页的同时下一页已在路上
+      - 请求失败时打印错误并结束迭代；strict=True 时改为抛出 PaginationError，便于调用方区分“读完”与“读了一半”
+    内存中最多保留一到两页结果，而不是整个列表。
+    """
+    pages = _iter_result_pages(method, url, headers, body, page_size, strict)
+    if prefetch:
+        pages = _prefetch(pages)
+    for results in pages:
+        yield from results
+
+def _iter_result_pages(method, url, headers, body, page_size, strict=False):
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    cursor = None
+    while True:
+        if method == "GET":
+            params = {"page_size": page_size}
+            if cursor:
+                params["start_cursor"] = cursor
+            resp = get(url, headers=headers, params=params)
+        else:
+            payload = dict(body or {}, page_size=page_size)
+            if cursor:
+                payload["start_cursor"] = cursor
+            resp = request(method, url, headers=headers, json=payload)
+        if resp.status_code != 200:
+            log.error("❌ 分页请求失败", endpoint=endpoint_key(method, url), status=resp.status_code, body=resp.text)
+            if strict:
+                raise PaginationError(f"{endpoint_key(method, url)} 返回 {resp.status_code}")
+            return
+        data = resp.json()
+        yield data.get("results", [])
+        cursor = data.get("next_cursor")
+        if not data.get("has_more") or not cursor:
+            return
+
+def _prefetch(pages, depth=1):
+    """ 在后台线程中消费 pages 生成器，最多提前缓冲 depth 页 """
+    buf = queue.Queue(maxsize=depth)
+    done = object()
+
+    def producer():
+        try:
+            for results in pages:
+                buf.put(results)
+        except Exception as e:
+            buf.put(e)  # 交给调用方线程重新抛出（如 PaginationError）
+        finally:
+            buf.put(done)
+
+    threading.Thread(target=producer, name="notion-prefetch", daemon=True).start()
+    while True:
+        results = buf.get()
+        if results is done:
+            return
+        if isinstance(results, Exception):
+            raise results
+        yield results
+
+def iter_database_pages(database_id, headers, filter=None, sorts=None, page_size=MAX_PAGE_SIZE, prefetch=False,
+                        strict=False):
+    """ 逐条迭代数据库中的页面，可附带 filter / sorts（strict=True 时中途失败抛出 PaginationError） """
+    body = {}
+    if filter:
+        body["filter"] = filter
+    if sorts:
+        body["sorts"] = sorts
+    url = f"{NOTION_API_URL}/databases/{database_id}/query"
+    return iter_paginated("POST", url, headers, body=body, page_size=page_size, prefetch=prefetch, strict=strict)
+
+def iter_block_children(block_id, headers, page_size=MAX_PAGE_SIZE, prefetch=False, strict=False):
+    """ 逐条迭代页面或 block 的子 block（strict=True 时中途失败抛出 PaginationError） """
+    url = f"{NOTION_API_URL}/blocks/{block_id}/children"
+    return iter_paginated("GET", url, headers, page_size=page_size, prefetch=prefetch, strict=strict)
+
+def iter_property_items(page_id, property_id, headers, page_size=MAX_PAGE_SIZE):
+    """
+    逐条迭代页面属性的完整取值（GET /pages/{id}/properties/{property_id}），
+    用于 relation / rollup / people 等在页面对象中最多只返回 25 个的属性。中途失败时抛出 PaginationError。
+    """
+    url = f"{NOTION_API_URL}/pages/{page_id}/properties/{property_id}"
+    return iter_paginated("GET", url, headers, page_size=page_size, strict=True)
+
+def iter_search(headers, query="", object_type=None, sort=None, page_size=MAX_PAGE_SIZE, strict=False):
+    """ 逐条迭代 /search 结果；object_type 可为 "database" 或 "page"（strict=True 时中途失败抛出 PaginationError） """
+    body = {"query": query}
+    if object_type:
+        body["filter"] = {"value": object_type, "property": "object"}
+    if sort:
+        body["sort"] = sort
+    return iter_paginated("POST", f"{NOTION_API_URL}/search", headers, body=body, page_size=page_size, strict=strict)
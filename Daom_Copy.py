@@ -1,177 +1,762 @@
-import requests
-import time
-
-# Notion API 配置
-NOTION_API_KEY = "YOUR API KEY"
-SOURCE_DATABASE_ID = "SOURCE DATABASE ID"
-TARGET_DATABASE_ID = "TARGET DATABASE ID"
-
-
-headers = {
-    "Authorization": f"Bearer {NOTION_API_KEY}",
-    "Content-Type": "application/json",
-    "Notion-Version": "2022-06-28"
-}
-
-# 映射源数据库和目标数据库的字段
-properties_map = {
-    "Name": "Name",
-    "Multi-select": "slect",   # 源数据库 `n1` 对应目标数据库 `n2`
-    "Date 1": "Date",  # `date` 对应 `created_at`
-    "Value 1": "V"  # `status` 对应 `progress`
-}
-
-def get_page_content(page_id):
-    """ 获取 Notion 页面 Block 内容 """
-    url = f"https://api.notion.com/v1/blocks/{page_id}/children"
-    response = requests.get(url, headers=headers)
-
-    if response.status_code == 200:
-        return response.json().get("results", [])  # ✅ 确保返回 Block 列表
-    else:
-        print(f"❌ 获取页面内容失败: {response.text}")
-        return []
-
-
-# 获取数据库中的所有页面
-def get_database_pages(database_id):
-    """ 获取数据库中的所有页面 """
-    url = f"https://api.notion.com/v1/databases/{database_id}/query"
-    response = requests.post(url, headers=headers)
-
-    if response.status_code == 200:
-        return response.json().get("results", [])
-    else:
-        print(f"❌ 获取数据库数据失败: {response.text}")
-        return []
-
-# 获取页面的内容
-def get_database_properties(database_id):
-    """ 获取目标数据库的字段列表 """
-    url = f"https://api.notion.com/v1/databases/{database_id}"
-    response = requests.get(url, headers=headers)
-
-    if response.status_code == 200:
-        properties = response.json().get("properties", {})
-        return list(properties.keys())  # 返回字段名称列表
-    else:
-        print(f"❌ 无法获取目标数据库属性: {response.text}")
-        return []
-
-
-# 复制页面到目标数据库
-def copy_page(source_page, target_database_id):
-    """ 复制页面到目标数据库，使用属性映射 """
-    properties = source_page.get("properties", {})
-
-    if not properties:
-        print(f"⚠️ 页面 {source_page['id']} 没有 properties，跳过复制")
-        return None
-
-    # 获取目标数据库的字段列表
-    target_properties = get_database_properties(target_database_id)
-
-    valid_properties = {}
-    for key, value in properties.items():
-        # ✅ 仅复制 `properties_map` 里定义的字段，并且目标数据库存在该字段
-        if key in properties_map and properties_map[key] in target_properties:
-            new_key = properties_map[key]  # 目标数据库的字段名称
-            prop_type = value["type"]  # 获取源数据库字段类型
-            
-            # 处理不同类型的数据，确保格式正确
-            if prop_type == "title":
-                valid_properties[new_key] = {"title": value["title"]}
-            elif prop_type == "rich_text":
-                valid_properties[new_key] = {"rich_text": value["rich_text"]}
-            elif prop_type == "number":
-                valid_properties[new_key] = {"number": value["number"]}
-            elif prop_type == "select":
-                valid_properties[new_key] = {"select": value["select"]}
-            elif prop_type == "multi_select":
-                valid_properties[new_key] = {"multi_select": value["multi_select"]}
-            elif prop_type == "date":
-                valid_properties[new_key] = {"date": value["date"]}
-            elif prop_type == "checkbox":
-                valid_properties[new_key] = {"checkbox": value["checkbox"]}
-            elif prop_type == "email":
-                valid_properties[new_key] = {"email": value["email"]}
-            elif prop_type == "phone_number":
-                valid_properties[new_key] = {"phone_number": value["phone_number"]}
-            elif prop_type == "url":
-                valid_properties[new_key] = {"url": value["url"]}
-            else:
-                print(f"⚠️ 无法处理字段类型: {key} ({prop_type})，跳过")
-        else:
-            print(f"⚠️ 忽略字段: {key} -> 无映射或目标数据库无对应字段")
-
-    # 确保 `valid_properties` 不为空，否则跳过复制
-    if not valid_properties:
-        print(f"⚠️ 页面 {source_page['id']} 没有可复制的 properties，跳过")
-        return None
-
-    # 创建新页面数据
-    new_page_data = {
-        "parent": {"database_id": target_database_id},
-        "properties": valid_properties
-    }
-
-    url = "https://api.notion.com/v1/pages"
-    response = requests.post(url, json=new_page_data, headers=headers)
-
-    if response.status_code == 200:
-        new_page_id = response.json()["id"]
-        print(f"✅ 页面复制成功: {new_page_id}")
-        return new_page_id
-    else:
-        print(f"❌ 页面复制失败: {response.text}")
-        return None
-
-# 复制 Notion 数据库中的所有页面
-def copy_database(source_database_id, target_database_id):
-    pages = get_database_pages(source_database_id)
-    
-    for page in pages:
-        page_id = page["id"]
-        print(f"正在复制页面: {page_id}")
-
-        new_page_id = copy_page(page, target_database_id)
-
-        if new_page_id:
-            content = get_page_content(page_id)
-            for block in content:
-                copy_block(new_page_id, block)
-
-        time.sleep(1)  # 避免 Notion API 速率限制
-
-# 复制 Block
-def copy_block(page_id, block):
-    """ 复制 Notion 页面 Block 内容 """
-    if not isinstance(block, dict) or "type" not in block:
-        print(f"⚠️ 无效的 block 数据，跳过: {block}")
-        return
-    
-    url = f"https://api.notion.com/v1/blocks/{page_id}/children"
-
-    block_type = block["type"]
-    if block_type not in block:
-        print(f"⚠️ 无法复制 block: {block}")
-        return
-
-    new_block = {
-        "children": [{
-            "object": "block",
-            "type": block_type,
-            block_type: block.get(block_type, {})
-        }]
-    }
-
-    response = requests.patch(url, json=new_block, headers=headers)
-
-    if response.status_code == 200:
-        print(f"✅ Block 复制成功")
-    else:
-        print(f"❌ Block 复制失败: {response.text}")
-
-
-# 开始执行
-copy_database(SOURCE_DATABASE_ID, TARGET_DATABASE_ID)
+import hashlib
+import json
+import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import Daom_Client as notion
+from Daom_Block import iter_blocks
+from Daom_Client import iter_database_pages, iter_property_items
+from Daom_Diff import diff_blocks, fingerprint_tree, summarize, update_payload
+from Daom_Index import resolve_database_id
+from Daom_Metrics import metrics
+from Daom_State import SyncStateStore
+
+# Notion API 配置
+NOTION_API_KEY = "YOUR API KEY"
+SOURCE_DATABASE_ID = "SOURCE DATABASE ID"
+TARGET_DATABASE_ID = "TARGET DATABASE ID"
+SOURCE_DATABASE_NAME = ""  # 非空时按名称从本地工作区索引解析数据库ID（先运行 Search DatabaseID.py 建立索引）
+TARGET_DATABASE_NAME = ""
+
+
+headers = {
+    "Authorization": f"Bearer {NOTION_API_KEY}",
+    "Content-Type": "application/json",
+    "Notion-Version": "2022-06-28"
+}
+
+# 映射源数据库和目标数据库的字段
+properties_map = {
+    "Name": "Name",
+    "Multi-select": "slect",   # 源数据库 `n1` 对应目标数据库 `n2`
+    "Date 1": "Date",  # `date` 对应 `created_at`
+    "Value 1": "V"  # `status` 对应 `progress`
+}
+
+PAGE_SIZE = 100  # 分页大小（Notion 上限 100）
+DEEP_COPY = True  # 递归复制 toggle、分栏、嵌套列表等子 block
+TREE_WORKERS = 4  # 深度复制时并发获取 / 写入兄弟子树的线程数
+COPY_WORKERS = 4  # 并发复制页面的线程数（1 表示逐页复制），所有线程共享同一个限速器
+PROGRESS_EVERY = 10  # 每完成多少页打印一次进度
+INCREMENTAL = False  # True 时只同步上次运行后有改动的页面（状态保存在 STATE_FILE）
+STATE_FILE = "daom_sync_state.sqlite3"
+DIFF_SYNC = True  # 增量同步已存在的页面时只写入有差异的 block（False 时清空后整页重新复制）
+METRICS_FILE = ""  # 非空时运行结束后写入 Prometheus 指标文本（供 node_exporter textfile collector 采集）
+
+def get_page_content(page_id):
+    """
+    逐条迭代 Notion 页面 Block 内容（自动翻页，每条解析为紧凑的 Daom_Block.Block）。
+    读取中途失败时抛出 PaginationError，不会把只读了一半的内容当作完整内容复制。
+    """
+    return iter_blocks(page_id, headers, page_size=PAGE_SIZE, strict=True)
+
+
+# 获取数据库中的所有页面
+def get_database_pages(database_id):
+    """ 逐条迭代数据库中的所有页面（自动翻页，后台预取下一页） """
+    return iter_database_pages(database_id, headers, page_size=PAGE_SIZE, prefetch=True)
+
+# 获取数据库字段结构（每个数据库每次运行只请求一次）
+_schema_cache = {}
+_plan_cache = {}
+_cache_lock = threading.Lock()
+
+def get_database_schema(database_id):
+    """ 获取数据库的字段结构 {字段名: 字段定义}，结果在进程内缓存 """
+    with _cache_lock:
+        if database_id in _schema_cache:
+            return _schema_cache[database_id]
+    url = f"https://api.notion.com/v1/databases/{database_id}"
+    response = notion.get(url, headers=headers)
+
+    if response.status_code != 200:
+        print(f"❌ 无法获取数据库属性: {response.text}")
+        return None
+    schema = response.json().get("properties", {})
+    with _cache_lock:
+        _schema_cache[database_id] = schema
+    return schema
+
+def get_database_properties(database_id):
+    """ 获取目标数据库的字段列表 """
+    return list((get_database_schema(database_id) or {}).keys())  # 返回字段名称列表
+
+
+# 属性转换
+RICH_TEXT_LIMIT = 100  # Notion 单个 rich_text / title 数组最多 100 个元素
+TEXT_CONTENT_LIMIT = 2000  # 单个 text 元素的 content 最多 2000 个字符
+TEXT_TYPES = {"title", "rich_text"}
+
+def convert_rich_text(items):
+    if len(items) <= RICH_TEXT_LIMIT:
+        return items
+    # 超出部分转为纯文本，按 2000 字符切分后接在保留的元素之后（这部分的格式会丢失）；
+    # 文字多时少保留几个原始元素，总数仍不超过 100 个，超过 100 * 2000 字符时才会截断
+    texts = [t.get("plain_text", "") for t in items]
+    keep = RICH_TEXT_LIMIT - 1
+    while keep > 0 and keep + math.ceil(sum(map(len, texts[keep:])) / TEXT_CONTENT_LIMIT) > RICH_TEXT_LIMIT:
+        keep -= 1
+    tail = "".join(texts[keep:])
+    chunks = [tail[i:i + TEXT_CONTENT_LIMIT] for i in range(0, len(tail), TEXT_CONTENT_LIMIT)]
+    if keep + len(chunks) > RICH_TEXT_LIMIT:
+        print(f"⚠️ 文本超过 {RICH_TEXT_LIMIT * TEXT_CONTENT_LIMIT} 个字符，超出部分被截断")
+        chunks = chunks[:RICH_TEXT_LIMIT - keep]
+    return items[:keep] + [{"type": "text", "text": {"content": c}} for c in chunks]
+
+def convert_option(option):
+    # 选项 ID 只在源数据库有效，按名称写入
+    return {"name": option["name"]} if option else None
+
+def convert_files(files):
+    # Notion 托管文件的链接会过期且不能通过 API 写入，只复制外部链接
+    return [f for f in files if f.get("type") == "external"]
+
+PROPERTY_CONVERTERS = {
+    "title": convert_rich_text,
+    "rich_text": convert_rich_text,
+    "number": lambda v: v,
+    "select": convert_option,
+    "status": convert_option,
+    "multi_select": lambda v: [{"name": o["name"]} for o in v],
+    "date": lambda v: v,
+    "checkbox": lambda v: v,
+    "email": lambda v: v,
+    "phone_number": lambda v: v,
+    "url": lambda v: v,
+    "relation": lambda v: [{"id": r["id"]} for r in v],
+    "people": lambda v: [{"object": "user", "id": u["id"]} for u in v],
+    "files": convert_files,
+}
+
+def compile_property_plan(source_schema, target_schema):
+    """
+    根据 properties_map 和两个数据库的字段结构生成转换计划：
+        [(源字段, 源类型, 目标字段, 目标类型, 转换函数)]
+    类型不兼容或无法写入的字段在这里一次性提示并排除。
+    """
+    plan = []
+    for source_key, target_key in properties_map.items():
+        source_type = source_schema.get(source_key, {}).get("type")
+        target_type = target_schema.get(target_key, {}).get("type")
+        if not source_type or not target_type:
+            print(f"⚠️ 忽略字段: {source_key} -> 无映射或目标数据库无对应字段")
+            continue
+        compatible = source_type == target_type or {source_type, target_type} <= TEXT_TYPES
+        if not compatible or source_type not in PROPERTY_CONVERTERS:
+            print(f"⚠️ 无法处理字段类型: {source_key} ({source_type} -> {target_type})，跳过")
+            continue
+        if source_type == "relation":
+            # 关联的页面 ID 只在指向同一个数据库时才有意义
+            source_related = source_schema[source_key].get("relation", {}).get("database_id")
+            target_related = target_schema[target_key].get("relation", {}).get("database_id")
+            if source_related != target_related:
+                print(f"⚠️ 关联字段指向不同的数据库: {source_key} ({source_related} -> {target_related})，跳过")
+                continue
+        plan.append((source_key, source_type, target_key, target_type, PROPERTY_CONVERTERS[source_type]))
+    return plan
+
+def get_property_plan(source_database_id, target_database_id):
+    """ 获取（并缓存）源数据库到目标数据库的属性转换计划 """
+    key = (source_database_id, target_database_id)
+    with _cache_lock:
+        if key in _plan_cache:
+            return _plan_cache[key]
+    source_schema = get_database_schema(source_database_id)
+    target_schema = get_database_schema(target_database_id)
+    if source_schema is None or target_schema is None:
+        return []
+    plan = compile_property_plan(source_schema, target_schema)
+    with _cache_lock:
+        _plan_cache[key] = plan
+    return plan
+
+TRUNCATED_TYPES = {"relation", "people"}  # 页面对象中最多返回 25 个，超出时 has_more 为 true
+
+def apply_property_plan(plan, properties, page_id=None):
+    """
+    按转换计划生成目标页面的 properties（除被截断的 relation / people 外只做字典转换，不发请求）。
+    relation / people 被截断时按 page_id 分页读取完整列表，读取失败时抛出 PaginationError（页面记为失败）。
+    """
+    valid_properties = {}
+    for source_key, source_type, target_key, target_type, convert in plan:
+        value = properties.get(source_key)
+        if not value or value.get("type") != source_type:
+            continue
+        items = value[source_type]
+        if source_type in TRUNCATED_TYPES and value.get("has_more"):
+            items = get_full_property(page_id, value, source_key)
+        valid_properties[target_key] = {target_type: convert(items)}
+    return valid_properties
+
+def get_full_property(page_id, value, name):
+    """ 读取被截断的 relation / people 属性的完整列表（GET /pages/{id}/properties/{property_id}） """
+    ptype = value["type"]
+    if not page_id:
+        raise notion.PaginationError(f"字段 {name} 已截断，缺少页面 ID，无法读取完整列表")
+    return [item[ptype] for item in iter_property_items(page_id, value["id"], headers) if item.get("type") == ptype]
+
+
+# 复制页面到目标数据库
+def copy_page(source_page, target_database_id, plan=None):
+    """ 复制页面到目标数据库，使用属性映射（plan 为空时按源页面所在数据库编译并缓存） """
+    properties = source_page.get("properties", {})
+
+    if not properties:
+        print(f"⚠️ 页面 {source_page['id']} 没有 properties，跳过复制")
+        return None
+
+    if plan is None:
+        source_database_id = source_page.get("parent", {}).get("database_id")
+        plan = get_property_plan(source_database_id, target_database_id) if source_database_id else []
+
+    valid_properties = apply_property_plan(plan, properties, source_page["id"])
+
+    # 确保 `valid_properties` 不为空，否则跳过复制
+    if not valid_properties:
+        print(f"⚠️ 页面 {source_page['id']} 没有可复制的 properties，跳过")
+        return None
+
+    # 创建新页面数据
+    new_page_data = {
+        "parent": {"database_id": target_database_id},
+        "properties": valid_properties
+    }
+
+    url = "https://api.notion.com/v1/pages"
+    response = notion.post(url, json=new_page_data, headers=headers)
+
+    if response.status_code == 200:
+        new_page_id = response.json()["id"]
+        print(f"✅ 页面复制成功: {new_page_id}")
+        return new_page_id
+    else:
+        print(f"❌ 页面复制失败: {response.text}")
+        return None
+
+# 复制 Notion 数据库中的所有页面
+@metrics.timed("copy_database")
+def copy_database(source_database_id, target_database_id, workers=COPY_WORKERS):
+    """
+    复制数据库中的所有页面：workers > 1 时多个页面在线程池中并发复制，
+    整体速度由 Daom_Client 的共享限速器决定。返回进度统计。
+    """
+    # 字段结构只获取一次，并预先编译属性转换计划
+    plan = get_property_plan(source_database_id, target_database_id)
+    if not plan:
+        print("❌ 没有可复制的字段映射，停止复制")
+        return None
+
+    pages = get_database_pages(source_database_id)
+    progress = CopyProgress()
+    for ok in run_page_jobs(pages, lambda page: copy_one_page(page, target_database_id, plan), workers):
+        progress.record(ok)
+
+    progress.report(final=True)
+    return progress.summary()
+
+def run_page_jobs(pages, job, workers):
+    """
+    对每个页面执行 job(page)，按完成顺序 yield 结果。
+    workers > 1 时在线程池中并发执行，同时最多排队 2 * workers 个页面，避免一次性读完整个数据库。
+    """
+    if workers <= 1:
+        for page in pages:
+            yield job(page)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for page in pages:
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            in_flight.add(executor.submit(job, page))
+        for future in wait(in_flight).done:
+            yield future.result()
+
+def copy_one_page(page, target_database_id, plan=None):
+    """ 复制单个页面（属性 + Block），返回是否成功（任一 Block 写入失败也算失败） """
+    page_id = page["id"]
+    print(f"正在复制页面: {page_id}")
+    try:
+        new_page_id = copy_page(page, target_database_id, plan)
+        return new_page_id is not None and copy_page_blocks(page_id, new_page_id)
+    except Exception as e:
+        print(f"❌ 复制页面 {page_id} 出错: {e!r}")
+        return False
+
+# 增量同步
+@metrics.timed("sync_database")
+def sync_database(source_database_id, target_database_id, store=None, workers=COPY_WORKERS):
+    """
+    增量同步：只处理上次同步后 last_edited_time 有变化的页面。
+      - 按 last_edited_time 过滤并升序查询源数据库（服务端过滤）
+      - 未同步过的页面新建；已同步且有改动的页面按差异更新属性与内容；未改动的跳过
+      - 源页面 -> 目标页面的映射与检查点保存在本地 SQLite（STATE_FILE）
+    请求数与改动量成正比，而不是与数据库大小成正比。
+    """
+    store = store or SyncStateStore(STATE_FILE)
+    plan = get_property_plan(source_database_id, target_database_id)
+    if not plan:
+        print("❌ 没有可复制的字段映射，停止同步")
+        return None
+
+    checkpoint = store.get_checkpoint(source_database_id, target_database_id)
+    previous_run = store.get_run_started(source_database_id, target_database_id)
+    run_started = time.strftime("%Y-%m-%dT%H:%M:00.000Z", time.gmtime())
+    # Notion 的 last_edited_time 精确到分钟：读取页面之后同一分钟内的再次编辑不会改变它。
+    # 因此用 on_or_after 查询，检查点不超过本次运行开始的那一分钟；
+    # 页面映射中的时间相同、但不早于上次运行开始那一分钟的页面仍重新处理（见 sync_one_page）
+    query_filter = {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": checkpoint}} if checkpoint else None
+    sorts = [{"timestamp": "last_edited_time", "direction": "ascending"}]
+    pages = iter_database_pages(source_database_id, headers, filter=query_filter, sorts=sorts,
+                                page_size=PAGE_SIZE, prefetch=True)
+    print(f"🔄 增量同步 {source_database_id} -> {target_database_id}，检查点: {checkpoint or '无（全量）'}")
+
+    progress = CopyProgress()
+    counts = {"created": 0, "updated": 0, "unchanged": 0, "failed": 0}
+    latest, earliest_failed = checkpoint, None
+    job = lambda page: (sync_one_page(page, source_database_id, target_database_id, plan, store, previous_run), page)
+    for status, page in run_page_jobs(pages, job, workers):
+        counts[status] += 1
+        progress.record(status != "failed")
+        edited = page.get("last_edited_time")
+        if status == "failed":
+            earliest_failed = min(earliest_failed or edited, edited)
+        elif edited and (latest is None or edited > latest):
+            latest = edited
+
+    # 有失败时检查点停在最早失败的页面，下次运行会重新处理它
+    new_checkpoint = earliest_failed or latest
+    if new_checkpoint:
+        new_checkpoint = min(new_checkpoint, run_started)
+        store.set_checkpoint(source_database_id, target_database_id, new_checkpoint, run_started)
+    progress.report(final=True)
+    print(f"🔄 新建 {counts['created']}，更新 {counts['updated']}，未改动 {counts['unchanged']}，失败 {counts['failed']}")
+    return dict(progress.summary(), **counts, checkpoint=new_checkpoint)
+
+def sync_one_page(page, source_database_id, target_database_id, plan, store, previous_run=None):
+    """
+    同步单个页面，返回 "created" / "updated" / "unchanged" / "failed"。
+    previous_run 为上次运行开始的那一分钟：last_edited_time 不早于它的页面可能在被读取后又编辑过（时间不变），
+    即使与映射中的时间相同也重新处理。
+    """
+    page_id = page["id"]
+    edited = page.get("last_edited_time")
+    try:
+        mapped = store.get_page(source_database_id, target_database_id, page_id)
+        if mapped and mapped[1] == edited and not (edited and previous_run and edited >= previous_run):
+            return "unchanged"
+        properties = apply_property_plan(plan, page.get("properties", {}), page_id)
+        properties_hash = hashlib.sha1(json.dumps(properties, sort_keys=True).encode()).hexdigest()
+        if mapped:
+            target_page_id = mapped[0]
+            print(f"正在更新页面: {page_id} -> {target_page_id}")
+            # 只改了正文时属性哈希不变，不再发送属性更新
+            if properties_hash != mapped[2] and not update_page(page, target_page_id, plan, properties):
+                return "failed"
+            if DIFF_SYNC:
+                if not sync_page_blocks(page_id, target_page_id):
+                    return "failed"
+            elif not (clear_page_blocks(target_page_id) and copy_page_blocks(page_id, target_page_id)):
+                return "failed"
+            status = "updated"
+        else:
+            print(f"正在复制页面: {page_id}")
+            target_page_id = copy_page(page, target_database_id, plan)
+            if not target_page_id:
+                return "failed"
+            if not copy_page_blocks(page_id, target_page_id):
+                # 页面已创建但内容不完整：记录映射（不记录编辑时间），下次运行按差异补齐，而不是再建一个页面
+                store.set_page(source_database_id, target_database_id, page_id, target_page_id, None, properties_hash)
+                return "failed"
+            status = "created"
+        store.set_page(source_database_id, target_database_id, page_id, target_page_id, edited, properties_hash)
+        return status
+    except Exception as e:
+        print(f"❌ 同步页面 {page_id} 出错: {e!r}")
+        return "failed"
+
+def update_page(source_page, target_page_id, plan, valid_properties=None):
+    """ 按转换计划更新已存在的目标页面属性（可传入已转换好的属性） """
+    if valid_properties is None:
+        valid_properties = apply_property_plan(plan, source_page.get("properties", {}), source_page["id"])
+    url = f"https://api.notion.com/v1/pages/{target_page_id}"
+    response = notion.patch(url, json={"properties": valid_properties}, headers=headers)
+    if response.status_code == 200:
+        print(f"✅ 页面属性更新成功: {target_page_id}")
+        return True
+    print(f"❌ 页面属性更新失败: {response.text}")
+    return False
+
+def clear_page_blocks(page_id):
+    """ 删除页面的全部顶层 block（重新复制内容前调用），全部删除成功时返回 True """
+    ok = True
+    for block in list(get_page_content(page_id)):
+        response = notion.delete(f"https://api.notion.com/v1/blocks/{block.id}", headers=headers)
+        if response.status_code != 200:
+            print(f"❌ 删除 Block {block.id} 失败: {response.text}")
+            ok = False
+    return ok
+
+# 按差异同步页面内容
+def sync_page_blocks(source_page_id, target_page_id):
+    """
+    对比源页面与目标页面的 block 树（按类型、规范化内容与子树哈希），只执行差异部分：
+    修改过的 block 原地 PATCH，新增的插入到对应位置之后，多余的删除。
+    全部操作成功时返回 True。
+    """
+    with ThreadPoolExecutor(max_workers=TREE_WORKERS) as executor:
+        source = fetch_block_tree(source_page_id, executor, deep=DEEP_COPY)
+        target = fetch_block_tree(target_page_id, executor, deep=DEEP_COPY)
+        fingerprint_tree(source)
+        fingerprint_tree(target)
+        ops = diff_blocks(target_page_id, source, target)
+        if not ops:
+            print(f"⏭️ 页面内容无差异: {target_page_id}")
+            return True
+        counts = summarize(ops)
+        print(f"🔄 页面 {target_page_id} 内容差异：更新 {counts['update']}，插入 {counts['insert']}，删除 {counts['delete']}")
+        return apply_edit_script(ops, executor)
+
+def apply_edit_script(ops, executor):
+    """ 执行 diff_blocks 生成的操作：先更新与插入（以保留的 block 为锚点），最后删除 """
+    def run(op):
+        if op[0] == "update":
+            url = f"https://api.notion.com/v1/blocks/{op[1]}"
+            response = notion.patch(url, json=update_payload(op[2]), headers=headers)
+        elif op[0] == "delete":
+            response = notion.delete(f"https://api.notion.com/v1/blocks/{op[1]}", headers=headers)
+        else:
+            _, parent_id, after, nodes = op
+            return write_block_tree(parent_id, nodes, executor, after=after)
+        if response.status_code != 200:
+            print(f"❌ Block {op[0]} 失败 {op[1]}: {response.text}")
+            return False
+        return True
+
+    # 插入操作内部会再用 executor 并发写子树，这里顺序执行，避免线程池被外层任务占满
+    ok = all([run(op) for op in ops if op[0] != "delete"])
+    deleted = list(executor.map(run, [op for op in ops if op[0] == "delete"]))
+    return ok and all(deleted)
+
+# 复制进度
+class CopyProgress:
+    """ 统计已复制页面数、页面/秒与请求/秒 """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests_at_start = notion.stats()["requests"]
+        self.copied = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def record(self, ok):
+        with self.lock:
+            if ok:
+                self.copied += 1
+            else:
+                self.failed += 1
+            finished = self.copied + self.failed
+        if finished % PROGRESS_EVERY == 0:
+            self.report()
+
+    def summary(self):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started, 1e-6)
+            requests = notion.stats()["requests"] - self.requests_at_start
+            return {
+                "copied": self.copied,
+                "failed": self.failed,
+                "elapsed": round(elapsed, 1),
+                "requests": requests,
+                "pages_per_second": round((self.copied + self.failed) / elapsed, 2),
+                "requests_per_second": round(requests / elapsed, 2),
+            }
+
+    def report(self, final=False):
+        s = self.summary()
+        prefix = "🏁 复制完成" if final else "📊 复制进度"
+        print(f"{prefix}: 成功 {s['copied']} 页，失败 {s['failed']} 页，用时 {s['elapsed']} 秒 | "
+              f"{s['pages_per_second']} 页/秒 | {s['requests_per_second']} 请求/秒")
+
+# 复制页面内的 Block
+def copy_page_blocks(source_page_id, new_page_id):
+    """ DEEP_COPY 时复制整棵 block 树，否则只批量复制顶层 block；全部写入成功时返回 True """
+    if DEEP_COPY:
+        with ThreadPoolExecutor(max_workers=TREE_WORKERS) as executor:
+            tree = fetch_block_tree(source_page_id, executor)
+            return write_block_tree(new_page_id, tree, executor)
+    writer = BlockBatchWriter(new_page_id)
+    for block in get_page_content(source_page_id):
+        writer.add(block)
+    writer.flush()
+    return writer.ok
+
+
+# 生成待追加的 Block 数据
+def build_block_payload(block):
+    """ 将源 block（Block）转成可追加的 children 元素，无法复制时返回 None """
+    if block is None:
+        print("⚠️ 无效的 block 数据，跳过")
+        return None
+    if not block.copyable:
+        print(f"⚠️ 无法复制 block: {block}")
+        return None
+    return block.payload()
+
+# 复制 Block
+def copy_block(page_id, block):
+    """ 复制单个 Notion 页面 Block 内容 """
+    child = build_block_payload(block)
+    if child is None:
+        return
+
+    url = f"https://api.notion.com/v1/blocks/{page_id}/children"
+    response = notion.patch(url, json={"children": [child]}, headers=headers)
+
+    if response.status_code == 200:
+        print(f"✅ Block 复制成功")
+    else:
+        print(f"❌ Block 复制失败: {response.text}")
+
+
+# 批量追加 Block
+MAX_CHILDREN_PER_REQUEST = 100  # Notion 单次追加 children 上限（每一层嵌套的 children 数组都受此限制）
+MAX_BLOCKS_PER_REQUEST = 1000   # Notion 单次追加请求的 block 总数上限（含嵌套的 children）
+
+class BlockBatchWriter:
+    """
+    将连续的顶层 block 攒成一批，一次 PATCH 追加到目标页面：
+      - add() 收集 block，攒满 batch_size 个（或嵌套 block 总数将超过 MAX_BLOCKS_PER_REQUEST）时自动 flush
+      - flush() 追加剩余的 block，页面复制结束时必须调用；本批全部写入成功时返回 True
+      - failed 累计写入失败的 block 数，ok 表示到目前为止没有失败
+      - 整批被 Notion 拒绝（400）时退回逐个追加，避免一个无效 block 连累整批
+      - after 不为空时插入到该 block 之后（而不是末尾），多批之间保持顺序
+    """
+
+    def __init__(self, page_id, batch_size=MAX_CHILDREN_PER_REQUEST, after=None):
+        self.page_id = page_id
+        self.after = after
+        self.batch_size = min(batch_size, MAX_CHILDREN_PER_REQUEST)
+        self.pending = []   # [(children 元素, tag)]
+        self.pending_blocks = 0  # pending 中的 block 总数（含嵌套）
+        self.created = []   # [(tag, Notion 返回的新 block)]，仅记录 tag 不为 None 的元素
+        self.requests = 0
+        self.written = 0
+        self.failed = 0
+
+    def add(self, block):
+        child = build_block_payload(block)
+        if child is not None:
+            self.add_payload(child)
+
+    def add_payload(self, child, tag=None):
+        """ 追加已构造好的 children 元素；tag 不为 None 时，创建成功后记录到 self.created """
+        size = payload_size(child)
+        if self.pending and self.pending_blocks + size > MAX_BLOCKS_PER_REQUEST:
+            self.flush()
+        self.pending.append((child, tag))
+        self.pending_blocks += size
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    @property
+    def ok(self):
+        return self.failed == 0
+
+    def flush(self):
+        if not self.pending:
+            return True
+        failed_before = self.failed
+        batch, self.pending = self.pending, []
+        self.pending_blocks = 0
+        url = f"https://api.notion.com/v1/blocks/{self.page_id}/children"
+        response = notion.patch(url, json=self._body([c for c, _ in batch]), headers=headers)
+        self.requests += 1
+
+        if response.status_code == 200:
+            self.written += len(batch)
+            self._record(batch, response.json().get("results", []))
+            print(f"✅ 批量复制 {len(batch)} 个 Block 成功")
+        elif response.status_code == 400 and len(batch) > 1:
+            print(f"⚠️ 批量复制被拒绝，改为逐个复制 {len(batch)} 个 Block: {response.text}")
+            for item in batch:
+                self.requests += 1
+                single = notion.patch(url, json=self._body([item[0]]), headers=headers)
+                if single.status_code == 200:
+                    self.written += 1
+                    self._record([item], single.json().get("results", []))
+                else:
+                    self.failed += 1
+                    print(f"❌ Block 复制失败: {single.text}")
+        else:
+            self.failed += len(batch)
+            print(f"❌ 批量复制 Block 失败: {response.text}")
+        return self.failed == failed_before
+
+    def _body(self, children):
+        body = {"children": children}
+        if self.after:
+            body["after"] = self.after
+        return body
+
+    def _record(self, batch, results):
+        # 追加接口按顺序返回新建的顶层 block（兼容返回内容包含 after 指定的 block 的情况）
+        ids = [r.get("id") for r in results]
+        if self.after in ids:
+            results = results[ids.index(self.after) + 1:]
+        results = results[:len(batch)]
+        for (_, tag), created in zip(batch, results):
+            if tag is not None:
+                self.created.append((tag, created))
+        if self.after and results:
+            self.after = results[-1]["id"]
+
+
+# 深度复制 Block 树
+INLINE_DEPTH = 2  # Notion 单次追加请求最多允许两层嵌套 children
+REQUIRES_CHILDREN = {"column_list", "column", "table"}  # 创建时必须同时带上 children 的类型
+
+def needs_children(block):
+    """ 是否需要获取该 block 的子 block（引用型同步块的内容属于原始块，不复制） """
+    if not block.has_children:
+        return False
+    if block.type == "synced_block" and block.synced_from:
+        return False
+    return block.type not in ("child_page", "child_database")
+
+def fetch_block_tree(page_id, executor, deep=True):
+    """
+    获取整棵 block 树，返回 [{"block": ..., "children": [...]}]。
+    按层并发获取：同一层所有带子 block 的节点同时请求，耗时与树深度成正比。
+    deep=False 时只获取顶层 block。
+    """
+    tree = [{"block": b, "children": []} for b in get_page_content(page_id)]
+    frontier = [node for node in tree if deep and needs_children(node["block"])]
+    while frontier:
+        results = executor.map(lambda node: list(get_page_content(node["block"].id)), frontier)
+        next_frontier = []
+        for node, blocks in zip(frontier, results):
+            node["children"] = [{"block": b, "children": []} for b in blocks]
+            next_frontier.extend(c for c in node["children"] if needs_children(c["block"]))
+        frontier = next_frontier
+    return tree
+
+def fits_inline(node, budget=INLINE_DEPTH):
+    """ 整棵子树能否随父 block 一次写入：不超过 budget 层，且每一层 children 都不超过单次上限 """
+    children = node["children"]
+    if not children:
+        return True
+    if budget <= 0 or len(children) > MAX_CHILDREN_PER_REQUEST:
+        return False
+    return all(fits_inline(c, budget - 1) for c in children)
+
+def tree_size(node):
+    return 1 + sum(tree_size(c) for c in node["children"])
+
+def payload_size(child):
+    """ children 元素中的 block 总数（含嵌套） """
+    kids = child.get(child.get("type"), {}).get("children", [])
+    return 1 + sum(payload_size(k) for k in kids)
+
+def build_nested_payload(node, budget, cuts, path=()):
+    """
+    构造带嵌套 children 的追加数据，最多内联 budget 层，每层最多内联 MAX_CHILDREN_PER_REQUEST 个子节点。
+    超出部分记录到 cuts：(在新建 block 中的位置路径, 未写入的子节点)。
+    """
+    child = build_block_payload(node["block"])
+    if child is None or not node["children"]:
+        return child
+    if budget <= 0:
+        cuts.append((path, node["children"]))
+        return child
+    children = node["children"]
+    if len(children) > MAX_CHILDREN_PER_REQUEST:
+        # 多出的子节点排在最后，创建后追加到新 block 末尾即可保持顺序
+        cuts.append((path, children[MAX_CHILDREN_PER_REQUEST:]))
+        children = children[:MAX_CHILDREN_PER_REQUEST]
+    kids = []
+    for c in children:
+        payload = build_nested_payload(c, budget - 1, cuts, path + (len(kids),))
+        if payload is not None:
+            kids.append(payload)
+    btype = child["type"]
+    child[btype] = dict(child[btype], children=kids)
+    return child
+
+def write_block_tree(parent_id, tree, executor, after=None):
+    """
+    将 block 树写入目标页面，按层推进：
+      - 整棵子树不超过 INLINE_DEPTH 层、每层 children 不超过 100 个时随父 block 一次性内联写入
+      - 更深或更宽的子树先创建父 block，再用返回的新 block ID 在下一轮分批追加其 children
+      - 同一层的多个父 block 并发写入
+    after 不为空时第一层插入到该 block 之后。
+    全部写入成功时返回 True；某个父 block 创建失败时，它的子树不再写入，返回 False。
+    """
+    ok = True
+    level = [(parent_id, tree, after)]
+    while level:
+        results = list(executor.map(lambda item: append_tree_level(*item), level))
+        ok = ok and all(level_ok for _, level_ok in results)
+        level = [deferred for batch, _ in results for deferred in batch]
+    return ok
+
+def append_tree_level(parent_id, nodes, after=None):
+    """ 追加一层节点，返回 (需要在下一轮继续写入的 [(新 block ID, 子节点, None)], 本层是否全部写入成功) """
+    writer = BlockBatchWriter(parent_id, after=after)
+    for node in nodes:
+        btype = node["block"].type
+        if fits_inline(node) and tree_size(node) <= MAX_BLOCKS_PER_REQUEST:
+            child = build_nested_payload(node, INLINE_DEPTH, [])
+            tag = None
+        elif btype in REQUIRES_CHILDREN:
+            cuts = []
+            child = build_nested_payload(node, INLINE_DEPTH, cuts)
+            tag = ("cuts", cuts)
+        else:
+            child = build_block_payload(node["block"])
+            tag = ("children", node["children"])
+        if child is not None:
+            writer.add_payload(child, tag)
+    writer.flush()
+
+    ok = writer.ok
+    deferred = []
+    for (kind, value), created in writer.created:
+        if kind == "children":
+            deferred.append((created["id"], value, None))
+            continue
+        for path, children in value:
+            block_id = resolve_created_path(created["id"], path)
+            if block_id:
+                deferred.append((block_id, children, None))
+            else:
+                ok = False
+    return deferred, ok
+
+def resolve_created_path(block_id, path):
+    """ 按位置路径在新建的嵌套 block 中找到对应的 block ID（仅分栏等必须内联的类型会用到） """
+    for index in path:
+        children = list(get_page_content(block_id))
+        if index >= len(children):
+            print(f"⚠️ 无法定位新建的嵌套 block: {block_id} {path}")
+            return None
+        block_id = children[index].id
+    return block_id
+
+
+# 开始执行
+if __name__ == "__main__":
+    if SOURCE_DATABASE_NAME:
+        SOURCE_DATABASE_ID = resolve_database_id(SOURCE_DATABASE_NAME) or SOURCE_DATABASE_ID
+    if TARGET_DATABASE_NAME:
+        TARGET_DATABASE_ID = resolve_database_id(TARGET_DATABASE_NAME) or TARGET_DATABASE_ID
+    if INCREMENTAL:
+        sync_database(SOURCE_DATABASE_ID, TARGET_DATABASE_ID)
+    else:
+        copy_database(SOURCE_DATABASE_ID, TARGET_DATABASE_ID)
+    if METRICS_FILE:
+        metrics.write(METRICS_FILE)
@@ -0,0 +1,135 @@
+import difflib
+import hashlib
+import json
+from urllib.parse import urlsplit
+
+# 比较内容时忽略的字段：plain_text / href 由 rich_text 推导，expiry_time 与签名 URL 每次请求都会变化
+IGNORED_KEYS = {"plain_text", "href", "expiry_time", "children"}
+# 这些类型不能通过 PATCH /blocks/{id} 修改内容，内容不同时只能删除后重新插入
+NOT_UPDATABLE = {"column_list", "column", "table", "synced_block", "child_page", "child_database",
+                 "link_preview", "unsupported", "breadcrumb", "table_of_contents"}
+
+
+# ========== 指纹 ==========
+def normalize(value):
+    """ 去掉易变字段后的规范化内容，用于计算哈希 """
+    if isinstance(value, dict):
+        normalized = {k: normalize(v) for k, v in value.items() if k not in IGNORED_KEYS}
+        # Notion 托管文件的 URL 带有过期签名，只比较路径
+        if value.get("type") == "file" and isinstance(value.get("file"), dict):
+            normalized["file"] = {"url": urlsplit(value["file"].get("url", "")).path}
+        return normalized
+    if isinstance(value, list):
+        return [normalize(v) for v in value]
+    return value
+
+def content_hash(block):
+    """ block（Daom_Block.Block）自身的指纹：类型 + 规范化内容（不含子 block） """
+    raw = json.dumps([block.type, normalize(block.content)], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def fingerprint_tree(nodes):
+    """
+    为 fetch_block_tree 返回的节点（{"block": Block, "children"}）计算指纹，写入节点：
+      - node["content_hash"]：类型 + 内容
+      - node["hash"]：内容 + 子树哈希，子树完全一致时才相同
+    返回这一层的整体哈希。
+    """
+    level = hashlib.sha1()
+    for node in nodes:
+        node["content_hash"] = content_hash(node["block"])
+        children_hash = fingerprint_tree(node["children"])
+        node["hash"] = hashlib.sha1(f"{node['content_hash']}:{children_hash}".encode()).hexdigest()
+        level.update(node["hash"].encode())
+    return level.hexdigest()
+
+
+# ========== 编辑脚本 ==========
+def diff_blocks(parent_id, source_nodes, target_nodes):
+    """
+    计算把目标 block 树变成源 block 树所需的最小编辑脚本，返回操作列表：
+        ("update", 目标 block ID, 源 block)         -> PATCH /blocks/{id}
+        ("insert", 父 ID, after block ID, [源节点])  -> PATCH /blocks/{父 ID}/children（after 为 None 时追加到末尾）
+        ("delete", 目标 block ID)                   -> DELETE /blocks/{id}
+    两侧节点需先经过 fingerprint_tree。子树哈希相同的 block 不产生任何操作。
+    """
+    ops = []
+    _diff_level(parent_id, source_nodes, target_nodes, ops)
+    return ops
+
+def _diff_level(parent_id, source_nodes, target_nodes, ops, anchor=None):
+    level_ops = []
+    kept = 0          # 保留（未删除）的目标 block 数
+    # anchor：最近一个保留的目标 block，插入操作以它为 after
+    inserts = []      # 待插入到 anchor 之后的连续源节点
+
+    def flush_inserts():
+        if inserts:
+            level_ops.append(("insert", parent_id, anchor, list(inserts)))
+            inserts.clear()
+
+    matcher = difflib.SequenceMatcher(None, [n["hash"] for n in target_nodes],
+                                      [n["hash"] for n in source_nodes], autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            flush_inserts()
+            anchor = target_nodes[i2 - 1]["block"].id
+            kept += i2 - i1
+            continue
+        targets, sources = target_nodes[i1:i2], source_nodes[j1:j2]
+        for target, source in zip(targets, sources):
+            if can_update(target, source):
+                flush_inserts()
+                anchor = target["block"].id
+                kept += 1
+                if target["content_hash"] != source["content_hash"]:
+                    level_ops.append(("update", anchor, source["block"]))
+                if target["hash"] != source["hash"]:
+                    _diff_level(anchor, source["children"], target["children"], level_ops)
+            else:
+                level_ops.append(("delete", target["block"].id))
+                inserts.append(source)
+        for target in targets[len(sources):]:
+            level_ops.append(("delete", target["block"].id))
+        inserts.extend(sources[len(targets):])
+    flush_inserts()
+
+    # Notion 只能插入到某个 block 之后，无法插到开头。开头有新增、后面又有保留的 block 时：
+    #   - 找到第一个能改成第一个源 block 的目标 block，删除它之前的目标 block，原地修改它，
+    #     其余部分以它为锚点重新比较（被删除的 block 会作为新增重新插入到它之后）
+    #   - 找不到时这一层整体重建
+    if kept and any(op[0] == "insert" and op[1] == parent_id and op[2] is None for op in level_ops):
+        first_source = source_nodes[0]
+        k = next((i for i, t in enumerate(target_nodes) if can_update(t, first_source)), None)
+        if k is not None:
+            first_target = target_nodes[k]
+            ops.extend(("delete", n["block"].id) for n in target_nodes[:k])
+            anchor = first_target["block"].id
+            if first_target["content_hash"] != first_source["content_hash"]:
+                ops.append(("update", anchor, first_source["block"]))
+            if first_target["hash"] != first_source["hash"]:
+                _diff_level(anchor, first_source["children"], first_target["children"], ops)
+            _diff_level(parent_id, source_nodes[1:], target_nodes[k + 1:], ops, anchor=anchor)
+            return
+        ops.extend(("delete", n["block"].id) for n in target_nodes)
+        ops.append(("insert", parent_id, None, list(source_nodes)))
+        return
+    ops.extend(level_ops)
+
+def can_update(target, source):
+    """ 同类型且可原地修改的 block 才配对更新；内容相同（只有子 block 不同）时任何类型都可以配对 """
+    target_type, source_type = target["block"].type, source["block"].type
+    if target_type != source_type:
+        return False
+    return target["content_hash"] == source["content_hash"] or target_type not in NOT_UPDATABLE
+
+def update_payload(block):
+    """ PATCH /blocks/{id} 的请求体：只包含该类型的内容字段 """
+    content = {k: v for k, v in block.content.items() if k != "children"}
+    return {block.type: content}
+
+def summarize(ops):
+    counts = {"update": 0, "insert": 0, "delete": 0}
+    for op in ops:
+        counts[op[0]] += len(op[3]) if op[0] == "insert" else 1
+    return counts
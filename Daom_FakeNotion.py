@@ -0,0 +1,464 @@
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+MAX_PAGE_SIZE = 100
+RELATION_LIMIT = 25  # 页面对象中 relation 最多返回的条数，超出部分需通过属性接口分页读取
+MAX_APPEND_BLOCKS = 1000  # 单次追加 children 请求中的 block 总数上限（含嵌套）
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeNotion:
+    """
+    内存中的 Notion 工作区，实现 Daom 脚本用到的接口：
+        POST /search、POST /databases/{id}/query、GET /databases/{id}、
+        POST /pages、GET|PATCH /pages/{id}、GET|PATCH|DELETE /blocks/{id}、
+        GET|PATCH /blocks/{id}/children
+    列表接口支持 start_cursor / page_size 分页。
+    """
+
+    def __init__(self):
+        self.databases = {}   # id -> database 对象
+        self.pages = {}       # id -> page 对象
+        self.blocks = {}      # id -> block 对象
+        self.children = {}    # 父 id -> [子 block id]
+        self.clock = 0        # 单调递增的“编辑时间”，保证 last_edited_time 顺序确定
+        self.lock = threading.RLock()
+
+    # ---------- 数据构造 ----------
+    def now(self):
+        self.clock += 1
+        stamp = EPOCH + timedelta(seconds=self.clock)
+        return stamp.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+    def add_database(self, title, properties, parent_page_id=None):
+        """ properties: {字段名: 字段类型} """
+        with self.lock:
+            db_id = str(uuid.uuid4())
+            stamp = self.now()
+            self.databases[db_id] = {
+                "object": "database",
+                "id": db_id,
+                "title": [rich_text(title)],
+                "parent": {"type": "page_id", "page_id": parent_page_id} if parent_page_id else {"type": "workspace", "workspace": True},
+                "properties": {name: {"id": uuid.uuid4().hex[:4], "name": name, "type": ptype, ptype: {}}
+                               for name, ptype in properties.items()},
+                "created_time": stamp,
+                "last_edited_time": stamp,
+            }
+            return db_id
+
+    def add_page(self, database_id=None, properties=None, parent_page_id=None):
+        """ properties 使用 API 写入格式，例如 {"Name": {"title": [...]}} """
+        with self.lock:
+            page_id = str(uuid.uuid4())
+            stamp = self.now()
+            if database_id:
+                parent = {"type": "database_id", "database_id": database_id}
+            elif parent_page_id:
+                parent = {"type": "page_id", "page_id": parent_page_id}
+            else:
+                parent = {"type": "workspace", "workspace": True}
+            self.pages[page_id] = {
+                "object": "page",
+                "id": page_id,
+                "parent": parent,
+                "properties": self._normalize_properties(database_id, properties or {}),
+                "created_time": stamp,
+                "last_edited_time": stamp,
+                "archived": False,
+            }
+            self.children.setdefault(page_id, [])
+            return page_id
+
+    def add_block(self, parent_id, payload, after=None):
+        """ 按追加接口的格式创建 block（支持嵌套 children），返回新 block """
+        with self.lock:
+            btype = payload["type"]
+            body = dict(payload.get(btype, {}))
+            kids = body.pop("children", [])
+            if btype in ("paragraph", "heading_1", "heading_2", "heading_3", "toggle", "quote", "callout",
+                         "bulleted_list_item", "numbered_list_item", "to_do"):
+                body["rich_text"] = [with_plain_text(t) for t in body.get("rich_text", [])]
+            block_id = str(uuid.uuid4())
+            stamp = self.now()
+            parent_type = "page_id" if parent_id in self.pages else "block_id"
+            block = {
+                "object": "block",
+                "id": block_id,
+                "parent": {"type": parent_type, parent_type: parent_id},
+                "type": btype,
+                btype: body,
+                "has_children": False,
+                "created_time": stamp,
+                "last_edited_time": stamp,
+                "archived": False,
+            }
+            self.blocks[block_id] = block
+            self.children[block_id] = []
+            siblings = self.children.setdefault(parent_id, [])
+            if after and after in siblings:
+                siblings.insert(siblings.index(after) + 1, block_id)
+            else:
+                siblings.append(block_id)
+            if parent_id in self.blocks:
+                self.blocks[parent_id]["has_children"] = True
+            for kid in kids:
+                self.add_block(block_id, kid)
+            return block
+
+    def _normalize_properties(self, database_id, properties):
+        schema = self.databases.get(database_id, {}).get("properties", {})
+        normalized = {}
+        for name, value in properties.items():
+            ptype = schema.get(name, {}).get("type") or next(iter(value))
+            inner = value.get(ptype)
+            if ptype in ("title", "rich_text"):
+                inner = [with_plain_text(t) for t in inner or []]
+            normalized[name] = {"id": schema.get(name, {}).get("id", name), "type": ptype, ptype: inner}
+        return normalized
+
+    # ---------- 请求分发 ----------
+    ROUTES = [
+        ("POST", r"/search", "search"),
+        ("POST", r"/databases/([^/]+)/query", "query_database"),
+        ("GET", r"/databases/([^/]+)", "get_database"),
+        ("POST", r"/pages", "create_page"),
+        ("GET", r"/pages/([^/]+)/properties/([^/]+)", "get_property_item"),
+        ("GET", r"/pages/([^/]+)", "get_page"),
+        ("PATCH", r"/pages/([^/]+)", "update_page"),
+        ("GET", r"/blocks/([^/]+)/children", "list_children"),
+        ("PATCH", r"/blocks/([^/]+)/children", "append_children"),
+        ("GET", r"/blocks/([^/]+)", "get_block"),
+        ("PATCH", r"/blocks/([^/]+)", "update_block"),
+        ("DELETE", r"/blocks/([^/]+)", "delete_block"),
+    ]
+
+    def handle(self, method, path, query, body):
+        """ 返回 (状态码, 响应 JSON) """
+        for route_method, pattern, name in self.ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                with self.lock:
+                    return getattr(self, name)(*match.groups(), query=query, body=body or {})
+        return error(400, "invalid_request_url", f"{method} {path} 不受支持")
+
+    def search(self, query, body):
+        objects = list(self.databases.values()) + list(self.pages.values())
+        wanted = (body.get("filter") or {}).get("value")
+        if wanted:
+            objects = [o for o in objects if o["object"] == wanted]
+        text = (body.get("query") or "").lower()
+        if text:
+            objects = [o for o in objects if text in object_title(o).lower()]
+        descending = (body.get("sort") or {}).get("direction", "descending") == "descending"
+        objects.sort(key=lambda o: o["last_edited_time"], reverse=descending)
+        return paginate([page_view(o) for o in objects], body)
+
+    def query_database(self, database_id, query, body):
+        if database_id not in self.databases:
+            return error(404, "object_not_found", f"数据库 {database_id} 不存在")
+        rows = [p for p in self.pages.values()
+                if p["parent"].get("database_id") == database_id and not p["archived"]]
+        since = ((body.get("filter") or {}).get("last_edited_time") or {}).get("on_or_after")
+        if since:
+            rows = [p for p in rows if p["last_edited_time"] >= since]
+        for sort in reversed(body.get("sorts") or []):
+            rows.sort(key=lambda p: p.get(sort.get("timestamp", "last_edited_time"), ""),
+                      reverse=sort.get("direction") == "descending")
+        return paginate([page_view(p) for p in rows], body)
+
+    def get_database(self, database_id, query, body):
+        if database_id not in self.databases:
+            return error(404, "object_not_found", f"数据库 {database_id} 不存在")
+        return 200, self.databases[database_id]
+
+    def create_page(self, query, body):
+        parent = body.get("parent", {})
+        database_id = parent.get("database_id")
+        if database_id and database_id not in self.databases:
+            return error(404, "object_not_found", f"数据库 {database_id} 不存在")
+        page_id = self.add_page(database_id, body.get("properties"), parent.get("page_id"))
+        for child in body.get("children", []):
+            self.add_block(page_id, child)
+        return 200, page_view(self.pages[page_id])
+
+    def get_page(self, page_id, query, body):
+        if page_id not in self.pages:
+            return error(404, "object_not_found", f"页面 {page_id} 不存在")
+        return 200, page_view(self.pages[page_id])
+
+    def get_property_item(self, page_id, property_id, query, body):
+        page = self.pages.get(page_id)
+        if not page:
+            return error(404, "object_not_found", f"页面 {page_id} 不存在")
+        # Notion 的属性 ID 本身可能含 URL 编码字符（如 "a%3Db"），两种写法都接受
+        prop = next((p for p in page["properties"].values()
+                     if unquote(p["id"]) == unquote(property_id)), None)
+        if prop is None:
+            return error(404, "object_not_found", f"属性 {property_id} 不存在")
+        ptype = prop["type"]
+        if ptype not in ("relation", "title", "rich_text", "people"):
+            return 200, {"object": "property_item", "id": property_id, "type": ptype, ptype: prop[ptype]}
+        items = [{"object": "property_item", "id": property_id, "type": ptype, ptype: value}
+                 for value in prop[ptype] or []]
+        status, listing = paginate(items, {k: v[0] for k, v in query.items()})
+        listing.update(type="property_item", property_item={"id": property_id, "next_url": None, "type": ptype, ptype: {}})
+        return status, listing
+
+    def update_page(self, page_id, query, body):
+        page = self.pages.get(page_id)
+        if not page:
+            return error(404, "object_not_found", f"页面 {page_id} 不存在")
+        database_id = page["parent"].get("database_id")
+        page["properties"].update(self._normalize_properties(database_id, body.get("properties", {})))
+        if "archived" in body:
+            page["archived"] = body["archived"]
+        page["last_edited_time"] = self.now()
+        return 200, page_view(page)
+
+    def list_children(self, block_id, query, body):
+        if block_id not in self.children:
+            return error(404, "object_not_found", f"block {block_id} 不存在")
+        blocks = [self.blocks[i] for i in self.children[block_id]]
+        return paginate(blocks, {k: v[0] for k, v in query.items()})
+
+    def append_children(self, block_id, query, body):
+        if block_id not in self.children:
+            return error(404, "object_not_found", f"block {block_id} 不存在")
+        children = body.get("children", [])
+        if len(children) > MAX_PAGE_SIZE:
+            return error(400, "validation_error", "children 最多 100 个")
+        if any(nesting_depth(c) > 3 for c in children):
+            return error(400, "validation_error", "最多允许两层嵌套 children")
+        if any(widest_children(c) > MAX_PAGE_SIZE for c in children):
+            return error(400, "validation_error", "嵌套的 children 数组最多 100 个")
+        if sum(payload_size(c) for c in children) > MAX_APPEND_BLOCKS:
+            return error(400, "validation_error", f"单次请求最多 {MAX_APPEND_BLOCKS} 个 block")
+        after = body.get("after")
+        if after and after not in self.children[block_id]:
+            return error(400, "validation_error", f"after block {after} 不是 {block_id} 的子 block")
+        created = []
+        for child in children:
+            created.append(self.add_block(block_id, child, after))
+            after = created[-1]["id"] if after else None
+        return 200, {"object": "list", "results": created, "next_cursor": None, "has_more": False}
+
+    def get_block(self, block_id, query, body):
+        if block_id not in self.blocks:
+            return error(404, "object_not_found", f"block {block_id} 不存在")
+        return 200, self.blocks[block_id]
+
+    def update_block(self, block_id, query, body):
+        block = self.blocks.get(block_id)
+        if not block:
+            return error(404, "object_not_found", f"block {block_id} 不存在")
+        btype = block["type"]
+        if btype in body:
+            block[btype] = dict(block[btype], **body[btype])
+            if "rich_text" in block[btype]:
+                block[btype]["rich_text"] = [with_plain_text(t) for t in block[btype]["rich_text"]]
+        block["last_edited_time"] = self.now()
+        return 200, block
+
+    def delete_block(self, block_id, query, body):
+        block = self.blocks.get(block_id)
+        if not block:
+            return error(404, "object_not_found", f"block {block_id} 不存在")
+        parent_id = block["parent"].get(block["parent"]["type"])
+        if block_id in self.children.get(parent_id, []):
+            self.children[parent_id].remove(block_id)
+        block["archived"] = True
+        return 200, block
+
+
+# ========== 辅助函数 ==========
+def rich_text(content):
+    return {"type": "text", "text": {"content": content, "link": None}, "plain_text": content, "href": None}
+
+def with_plain_text(item):
+    if item.get("type", "text") == "text" and "plain_text" not in item:
+        return dict(item, type="text", plain_text=item.get("text", {}).get("content", ""))
+    return item
+
+def page_view(obj):
+    """ 与 Notion 一致：页面对象中的 relation / people 最多返回 RELATION_LIMIT 条，超出时 has_more 为 true """
+    if obj.get("object") != "page":
+        return obj
+    properties = {}
+    for name, prop in obj["properties"].items():
+        if prop["type"] in ("relation", "people"):
+            related = prop[prop["type"]] or []
+            prop = dict(prop, **{prop["type"]: related[:RELATION_LIMIT]}, has_more=len(related) > RELATION_LIMIT)
+        properties[name] = prop
+    return dict(obj, properties=properties)
+
+def object_title(obj):
+    if obj["object"] == "database":
+        return "".join(t.get("plain_text", "") for t in obj["title"])
+    for prop in obj["properties"].values():
+        if prop["type"] == "title":
+            return "".join(t.get("plain_text", "") for t in prop["title"])
+    return ""
+
+def nesting_depth(payload):
+    kids = payload.get(payload.get("type"), {}).get("children", [])
+    return 1 + max((nesting_depth(k) for k in kids), default=0)
+
+def widest_children(payload):
+    kids = payload.get(payload.get("type"), {}).get("children", [])
+    return max([len(kids)] + [widest_children(k) for k in kids])
+
+def payload_size(payload):
+    kids = payload.get(payload.get("type"), {}).get("children", [])
+    return 1 + sum(payload_size(k) for k in kids)
+
+def paginate(items, params):
+    page_size = min(int(params.get("page_size") or MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+    start = int(params.get("start_cursor") or 0)
+    chunk = items[start:start + page_size]
+    has_more = start + page_size < len(items)
+    return 200, {
+        "object": "list",
+        "results": chunk,
+        "next_cursor": str(start + page_size) if has_more else None,
+        "has_more": has_more,
+    }
+
+def error(status, code, message):
+    return status, {"object": "error", "status": status, "code": code, "message": message}
+
+
+# ========== HTTP 服务 ==========
+class FakeNotionServer:
+    """
+    在本地端口上提供 FakeNotion 的 HTTP 服务：
+      - latency：每个请求额外的延迟（秒），模拟网络往返
+      - rate_limit：每秒允许的请求数，超出时返回 429 + Retry-After（None 表示不限速）
+      - GET /__stats 返回请求计数，POST /__reset 清零计数
+    """
+
+    def __init__(self, notion=None, host="127.0.0.1", port=0, latency=0.0, rate_limit=None):
+        self.notion = notion or FakeNotion()
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.counts = {}
+        self.throttled = 0
+        self.stats_lock = threading.Lock()
+        self.allowance = rate_limit or 0
+        self.allowance_at = time.monotonic()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-notion", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        with self.stats_lock:
+            return {"requests": sum(self.counts.values()), "throttled": self.throttled, "by_endpoint": dict(self.counts)}
+
+    def reset(self):
+        with self.stats_lock:
+            self.counts.clear()
+            self.throttled = 0
+
+    def _throttle(self):
+        """ 服务端令牌桶，返回需要等待的秒数（0 表示放行） """
+        if not self.rate_limit:
+            return 0
+        with self.stats_lock:
+            now = time.monotonic()
+            self.allowance = min(self.rate_limit, self.allowance + (now - self.allowance_at) * self.rate_limit)
+            self.allowance_at = now
+            if self.allowance >= 1:
+                self.allowance -= 1
+                return 0
+            self.throttled += 1
+            return (1 - self.allowance) / self.rate_limit
+
+    def _record(self, method, path):
+        path = re.sub(r"/properties/[^/]+", "/properties/{property_id}", path)
+        key = f"{method} {re.sub(r'/[0-9a-f]{8}-[0-9a-f-]{27}', '/{id}', path)}"
+        with self.stats_lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # 响应头和响应体分两次写出，避免 keep-alive 下的 40ms 延迟确认
+
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self, method):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                if parsed.path == "/__stats":
+                    return self._send(200, server.stats())
+                if parsed.path == "/__reset":
+                    server.reset()
+                    return self._send(200, {"status": "reset"})
+                path = parsed.path[3:] if parsed.path.startswith("/v1") else parsed.path
+                server._record(method, path)
+                if server.latency:
+                    time.sleep(server.latency)
+                wait = server._throttle()
+                if wait:
+                    return self._send(429, {"object": "error", "status": 429, "code": "rate_limited",
+                                            "message": "请求过于频繁"}, {"Retry-After": f"{wait:.3f}"})
+                body = json.loads(raw) if raw else {}
+                status, payload = server.notion.handle(method, path, parse_qs(parsed.query), body)
+                self._send(status, payload)
+
+            def _send(self, status, payload, headers=None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PATCH(self):
+                self._dispatch("PATCH")
+
+            def do_DELETE(self):
+                self._dispatch("DELETE")
+
+        return Handler
+
+
+if __name__ == "__main__":
+    server = FakeNotionServer(port=8765).start()
+    print(f"🧪 Fake Notion API 已启动: {server.url}（设置 NOTION_API_URL 指向该地址）")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,212 @@
+import difflib
+import json
+import sqlite3
+import threading
+
+from Daom_Client import PaginationError, iter_search
+from Daom_Log import get_logger
+
+log = get_logger("index")
+
+INDEX_FILE = "daom_workspace_index.sqlite3"
+OBJECT_TYPES = ("database", "page")
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    id TEXT PRIMARY KEY,
+    object TEXT NOT NULL,
+    name TEXT NOT NULL,
+    parent_type TEXT,
+    parent_id TEXT,
+    last_edited_time TEXT,
+    schema TEXT
+);
+CREATE TABLE IF NOT EXISTS crawl_state (
+    object TEXT PRIMARY KEY,
+    last_edited_time TEXT NOT NULL
+);
+"""
+
+
+class WorkspaceIndex:
+    """
+    本地工作区索引（SQLite 文件）：通过 /search 爬取所有数据库与页面，
+    记录名称、ID、父级、last_edited_time 以及数据库的字段结构。
+      - refresh()：按 last_edited_time 倒序翻页，遇到上次爬取时间之前的对象即停止（增量刷新）
+      - refresh(full=True)：完整重建，同时删除已不在工作区中的对象
+      - find() / resolve_id()：名称精确查找（忽略大小写与多余空白），只查内存字典
+      - fuzzy()：名称模糊查找（子串 + difflib 相似度）
+    """
+
+    def __init__(self, path=INDEX_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript(INDEX_SCHEMA)
+        self.by_name = {}  # 规范化名称 -> [对象]
+        self.by_id = {}
+        self._load()
+
+    def _load(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, object, name, parent_type, parent_id, last_edited_time, schema FROM objects"
+            ).fetchall()
+        by_id = {}
+        by_name = {}
+        for row in rows:
+            entry = {
+                "id": row[0],
+                "object": row[1],
+                "name": row[2],
+                "parent_type": row[3],
+                "parent_id": row[4],
+                "last_edited_time": row[5],
+                "schema": json.loads(row[6]) if row[6] else None,
+            }
+            by_id[entry["id"]] = entry
+            by_name.setdefault(normalize_name(entry["name"]), []).append(entry)
+        self.by_id, self.by_name = by_id, by_name
+
+    # ---------- 爬取 ----------
+    def refresh(self, headers, full=False, object_types=OBJECT_TYPES):
+        """ 增量（或完整）刷新索引，返回各类型新增 / 更新的对象数（该类型爬取中途失败时为 None） """
+        counts = {}
+        for object_type in object_types:
+            counts[object_type] = self._crawl(headers, object_type, full)
+        self._load()
+        if any(count is None for count in counts.values()):
+            log.warning("⚠️ 工作区索引只刷新了一部分，请稍后重试", full=full, objects=len(self.by_id), **counts)
+        else:
+            log.info("✅ 工作区索引已刷新", full=full, objects=len(self.by_id), **counts)
+        return counts
+
+    def _crawl(self, headers, object_type, full):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT last_edited_time FROM crawl_state WHERE object = ?", (object_type,)
+            ).fetchone()
+        since = None if full or not row else row[0]
+        newest = row[0] if row else None
+        seen = set()
+        batch = []
+        results = iter_search(headers, object_type=object_type, strict=True,
+                              sort={"direction": "descending", "timestamp": "last_edited_time"})
+        try:
+            for obj in results:
+                edited = obj.get("last_edited_time")
+                # 倒序遍历：早于上次爬取时间的对象之前已经入库，后面的结果也都更早
+                if since and edited and edited < since:
+                    break
+                seen.add(obj["id"])
+                if newest is None or (edited and edited > newest):
+                    newest = edited
+                batch.append(obj)
+                if len(batch) >= 100:
+                    self._store(batch)
+                    batch = []
+        except PaginationError as e:
+            # 只读到一部分：已读到的对象照常入库，但不能据此删除对象或推进爬取时间，下次重新爬取
+            self._store(batch)
+            log.error("❌ 搜索结果读取中断，本次不删除对象、不更新爬取时间", object=object_type, error=str(e))
+            return None
+        self._store(batch)
+
+        with self.lock, self.conn:
+            if full:
+                # 完整刷新时，未出现在搜索结果中的对象已被删除或失去访问权限
+                existing = [r[0] for r in self.conn.execute("SELECT id FROM objects WHERE object = ?", (object_type,))]
+                self.conn.executemany("DELETE FROM objects WHERE id = ?", [(i,) for i in existing if i not in seen])
+            if newest:
+                self.conn.execute("INSERT OR REPLACE INTO crawl_state VALUES (?, ?)", (object_type, newest))
+        return len(seen)
+
+    def _store(self, objects):
+        if not objects:
+            return
+        live = [o for o in objects if not o.get("archived") and not o.get("in_trash")]
+        gone = [(o["id"],) for o in objects if o.get("archived") or o.get("in_trash")]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [index_row(o) for o in live],
+            )
+            self.conn.executemany("DELETE FROM objects WHERE id = ?", gone)
+
+    # ---------- 查询 ----------
+    def get(self, object_id):
+        return self.by_id.get(object_id)
+
+    def find(self, name, object_type=None):
+        """ 名称精确匹配（忽略大小写与多余空白），返回对象列表，最近编辑的在前 """
+        matches = self.by_name.get(normalize_name(name), [])
+        if object_type:
+            matches = [m for m in matches if m["object"] == object_type]
+        return sorted(matches, key=lambda m: m["last_edited_time"] or "", reverse=True)
+
+    def resolve_id(self, name, object_type="database"):
+        """ 按名称解析 ID；不存在时返回 None，重名时取最近编辑的一个 """
+        matches = self.find(name, object_type)
+        if len(matches) > 1:
+            log.warning("⚠️ 名称对应多个对象，使用最近编辑的一个", name=name, object=object_type, count=len(matches))
+        return matches[0]["id"] if matches else None
+
+    def fuzzy(self, name, object_type=None, limit=5, cutoff=0.6):
+        """ 模糊匹配：先取名称包含查询词的对象，再用 difflib 按相似度补足 """
+        key = normalize_name(name)
+        keys = [k for k, entries in self.by_name.items()
+                if not object_type or any(e["object"] == object_type for e in entries)]
+        ranked = [k for k in keys if key and key in k]
+        ranked.sort(key=len)
+        for k in difflib.get_close_matches(key, keys, n=limit, cutoff=cutoff):
+            if k not in ranked:
+                ranked.append(k)
+        results = []
+        for k in ranked:
+            results.extend(e for e in self.by_name[k] if not object_type or e["object"] == object_type)
+            if len(results) >= limit:
+                break
+        return results[:limit]
+
+    def databases(self):
+        return sorted((e for e in self.by_id.values() if e["object"] == "database"),
+                      key=lambda e: e["last_edited_time"] or "", reverse=True)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def object_name(obj):
+    """ 数据库取 title，页面取 title 类型的属性 """
+    if obj.get("object") == "database":
+        items = obj.get("title", [])
+    else:
+        items = next((p.get("title", []) for p in obj.get("properties", {}).values() if p.get("type") == "title"), [])
+    return "".join(t.get("plain_text") or t.get("text", {}).get("content", "") for t in items)
+
+def index_row(obj):
+    parent = obj.get("parent") or {}
+    parent_type = parent.get("type")
+    parent_id = parent.get(parent_type) if parent_type != "workspace" else None
+    schema = None
+    if obj.get("object") == "database":
+        schema = json.dumps({name: prop.get("type") for name, prop in obj.get("properties", {}).items()},
+                            ensure_ascii=False)
+    return (obj["id"], obj["object"], object_name(obj), parent_type, parent_id, obj.get("last_edited_time"), schema)
+
+def normalize_name(name):
+    return " ".join((name or "").split()).casefold()
+
+def resolve_database_id(name, path=INDEX_FILE):
+    """ 脚本启动时按名称解析数据库 ID（只查本地索引，不发请求）；找不到时返回 None """
+    index = WorkspaceIndex(path)
+    try:
+        database_id = index.resolve_id(name, "database")
+        if not database_id:
+            suggestions = [e["name"] for e in index.fuzzy(name, "database")]
+            log.error("❌ 本地索引中没有该数据库，请先刷新索引", name=name, suggestions=", ".join(suggestions))
+        return database_id
+    finally:
+        index.close()
@@ -0,0 +1,364 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from Daom_Log import get_logger
+
+log = get_logger("jobs")
+
+
+class JobQueue:
+    """
+    有界后台任务队列：
+      - submit() 只负责入队并立即返回 job_id（队列已满时返回 None）
+      - 固定数量的工作线程从队列中取出任务，调用 handler(payload) 执行
+      - 记录每个任务的状态、排队耗时和执行耗时，供 /jobs 接口查询
+      - 传入 shared（SharedCache）时，任务记录同时写入共享缓存，多 worker 部署时任一进程都能查询
+    """
+
+    def __init__(self, handler, workers=4, max_queue=100, history=500, shared=None, record_ttl=3600):
+        self.handler = handler
+        self.workers = workers
+        self.history = history
+        self.shared = shared
+        self.record_ttl = record_ttl
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.jobs = OrderedDict()  # job_id -> 任务记录，只保留最近 history 条
+        self.lock = threading.Lock()
+        self.threads = []
+        self.running = 0
+        self.counters = {"submitted": 0, "rejected": 0, "succeeded": 0, "failed": 0}
+        self.total_run_ms = 0.0
+        self.total_queue_ms = 0.0
+
+    def start(self):
+        """ 启动工作线程（首次 submit 时自动调用） """
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"daom-job-{i}", daemon=True)
+                t.start()
+                self.threads.append(t)
+
+    def submit(self, payload, **meta):
+        """ 入队一个任务，返回 job_id；队列已满时返回 None """
+        job_id = self.reserve(**meta)
+        return job_id if self.enqueue(job_id, payload) else None
+
+    def reserve(self, job_id=None, **meta):
+        """ 先创建任务记录（状态 pending）并返回 job_id（可预先生成后传入），稍后再调用 enqueue() 入队 """
+        job_id = job_id or uuid.uuid4().hex
+        record = {
+            "id": job_id,
+            "status": "pending",
+            "enqueued_at": None,
+            "started_at": None,
+            "finished_at": None,
+            "queue_ms": None,
+            "run_ms": None,
+            "result": None,
+            "error": None,
+        }
+        record.update(meta)
+        with self.lock:
+            self.jobs[job_id] = record
+            while len(self.jobs) > self.history:
+                self.jobs.popitem(last=False)
+        self._publish(record)
+        return job_id
+
+    def has_capacity(self, reserved=0):
+        """ 队列在已为 reserved 个任务预留位置之后，是否还能再接收一个任务 """
+        return self.queue.maxsize <= 0 or self.queue.qsize() + reserved < self.queue.maxsize
+
+    def enqueue(self, job_id, payload):
+        """ 将已创建的任务放入队列；队列已满时标记为 rejected 并返回 False """
+        self.start()
+        with self.lock:
+            record = self.jobs.get(job_id)
+            if record is not None:
+                record["status"] = "queued"
+                record["enqueued_at"] = time.time()
+        try:
+            self.queue.put_nowait((job_id, payload))
+        except queue.Full:
+            with self.lock:
+                if record is not None:
+                    record["status"] = "rejected"
+                self.counters["rejected"] += 1
+            self._publish(record)
+            log.error("❌ 任务队列已满，拒绝新任务", job_id=job_id, capacity=self.queue.maxsize)
+            return False
+        with self.lock:
+            self.counters["submitted"] += 1
+        self._publish(record)
+        return True
+
+    def mark(self, job_id, **fields):
+        """ 更新任务记录（如合并进其他任务、等待重试），本进程没有该记录时忽略 """
+        with self.lock:
+            record = self.jobs.get(job_id)
+            if record is None:
+                return
+            record.update(fields)
+        self._publish(record)
+
+    def _worker(self):
+        while True:
+            job_id, payload = self.queue.get()
+            started = time.time()
+            with self.lock:
+                self.running += 1
+                record = self.jobs.get(job_id, {"id": job_id})
+                record["status"] = "running"
+                record["started_at"] = started
+                record["queue_ms"] = round((started - record.get("enqueued_at", started)) * 1000, 1)
+            self._publish(record)
+            try:
+                result = self.handler(payload)
+                status, error = "succeeded", None
+            except Exception as e:
+                result, status, error = None, "failed", repr(e)
+                log.error("❌ 后台任务执行失败", job_id=job_id, error=error)
+            finished = time.time()
+            with self.lock:
+                self.running -= 1
+                record["status"] = status
+                record["result"] = result
+                record["error"] = error
+                record["finished_at"] = finished
+                record["run_ms"] = round((finished - started) * 1000, 1)
+                self.counters[status] += 1
+                self.total_run_ms += record["run_ms"]
+                self.total_queue_ms += record["queue_ms"]
+            self._publish(record)
+            self.queue.task_done()
+
+    def _publish(self, record):
+        if self.shared is None or record is None:
+            return
+        with self.lock:
+            snapshot = dict(record)
+        try:
+            self.shared.set(f"job:{snapshot['id']}", snapshot, ttl=self.record_ttl)
+        except Exception as e:
+            log.warning("⚠️ 任务记录写入共享缓存失败", job_id=snapshot["id"], error=repr(e))
+
+    def get(self, job_id):
+        """ 查询单个任务记录（本进程没有时查共享缓存，任务可能由其他 worker 进程接收） """
+        with self.lock:
+            record = self.jobs.get(job_id)
+            if record:
+                return dict(record)
+        return self.shared.get(f"job:{job_id}") if self.shared is not None else None
+
+    def stats(self):
+        """ 队列深度、并发情况与平均耗时 """
+        with self.lock:
+            done = self.counters["succeeded"] + self.counters["failed"]
+            return {
+                "queue_depth": self.queue.qsize(),
+                "queue_capacity": self.queue.maxsize,
+                "workers": self.workers,
+                "running": self.running,
+                "counters": dict(self.counters),
+                "avg_queue_ms": round(self.total_queue_ms / done, 1) if done else None,
+                "avg_run_ms": round(self.total_run_ms / done, 1) if done else None,
+                "recent": [dict(r) for r in list(self.jobs.values())[-20:]],
+            }
+
+
+class Coalescer:
+    """
+    按 key（如 A 页面 ID）合并短时间内连续到达的事件：
+      - 某个 key 的第一个事件到达后开始计时，window 秒内没有新事件才真正提交
+      - 窗口内的新事件通过 merge(旧 payload, 新 payload) 合并，并重新计时
+      - 从第一个事件起最多等待 max_wait 秒，避免持续编辑时一直不处理
+      - 新 key 到达时先确认任务队列为所有等待中的 key 都留有位置、且等待中的 key 不超过 max_pending，
+        否则直接拒绝（add 返回 None），不会在返回 202 之后才因为队列已满而丢弃事件
+      - 所有 key 共用一个调度线程（按到期时间排序的堆），不为每个 key 单独启动计时器
+      - 到期时队列仍然已满（被其他来源占满）则稍后重试，超过 retry_for 秒才放弃
+      - 传入 shared（SharedCache）时跨 worker 进程合并：第一个收到某 key 事件的进程在共享缓存中登记为合并者，
+        其他进程收到的同一 key 事件并入共享记录（不在本进程排队），合并者到期时一并取出处理
+    同一窗口内的所有事件（包括其他 worker 收到的）共享同一个 job_id；等待重试期间该 key 又开始了新的窗口时，
+    旧任务并入新任务，其记录的 status 为 "merged"，merged_into 为新任务的 job_id。
+    """
+
+    def __init__(self, jobs, merge, window=2.0, max_wait=10.0, max_pending=1000, retry_for=60.0, shared=None):
+        self.jobs = jobs
+        self.merge = merge
+        self.window = window
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self.retry_for = retry_for
+        self.shared = shared
+        self.token = uuid.uuid4().hex  # 本进程在共享记录中的合并者标识
+        self.pending = {}   # key -> {"job_id", "payload", "first_at", "due"}
+        self.schedule = []  # 堆：(到期时间, 序号, key)；key 重新计时后旧的条目在弹出时跳过
+        self.seq = itertools.count()
+        self.lock = threading.Condition()
+        self.thread = None
+        self.counters = {"received": 0, "coalesced": 0, "processed": 0, "rejected": 0, "retried": 0, "dropped": 0,
+                         "joined_remote": 0, "merged_remote": 0}
+
+    def add(self, key, payload, **meta):
+        """ 接收一个事件，返回其所属任务的 job_id；队列或等待表已满时返回 None（调用方应返回 503） """
+        if self.window <= 0:
+            job_id = self.jobs.submit(payload, **meta)
+            with self.lock:
+                self.counters["received"] += 1
+                self.counters["processed" if job_id else "rejected"] += 1
+            return job_id
+
+        with self.lock:
+            self.counters["received"] += 1
+            entry = self.pending.get(key)
+            now = time.monotonic()
+            if entry is None:
+                has_room = len(self.pending) < self.max_pending and self.jobs.has_capacity(reserved=len(self.pending))
+                job_id, joined = self._claim(key, payload, has_room)
+                if joined:
+                    self.counters["joined_remote"] += 1
+                    return job_id
+                if not has_room:
+                    self.counters["rejected"] += 1
+                    log.error("❌ 事件合并等待表或任务队列已满，拒绝新事件", key=key, waiting=len(self.pending))
+                    return None
+                entry = {"job_id": self.jobs.reserve(job_id=job_id, **meta), "payload": payload, "first_at": now}
+                self.pending[key] = entry
+            else:
+                entry["payload"] = self.merge(entry["payload"], payload)
+                self.counters["coalesced"] += 1
+            self._schedule(key, entry, now + min(self.window, max(self.max_wait - (now - entry["first_at"]), 0)))
+        self.start()
+        return entry["job_id"]
+
+    def _claim(self, key, payload, has_room):
+        """
+        在共享缓存中查找同一 key 的合并者（调用方持有 self.lock）。返回 (job_id, 是否已并入其他进程)：
+          - 其他进程正在合并该 key：事件并入其共享记录，返回它的 job_id
+          - 否则本进程有空位时登记为合并者，返回新生成的 job_id；没有空位时不登记
+        """
+        job_id = uuid.uuid4().hex
+        if self.shared is None:
+            return job_id, False
+        result = {}
+
+        def claim(record):
+            if record is not None and record["owner"] != self.token:
+                record["payload"] = payload if record["payload"] is None else self.merge(record["payload"], payload)
+                result["joined"] = record["job_id"]
+                return record
+            return {"owner": self.token, "job_id": job_id, "payload": None} if has_room else record
+
+        try:
+            # 合并者异常退出时，共享记录在 max_wait + retry_for 之后过期，由下一个收到事件的进程接手
+            self.shared.update(f"coalesce:{key}", claim, ttl=self._record_ttl())
+        except Exception as e:
+            log.warning("⚠️ 共享事件合并记录读写失败，只在本进程合并", key=key, error=repr(e))
+            return job_id, False
+        if "joined" in result:
+            return result["joined"], True
+        return job_id, False
+
+    def _take_remote(self, key, entry):
+        """ 取出其他进程并入的事件并删除共享记录，此后同一 key 的新事件会重新登记合并者 """
+        if self.shared is None:
+            return
+        taken = {}
+
+        def take(record):
+            if record is None or record["owner"] != self.token:
+                return record
+            taken["payload"] = record["payload"]
+            return None
+
+        try:
+            # 其他合并者的记录原样写回，保留过期时间（否则会变成永不过期）
+            self.shared.update(f"coalesce:{key}", take, ttl=self._record_ttl())
+        except Exception as e:
+            log.warning("⚠️ 共享事件合并记录读写失败", key=key, error=repr(e))
+            return
+        if taken.get("payload") is not None:
+            entry["payload"] = self.merge(entry["payload"], taken["payload"])
+            with self.lock:
+                self.counters["merged_remote"] += 1
+
+    def _record_ttl(self):
+        return self.max_wait + self.retry_for + 60
+
+    def start(self):
+        """ 启动调度线程（首次 add 时自动调用） """
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._scheduler, name="daom-coalescer", daemon=True)
+                self.thread.start()
+
+    def _schedule(self, key, entry, due):
+        # 调用方持有 self.lock
+        entry["due"] = due
+        heapq.heappush(self.schedule, (due, next(self.seq), key))
+        self.lock.notify()
+
+    def _scheduler(self):
+        while True:
+            with self.lock:
+                while True:
+                    # 跳过已重新计时或已处理的旧条目
+                    while self.schedule:
+                        due, _, key = self.schedule[0]
+                        entry = self.pending.get(key)
+                        if entry is not None and entry["due"] == due:
+                            break
+                        heapq.heappop(self.schedule)
+                    now = time.monotonic()
+                    if self.schedule and self.schedule[0][0] <= now:
+                        _, _, key = heapq.heappop(self.schedule)
+                        entry = self.pending.pop(key)
+                        break
+                    self.lock.wait(self.schedule[0][0] - now if self.schedule else None)
+            self._fire(key, entry)
+
+    def _fire(self, key, entry):
+        self._take_remote(key, entry)
+        if self.jobs.enqueue(entry["job_id"], entry["payload"]):
+            with self.lock:
+                self.counters["processed"] += 1
+            return
+        with self.lock:
+            now = time.monotonic()
+            if now - entry["first_at"] >= self.retry_for:
+                self.counters["dropped"] += 1
+                log.error("❌ 任务队列持续已满，放弃合并后的事件", key=key, job_id=entry["job_id"])
+                return
+            self.counters["retried"] += 1
+            current = self.pending.get(key)
+            if current is not None:
+                # 等待重试期间同一 key 又收到了新事件：并入新的任务一起处理
+                current["payload"] = self.merge(entry["payload"], current["payload"])
+            else:
+                self.pending[key] = entry
+                self._schedule(key, entry, now + max(self.window, 1.0))
+        # enqueue 失败时任务记录已被标记为 rejected，而事件仍会处理：改为等待重试，或指向合并后的任务
+        if current is not None:
+            self.jobs.mark(entry["job_id"], status="merged", merged_into=current["job_id"])
+            log.warning("⚠️ 任务队列已满，事件并入同一 key 的新任务", key=key, job_id=entry["job_id"],
+                        merged_into=current["job_id"])
+            return
+        self.jobs.mark(entry["job_id"], status="retrying")
+        log.warning("⚠️ 任务队列已满，稍后重试合并后的事件", key=key, job_id=entry["job_id"])
+
+    def stats(self):
+        with self.lock:
+            return {
+                "window": self.window,
+                "max_wait": self.max_wait,
+                "max_pending": self.max_pending,
+                "waiting": len(self.pending),
+                "counters": dict(self.counters),
+            }
@@ -0,0 +1,117 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+LOG_LEVEL = os.environ.get("DAOM_LOG_LEVEL", "INFO").upper()  # DEBUG 时才会生成 payload / block 的完整内容
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+ROOT_LOGGER = "daom"
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class Lazy:
+    """ 延迟求值的字段：只有日志真正输出时才调用 fn()，如 Lazy(json.dumps, payload) """
+
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self):
+        return str(self.fn(*self.args))
+
+def lazy_json(obj):
+    """ 单行 JSON，仅在日志级别启用时序列化 """
+    return Lazy(_compact_json, obj)
+
+def _compact_json(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class Record:
+    """ 一条 "事件 key=value ..." 单行日志；格式化推迟到 logging 调用 str() 时 """
+
+    __slots__ = ("event", "fields")
+
+    def __init__(self, event, fields):
+        self.event = event
+        self.fields = fields
+
+    def __str__(self):
+        parts = [self.event]
+        for key, value in self.fields.items():
+            parts.append(f"{key}={format_value(value)}")
+        return " ".join(parts)
+
+def format_value(value):
+    if isinstance(value, (bool, int, float)) or value is None:
+        return json.dumps(value)
+    text = str(value)
+    if not text or any(c in text for c in " \t\n\r\"="):
+        return json.dumps(text, ensure_ascii=False)
+    return text
+
+
+class StructLogger:
+    """
+    结构化日志：log.info("✅ 成功同步", page_id=..., blocks=3)
+    输出为单行 "✅ 成功同步 page_id=... blocks=3"。
+      - 级别未启用时直接返回，不构造消息，字段中的 Lazy 也不会求值
+      - 所有记录经 QueueHandler 放入内存队列，由后台线程写出，不阻塞调用方
+    """
+
+    def __init__(self, name):
+        setup_logging()
+        self.logger = logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+    def enabled(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, event, exc_info=None, **fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, Record(event, fields), exc_info=exc_info, stacklevel=3)
+
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+
+def setup_logging(level=None):
+    """ 为 daom.* 日志挂上 QueueHandler + 后台 QueueListener（只初始化一次） """
+    global _listener
+    with _setup_lock:
+        root = logging.getLogger(ROOT_LOGGER)
+        if _listener is None:
+            records = queue.SimpleQueue()
+            stream = logging.StreamHandler(sys.stdout)
+            stream.setFormatter(logging.Formatter(LOG_FORMAT))
+            _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+            _listener.start()
+            atexit.register(_listener.stop)  # 退出前写完队列中剩余的日志
+            root.addHandler(logging.handlers.QueueHandler(records))
+            root.propagate = False
+            root.setLevel(LOG_LEVEL)
+        if level is not None:
+            root.setLevel(level.upper() if isinstance(level, str) else level)
+
+def set_level(level):
+    """ 运行时调整 daom.* 的日志级别，如 set_level("DEBUG") """
+    setup_logging(level)
+
+def get_logger(name):
+    return StructLogger(name)
@@ -0,0 +1,245 @@
+import functools
+import os
+import threading
+import time
+
+from Daom_Log import get_logger
+
+log = get_logger("metrics")
+
+# 单次 Notion 请求的耗时分桶（秒）
+REQUEST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 限速器排队等待的分桶（秒）
+WAIT_BUCKETS = (0.001, 0.01, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 30.0)
+# 整体操作（webhook 处理、数据库复制）的耗时分桶（秒）
+OPERATION_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+
+
+class Histogram:
+    """ 累积分桶直方图（Prometheus 语义：le 为上界，含 +Inf） """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_json(self):
+        return {"counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+    @classmethod
+    def from_json(cls, buckets, data):
+        hist = cls(buckets)
+        hist.counts, hist.sum, hist.count = list(data["counts"]), data["sum"], data["count"]
+        return hist
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+    """
+    进程内指标，按 Prometheus 文本格式输出：
+      - observe_request()：每个接口模板的请求数、错误数、429 次数与耗时直方图（由 Daom_Client 调用）
+      - observe_wait()：在共享令牌桶上排队等待的时间，反映离限速还有多远
+      - timed(name)：装饰器，记录整体操作（如 notion_webhook、copy_database）的耗时与异常数
+      - gauge(name, help, fn)：注册回调型指标，render() 时调用 fn() 取值（返回数字或 {标签元组: 数字}）
+      - snapshot() / render(snapshots)：多 worker 部署时各进程把快照写入共享存储，
+        任一进程汇总全部快照后输出（计数与直方图相加，回调型指标按 merge 相加或取最大值）
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}    # endpoint -> {"count", "errors", "throttled", "latency"}
+        self.wait = Histogram(WAIT_BUCKETS)
+        self.operations = {}  # name -> {"count", "errors", "latency"}
+        self.gauges = []      # (name, type, help, label 名, fn, merge)
+
+    def observe_request(self, endpoint, status, seconds):
+        """ status 为 None 表示网络错误或超时 """
+        with self.lock:
+            entry = self.requests.get(endpoint)
+            if entry is None:
+                entry = self.requests[endpoint] = {"count": 0, "errors": 0, "throttled": 0,
+                                                   "latency": Histogram(REQUEST_BUCKETS)}
+            entry["count"] += 1
+            if status is None or status >= 400:
+                entry["errors"] += 1
+            if status == 429:
+                entry["throttled"] += 1
+            entry["latency"].observe(seconds)
+
+    def observe_wait(self, seconds):
+        with self.lock:
+            self.wait.observe(seconds)
+
+    def observe_operation(self, name, seconds, ok=True):
+        with self.lock:
+            entry = self.operations.get(name)
+            if entry is None:
+                entry = self.operations[name] = {"count": 0, "errors": 0, "latency": Histogram(OPERATION_BUCKETS)}
+            entry["count"] += 1
+            if not ok:
+                entry["errors"] += 1
+            entry["latency"].observe(seconds)
+
+    def timed(self, name):
+        """ 装饰器：记录函数的端到端耗时，抛出异常时计为错误 """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                ok = False
+                try:
+                    result = fn(*args, **kwargs)
+                    ok = True
+                    return result
+                finally:
+                    self.observe_operation(name, time.perf_counter() - started, ok)
+            return wrapper
+        return decorator
+
+    def gauge(self, name, help_text, fn, labels=(), kind="gauge", merge="sum"):
+        """ merge：汇总多个进程的快照时如何合并同一标签的取值（"sum" 或 "max"） """
+        with self.lock:
+            self.gauges = [g for g in self.gauges if g[0] != name] + [(name, kind, help_text, labels, fn, merge)]
+
+    def snapshot(self):
+        """ 当前进程的全部指标（回调型指标在此时取值），可 JSON 序列化 """
+        with self.lock:
+            snap = {
+                "wait": self.wait.to_json(),
+                "requests": {e: dict(v, latency=v["latency"].to_json()) for e, v in self.requests.items()},
+                "operations": {n: dict(v, latency=v["latency"].to_json()) for n, v in self.operations.items()},
+            }
+            gauges = list(self.gauges)
+        snap["gauges"] = []
+        for name, kind, help_text, labels, fn, merge in gauges:
+            try:
+                value = fn()
+            except Exception as e:
+                log.error("❌ 指标取值失败", metric=name, error=repr(e))
+                continue
+            samples = value if isinstance(value, dict) else {(): value}
+            snap["gauges"].append([name, kind, help_text, list(labels), merge,
+                                   [[list(k), v] for k, v in samples.items()]])
+        return snap
+
+    def render(self, snapshots=None):
+        """ 输出 Prometheus text exposition format（0.0.4）；传入 snapshots 时输出它们的汇总 """
+        snap = merge_snapshots(snapshots) if snapshots is not None else self.snapshot()
+        wait = Histogram.from_json(WAIT_BUCKETS, snap["wait"])
+        requests = {e: dict(v, latency=Histogram.from_json(REQUEST_BUCKETS, v["latency"]))
+                    for e, v in snap["requests"].items()}
+        operations = {n: dict(v, latency=Histogram.from_json(OPERATION_BUCKETS, v["latency"]))
+                      for n, v in snap["operations"].items()}
+
+        lines = []
+        self._render_histogram(lines, "daom_rate_limiter_wait_seconds", "在共享令牌桶上等待的时间", {(): wait}, ())
+
+        self._render_counter(lines, "daom_notion_requests_total", "Notion 请求数（每次重试单独计数）",
+                             {(e,): v["count"] for e, v in requests.items()}, ("endpoint",))
+        self._render_counter(lines, "daom_notion_request_errors_total", "返回 4xx / 5xx 或网络错误的请求数",
+                             {(e,): v["errors"] for e, v in requests.items()}, ("endpoint",))
+        self._render_counter(lines, "daom_notion_throttled_total", "返回 429 的请求数",
+                             {(e,): v["throttled"] for e, v in requests.items()}, ("endpoint",))
+        self._render_histogram(lines, "daom_notion_request_duration_seconds", "单次 Notion 请求耗时",
+                               {(e,): v["latency"] for e, v in requests.items()}, ("endpoint",))
+
+        self._render_counter(lines, "daom_operation_total", "整体操作次数",
+                             {(n,): v["count"] for n, v in operations.items()}, ("operation",))
+        self._render_counter(lines, "daom_operation_errors_total", "以异常结束的整体操作次数",
+                             {(n,): v["errors"] for n, v in operations.items()}, ("operation",))
+        self._render_histogram(lines, "daom_operation_duration_seconds", "整体操作端到端耗时",
+                               {(n,): v["latency"] for n, v in operations.items()}, ("operation",))
+
+        for name, kind, help_text, labels, merge, samples in snap["gauges"]:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for label_values, sample in samples:
+                lines.append(f"{name}{format_labels(tuple(labels), tuple(label_values))} {format_value(sample)}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_counter(lines, name, help_text, samples, labels):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for label_values, value in sorted(samples.items()):
+            lines.append(f"{name}{format_labels(labels, label_values)} {format_value(value)}")
+
+    @staticmethod
+    def _render_histogram(lines, name, help_text, histograms, labels):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for label_values, hist in sorted(histograms.items()):
+            for bound, total in hist.cumulative():
+                le = bound if bound == "+Inf" else format_value(bound)
+                lines.append(f"{name}_bucket{format_labels(labels + ('le',), label_values + (le,))} {total}")
+            lines.append(f"{name}_sum{format_labels(labels, label_values)} {format_value(hist.sum)}")
+            lines.append(f"{name}_count{format_labels(labels, label_values)} {hist.count}")
+
+    def write(self, path):
+        """ 写入文本文件（供 node_exporter textfile collector 采集，适用于一次性运行的脚本） """
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+def merge_snapshots(snapshots):
+    """ 汇总多个进程的 Metrics.snapshot()：计数与直方图相加，回调型指标按各自的 merge 方式合并 """
+    merged = {"wait": Histogram(WAIT_BUCKETS).to_json(), "requests": {}, "operations": {}}
+    gauges = {}  # name -> [name, kind, help, labels, merge, {标签元组: 取值}]
+    for snap in snapshots:
+        merged["wait"] = add_histograms(merged["wait"], snap["wait"])
+        for section in ("requests", "operations"):
+            for key, value in snap[section].items():
+                entry = merged[section].get(key)
+                merged[section][key] = value if entry is None else {
+                    k: add_histograms(entry[k], v) if k == "latency" else entry[k] + v for k, v in value.items()}
+        for name, kind, help_text, labels, merge, samples in snap["gauges"]:
+            values = gauges.setdefault(name, [name, kind, help_text, labels, merge, {}])[5]
+            for label_values, value in samples:
+                key = tuple(label_values)
+                if key not in values:
+                    values[key] = value
+                else:
+                    values[key] = max(values[key], value) if merge == "max" else values[key] + value
+    merged["gauges"] = [g[:5] + [[[list(k), v] for k, v in g[5].items()]] for g in gauges.values()]
+    return merged
+
+def add_histograms(a, b):
+    return {"counts": [x + y for x, y in zip(a["counts"], b["counts"])], "sum": a["sum"] + b["sum"],
+            "count": a["count"] + b["count"]}
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+def format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+metrics = Metrics()
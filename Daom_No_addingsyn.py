@@ -1,12 +1,13 @@
 # 不添加同步块
 
 from flask import Flask, request, jsonify
-import requests
-import json
-import time
+import logging
+import Daom_Client as notion
+from Daom_Log import get_logger, lazy_json
 
 # 初始化 Flask 服务器
 app = Flask(__name__)
+log = get_logger("daom_no_addingsyn")
 
 # Notion API 配置
 NOTION_API_KEY = "API KEY"
@@ -28,12 +29,13 @@ def notion_webhook():
     - 将该同步块复制到每个 B 页面（使用原始同步块作为源，如果已在同步中）
     """
     data = request.json
-    print(f"✅ 收到 Notion Webhook 请求: {json.dumps(data, indent=2)}")
+    log.info("✅ 收到 Notion Webhook 请求")
+    log.debug("🔍 Webhook payload", payload=lazy_json(data))
 
     # 获取 A 页面 ID（触发页面）
     source_page_id = data.get("data", {}).get("id")
     if not source_page_id:
-        print("❌ 未能获取 A 页面 ID")
+        log.error("❌ 未能获取 A 页面 ID")
         return jsonify({"error": "未找到触发页面 ID"}), 400
 
     # 从 Webhook 数据中直接获取 Fiarybase 关联的 B 页面 ID
@@ -41,18 +43,17 @@ def notion_webhook():
     if not related_page_ids:
         return jsonify({"error": "未找到关联的 B 页面"}), 400
 
-    print(f"✅ A 页面 ID: {source_page_id}")
-    print(f"✅ 直接从 Webhook 解析关联页面 ID: {related_page_ids}")
+    log.info("✅ 直接从 Webhook 解析关联页面", page_id=source_page_id, related=lazy_json(related_page_ids))
 
     # 在 A 页面中查找 %Fiary 标记后的同步块
     sync_block_id = find_synced_block_after_marker(source_page_id)
     if not sync_block_id:
-        print(f"⚠️ A 页面 {source_page_id} 没有 `%Fiary` 后的同步块")
+        log.warning("⚠️ A 页面没有 %Fiary 后的同步块", page_id=source_page_id)
         return jsonify({"error": "未找到同步块"}), 400
 
     # 将 A 页面的该同步块复制到每个 B 页面
     for target_page_id in related_page_ids:
-        print(f"🚀 将 A 页面同步块 {sync_block_id} 复制到 B 页面 {target_page_id}")
+        log.info("🚀 将 A 页面同步块复制到 B 页面", block_id=sync_block_id, page_id=target_page_id)
         copy_synced_block_content(sync_block_id, target_page_id)
 
     return jsonify({"status": "success"})
@@ -66,35 +67,29 @@ def get_related_page_ids(webhook_data):
         related_page_ids = [r["id"] for r in relation_list]
         return related_page_ids
     else:
-        print("⚠️ Webhook 数据中 `Fiarybase` 为空")
+        log.warning("⚠️ Webhook 数据中的 relation 为空", property=RELATION_PROPERTY_NAME)
         return None
 
-def get_page_content_with_debug(page_id, retries=3, delay=2):
-    """ 获取页面 Blocks，并打印调试信息 """
+def get_page_content_with_debug(page_id):
+    """ 获取页面 Blocks，并打印调试信息（404 交给统一重试策略处理） """
     url = f"https://api.notion.com/v1/blocks/{page_id}/children"
-    for attempt in range(retries):
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            blocks = response.json().get("results", [])
-            print(f"✅ 成功获取页面 {page_id} 的 Blocks，共 {len(blocks)} 个")
-            for idx, block in enumerate(blocks):
-                print(f"🔍 Block {idx+1}: {json.dumps(block, indent=2, ensure_ascii=False)}\n")
-            return blocks
-        elif response.status_code == 404:
-            print(f"⚠️ 第 {attempt+1}/{retries} 次尝试：页面 {page_id} 未找到，等待 {delay} 秒后重试...")
-            time.sleep(delay)
-        else:
-            print(f"❌ 获取页面 {page_id} 内容失败: {response.text}")
-            return None
-    print(f"❌ 页面 {page_id} 达到最大重试次数，无法获取 Blocks")
-    return None
+    response = notion.get(url, headers=headers, retry_statuses={404})
+    if response.status_code != 200:
+        log.error("❌ 获取页面内容失败", page_id=page_id, status=response.status_code, body=response.text)
+        return None
+    blocks = response.json().get("results", [])
+    log.info("✅ 成功获取页面的 Blocks", page_id=page_id, blocks=len(blocks))
+    if log.enabled(logging.DEBUG):
+        for idx, block in enumerate(blocks):
+            log.debug("🔍 Block", page_id=page_id, index=idx + 1, block=lazy_json(block))
+    return blocks
 
 def find_synced_block_after_marker(source_page_id):
     """ 在 A 页面查找 `%Fiary` 标记后的同步块 """
-    print(f"🔍 获取 A 页面 {source_page_id} 的 Blocks...")
+    log.debug("🔍 获取 A 页面的 Blocks", page_id=source_page_id)
     blocks = get_page_content_with_debug(source_page_id)
     if not blocks:
-        print(f"❌ 无法获取 A 页面 {source_page_id} 的 Block 数据")
+        log.error("❌ 无法获取 A 页面的 Block 数据", page_id=source_page_id)
         return None
 
     found_marker = False
@@ -103,12 +98,12 @@ def find_synced_block_after_marker(source_page_id):
         text_content = block.get(block_type, {}).get("rich_text", [])
         if text_content and text_content[0].get("text", {}).get("content") == FIARY_MARKER:
             found_marker = True
-            print(f"✅ 找到 `%Fiary` 标记 in {block_type}")
+            log.debug("✅ 找到 %Fiary 标记", block_type=block_type)
             continue  # 跳过标记块
         if found_marker and block_type == "synced_block":
-            print(f"✅ 找到标记后的同步块 ID: {block.get('id')}")
+            log.info("✅ 找到标记后的同步块", page_id=source_page_id, block_id=block.get("id"))
             return block.get("id")
-    print(f"⚠️ A 页面 {source_page_id} 没有 `%Fiary` 后的同步块")
+    log.warning("⚠️ A 页面没有 %Fiary 后的同步块", page_id=source_page_id)
     return None
 
 def copy_synced_block_content(sync_block_id, target_page_id):
@@ -118,16 +113,16 @@ def copy_synced_block_content(sync_block_id, target_page_id):
     """
     # 先获取源同步块详情
     url = f"https://api.notion.com/v1/blocks/{sync_block_id}"
-    response = requests.get(url, headers=headers)
+    response = notion.get(url, headers=headers)
     if response.status_code != 200:
-        print(f"❌ 获取源同步块详情失败: {response.text}")
+        log.error("❌ 获取源同步块详情失败", block_id=sync_block_id, status=response.status_code, body=response.text)
         return
     source_block = response.json()
     # 如果源同步块已经在同步自其他块，则使用原始块 ID
     synced_info = source_block.get("synced_block", {})
     if synced_info.get("synced_from"):
         original_block_id = synced_info["synced_from"].get("block_id")
-        print(f"✅ 源同步块 {sync_block_id} 正在同步自原始块 {original_block_id}")
+        log.debug("✅ 源同步块同步自原始块", block_id=sync_block_id, original=original_block_id)
     else:
         original_block_id = sync_block_id
 
@@ -140,11 +135,11 @@ def copy_synced_block_content(sync_block_id, target_page_id):
         }
     }
     add_block_url = f"https://api.notion.com/v1/blocks/{target_page_id}/children"
-    response = requests.patch(add_block_url, json={"children": [new_sync_block]}, headers=headers)
+    response = notion.patch(add_block_url, json={"children": [new_sync_block]}, headers=headers)
     if response.status_code == 200:
-        print(f"✅ 成功同步 block 到 B 页面 {target_page_id}")
+        log.info("✅ 同步块已复制到 B 页面", page_id=target_page_id)
     else:
-        print(f"❌ 复制 block 失败: {response.text}")
+        log.error("❌ 同步块复制失败", page_id=target_page_id, status=response.status_code, body=response.text)
 
 def get_related_page_ids_from_notion(page_id):
     """
@@ -152,19 +147,19 @@ def get_related_page_ids_from_notion(page_id):
     （备用方案，如果 Webhook 数据不全则可调用）
     """
     url = f"https://api.notion.com/v1/pages/{page_id}"
-    response = requests.get(url, headers=headers)
+    response = notion.get(url, headers=headers)
     if response.status_code != 200:
-        print(f"❌ 获取 A 页面失败: {response.text}")
+        log.error("❌ 获取 A 页面失败", page_id=page_id, status=response.status_code, body=response.text)
         return None
     properties = response.json().get("properties", {})
     relation_property = properties.get(RELATION_PROPERTY_NAME, {})
     relation_list = relation_property.get("relation", [])
     if relation_list:
         related_page_ids = [r["id"] for r in relation_list]
-        print(f"✅ 从 Notion API 获取 `Fiarybase` 关联页面: {related_page_ids}")
+        log.info("✅ 从 Notion API 获取关联页面", page_id=page_id, property=RELATION_PROPERTY_NAME, pages=lazy_json(related_page_ids))
         return related_page_ids
     else:
-        print(f"⚠️ A 页面 {page_id} 没有关联的 B 页面")
+        log.warning("⚠️ A 页面没有关联的 B 页面", page_id=page_id)
         return None
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS page_map (
+    source_database_id TEXT NOT NULL,
+    target_database_id TEXT NOT NULL,
+    source_page_id TEXT NOT NULL,
+    target_page_id TEXT NOT NULL,
+    last_edited_time TEXT,
+    properties_hash TEXT,
+    PRIMARY KEY (source_database_id, target_database_id, source_page_id)
+);
+CREATE TABLE IF NOT EXISTS checkpoint (
+    source_database_id TEXT NOT NULL,
+    target_database_id TEXT NOT NULL,
+    last_edited_time TEXT NOT NULL,
+    run_started TEXT,
+    PRIMARY KEY (source_database_id, target_database_id)
+);
+"""
+
+
+class SyncStateStore:
+    """
+    增量同步的本地状态（SQLite 文件）：
+      - page_map：源页面 -> 目标页面 ID，以及上次同步时源页面的 last_edited_time 和已写入属性的哈希
+      - checkpoint：每对源/目标数据库已同步到的 last_edited_time，以及上次同步开始的时间（精确到分钟）
+    同一个实例可在多个线程中共享。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+            # 旧版本创建的状态文件没有 properties_hash 列
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(page_map)")]
+            if "properties_hash" not in columns:
+                self.conn.execute("ALTER TABLE page_map ADD COLUMN properties_hash TEXT")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(checkpoint)")]
+            if "run_started" not in columns:
+                self.conn.execute("ALTER TABLE checkpoint ADD COLUMN run_started TEXT")
+
+    def get_page(self, source_database_id, target_database_id, source_page_id):
+        """ 返回 (target_page_id, last_edited_time, properties_hash)，未同步过时返回 None """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT target_page_id, last_edited_time, properties_hash FROM page_map "
+                "WHERE source_database_id = ? AND target_database_id = ? AND source_page_id = ?",
+                (source_database_id, target_database_id, source_page_id),
+            ).fetchone()
+
+    def set_page(self, source_database_id, target_database_id, source_page_id, target_page_id, last_edited_time,
+                 properties_hash=None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO page_map (source_database_id, target_database_id, source_page_id, "
+                "target_page_id, last_edited_time, properties_hash) VALUES (?, ?, ?, ?, ?, ?)",
+                (source_database_id, target_database_id, source_page_id, target_page_id, last_edited_time,
+                 properties_hash),
+            )
+
+    def get_checkpoint(self, source_database_id, target_database_id):
+        return self._get_checkpoint_row(source_database_id, target_database_id)[0]
+
+    def get_run_started(self, source_database_id, target_database_id):
+        """ 上次同步开始的时间（精确到分钟），没有记录时返回 None """
+        return self._get_checkpoint_row(source_database_id, target_database_id)[1]
+
+    def _get_checkpoint_row(self, source_database_id, target_database_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT last_edited_time, run_started FROM checkpoint "
+                "WHERE source_database_id = ? AND target_database_id = ?",
+                (source_database_id, target_database_id),
+            ).fetchone()
+        return row or (None, None)
+
+    def set_checkpoint(self, source_database_id, target_database_id, last_edited_time, run_started=None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoint (source_database_id, target_database_id, last_edited_time, "
+                "run_started) VALUES (?, ?, ?, ?)",
+                (source_database_id, target_database_id, last_edited_time, run_started),
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class RefScanError(RuntimeError):
+    """ B 页面扫描失败，无法判断其中是否已有引用 """
+
+
+REFS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS synced_refs (
+    original_block_id TEXT NOT NULL,
+    target_page_id TEXT NOT NULL,
+    PRIMARY KEY (original_block_id, target_page_id)
+);
+CREATE TABLE IF NOT EXISTS scanned_pages (
+    target_page_id TEXT PRIMARY KEY
+);
+"""
+
+
+class SyncedRefIndex:
+    """
+    同步块引用索引（SQLite 文件）：原始同步块 ID -> 已经引用它的 B 页面集合。
+      - 某个 B 页面第一次被查询时，调用 scan(page_id) 读取其中已有的同步块引用并入库
+      - 之后的查询只查本地索引，不再请求 Notion
+      - lock(page_id) 返回该 B 页面专用的锁，避免并发任务重复写入同一页面（只在本进程内有效）
+    文件使用 WAL 模式，多个 worker 进程可以共享同一个索引文件。
+    """
+
+    def __init__(self, path, scan):
+        self.path = path
+        self.scan = scan  # scan(page_id) -> 该页面中同步块引用的原始块 ID 列表；失败时返回 None
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self.db_lock = threading.Lock()
+        self.page_locks = {}
+        with self.db_lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            with self.conn:
+                self.conn.executescript(REFS_SCHEMA)
+
+    def lock(self, target_page_id):
+        with self.db_lock:
+            return self.page_locks.setdefault(target_page_id, threading.Lock())
+
+    def _ensure_scanned(self, target_page_id):
+        with self.db_lock:
+            scanned = self.conn.execute(
+                "SELECT 1 FROM scanned_pages WHERE target_page_id = ?", (target_page_id,)
+            ).fetchone()
+        if scanned:
+            return True
+        originals = self.scan(target_page_id)
+        if originals is None:
+            return False
+        with self.db_lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO synced_refs VALUES (?, ?)",
+                [(original, target_page_id) for original in originals],
+            )
+            self.conn.execute("INSERT OR IGNORE INTO scanned_pages VALUES (?)", (target_page_id,))
+        return True
+
+    def has_reference(self, original_block_id, target_page_id):
+        """ B 页面中是否已经存在引用该原始块的同步块；页面扫描失败时抛出 RefScanError（不能当作“没有引用”） """
+        if not self._ensure_scanned(target_page_id):
+            raise RefScanError(f"无法扫描 B 页面 {target_page_id}")
+        with self.db_lock:
+            return self.conn.execute(
+                "SELECT 1 FROM synced_refs WHERE original_block_id = ? AND target_page_id = ?",
+                (original_block_id, target_page_id),
+            ).fetchone() is not None
+
+    def add(self, original_block_id, target_page_id):
+        with self.db_lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO synced_refs VALUES (?, ?)", (original_block_id, target_page_id))
+
+    def forget_page(self, target_page_id):
+        """ 丢弃某个 B 页面的索引，下次查询时重新扫描（页面被手动修改后使用） """
+        with self.db_lock, self.conn:
+            self.conn.execute("DELETE FROM synced_refs WHERE target_page_id = ?", (target_page_id,))
+            self.conn.execute("DELETE FROM scanned_pages WHERE target_page_id = ?", (target_page_id,))
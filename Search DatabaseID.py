@@ -1,4 +1,6 @@
-import requests
+import sys
+
+from Daom_Index import INDEX_FILE, WorkspaceIndex
 
 # 你的 Notion API Token
 NOTION_API_KEY = "YOUR API KEY"
@@ -10,24 +12,30 @@ headers = {
     "Notion-Version": "2022-06-28"
 }
 
-def get_all_databases():
-    """ 搜索 Notion 工作区中的所有数据库，并返回数据库名称和 ID """
-    url = "https://api.notion.com/v1/search"
-    data = {
-        "query": "",
-        "filter": {"value": "database", "property": "object"},
-        "sort": {"direction": "descending", "timestamp": "last_edited_time"}
-    }
-    response = requests.post(url, headers=headers, json=data)
+FULL_REFRESH = False  # True 时完整重建本地索引（同时清理已删除的数据库 / 页面）
+
+def get_all_databases(index):
+    """ 打印本地索引中所有数据库的名称和 ID（最近编辑的在前） """
+    for db in index.databases():
+        print(f"📁 数据库名称: {db['name'] or '无标题'} | 🆔 ID: {db['id']}")
 
-    if response.status_code == 200:
-        databases = response.json().get("results", [])
-        for db in databases:
-            db_id = db["id"]
-            db_name = db["title"][0]["text"]["content"] if db["title"] else "无标题"
-            print(f"📁 数据库名称: {db_name} | 🆔 ID: {db_id}")
-    else:
-        print(f"❌ 获取数据库列表失败: {response.text}")
+def lookup(index, name):
+    """ 按名称查找数据库 / 页面 ID：先精确匹配，找不到时给出相近的名称 """
+    matches = index.find(name)
+    if matches:
+        for m in matches:
+            print(f"✅ {m['object']} {m['name']} | 🆔 ID: {m['id']}")
+        return
+    print(f"⚠️ 没有名称为 {name} 的数据库或页面，相近的有：")
+    for m in index.fuzzy(name):
+        print(f"🔍 {m['object']} {m['name']} | 🆔 ID: {m['id']}")
 
-# 运行获取所有数据库 ID
-get_all_databases()
+# 增量刷新本地索引（只拉取上次运行后有改动的对象），然后从本地查询
+# 用法：python "Search DatabaseID.py" [名称]
+index = WorkspaceIndex(INDEX_FILE)
+index.refresh(headers, full=FULL_REFRESH)
+if len(sys.argv) > 1:
+    lookup(index, " ".join(sys.argv[1:]))
+else:
+    get_all_databases(index)
+index.close()
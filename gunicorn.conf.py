@@ -0,0 +1,27 @@
+"""
+gunicorn 配置：gunicorn -c gunicorn.conf.py wsgi:app
+可通过环境变量覆盖：DAOM_BIND、DAOM_WORKERS、DAOM_THREADS。
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("DAOM_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("DAOM_WORKERS", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("DAOM_THREADS", 4))  # Webhook 入口只做校验和入队，少量线程即可
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+# 不使用 preload_app：Daom3 在导入时打开 SQLite 连接和 HTTP 连接池，必须在 fork 之后于各 worker 中创建
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_worker_init(worker):
+    # Notion 的限速按 integration 计算，每个 worker 只分到总额度的 1/workers
+    import Daom_Client as notion
+    notion.configure(rate=notion.RATE_LIMIT / workers, burst=max(notion.RATE_BURST // workers, 1))
+    worker.log.info("Notion 客户端限速: %.2f 次/秒", notion.RATE_LIMIT / workers)
@@ -0,0 +1,13 @@
+"""
+WSGI 入口，供多 worker 的 pre-fork 服务器加载：
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+每个 worker 进程各自导入 Daom3，拥有独立的后台任务队列与连接池；
+Button Mapping、marker 索引、同步块原始块、relation 列表与任务记录通过 Daom3.SHARED_CACHE_FILE 在进程间共享。
+同一 A 页面的事件跨 worker 合并（由第一个收到事件的 worker 处理），B 页面的写入由跨进程租约互斥；
+/metrics 与 /jobs 汇总所有 worker 发布到共享缓存的统计，抓取任意一个 worker 即可。
+"""
+from Daom3 import create_app
+
+app = create_app()